@@ -0,0 +1,116 @@
+from benchmarks.benchmark_checkpointing import measure_peak_memory, measure_saved_activations
+from benchmarks.common import get_benchmark_general_args, time_function
+from models.autoencoder import AutoEncoder
+from torch.nn import functional as F
+from layers.stft import STFTEngine
+import argparse
+import torch
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the benchmark of the auto-encoder training step.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Compares the throughput of the auto-encoder training step with one '
+                                                 'pass per stream (input and target) to a single dual-stream pass.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Number of samples per stream and batch.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
+    parser.add_argument('--n_repeat', default=10, type=int, help='Number of measured steps per setting.')
+    args = parser.parse_args()
+    return args
+
+
+def get_separate_losses(autoencoder, spectrogram, input_batch, target_batch):
+    """
+    Losses of the two-pass step, each stream being back-propagated on its own.
+    :param autoencoder: auto-encoder in training mode (nn.Module).
+    :param spectrogram: STFT engine (STFTEngine).
+    :param input_batch: batch of input data (torch tensor).
+    :param target_batch: batch of target data (torch tensor).
+    :return: time and frequency losses of the input stream followed by the ones of the target stream (list of floats).
+    """
+    losses = []
+    for data_batch in [input_batch, target_batch]:
+        generated_batch = autoencoder(data_batch)
+        time_l2_loss = F.mse_loss(generated_batch, data_batch)
+        freq_l2_loss = spectrogram.l2_loss(generated_batch, data_batch)
+        (time_l2_loss + freq_l2_loss).backward()
+        losses += [time_l2_loss.item(), freq_l2_loss.item()]
+    return losses
+
+
+def get_dual_stream_losses(autoencoder, spectrogram, input_batch, target_batch):
+    """
+    Losses of the dual-stream step, as computed by AutoEncoderTrainer.compute_dual_stream_losses.
+    :param autoencoder: auto-encoder in training mode (nn.Module).
+    :param spectrogram: STFT engine (STFTEngine).
+    :param input_batch: batch of input data (torch tensor).
+    :param target_batch: batch of target data (torch tensor).
+    :return: time and frequency losses of the input stream followed by the ones of the target stream (list of floats).
+    """
+    data_batch = torch.cat([input_batch, target_batch])
+    generated_batch = autoencoder(data_batch)
+    time_l2 = (generated_batch - data_batch).pow(2).flatten(start_dim=1).mean(dim=1)
+    generated_spectrograms, data_spectrograms = spectrogram.get_pair_spectrograms(
+        generated_batch, data_batch, resolutions=spectrogram.loss_resolutions)
+    losses = []
+    n_samples = input_batch.shape[0]
+    for stream in [slice(None, n_samples), slice(n_samples, None)]:
+        losses.append(time_l2[stream].mean())
+        losses.append(spectrogram.l2_loss_from_spectrograms(
+            {key: value[stream] for key, value in generated_spectrograms.items()},
+            {key: value[stream] for key, value in data_spectrograms.items()}))
+    sum(losses).backward()
+    return [loss.item() for loss in losses]
+
+
+def get_gradients(autoencoder):
+    """
+    :param autoencoder: auto-encoder whose parameters have gradients (nn.Module).
+    :return: flattened gradients of the parameters (torch tensor).
+    """
+    return torch.cat([p.grad.flatten() for p in autoencoder.parameters()])
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length)
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+
+    autoencoder = AutoEncoder(general_args, return_embedding=False).to(device).train()
+    spectrogram = STFTEngine(resolutions=[(n_fft, n_fft // 4) for n_fft in general_args.stft_n_ffts]).to(device)
+    input_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length, device=device)
+    target_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length, device=device)
+    steps = {'separate': get_separate_losses, 'dual-stream': get_dual_stream_losses}
+
+    # Both steps must give the same losses and gradients, the dropout is disabled as both steps draw different masks
+    losses, gradients = {}, {}
+    autoencoder.eval()
+    for name, step in steps.items():
+        autoencoder.zero_grad()
+        losses[name] = step(autoencoder, spectrogram, input_batch, target_batch)
+        gradients[name] = get_gradients(autoencoder)
+    autoencoder.train()
+    print('Largest difference between the losses: {:.3e}'.format(
+        max(abs(a - b) for a, b in zip(losses['separate'], losses['dual-stream']))))
+    print('Largest difference between the gradients: {:.3e}'.format(
+        (gradients['separate'] - gradients['dual-stream']).abs().max().item()))
+
+    # Activations kept at once by the largest forward pass of each step, the peak memory is only measured on GPU
+    stream_batches = {'separate': input_batch, 'dual-stream': torch.cat([input_batch, target_batch])}
+
+    print('{:>12} {:>10} {:>16} {:>16} {:>16}'.format('step', 'time [s]', 'samples / s', 'peak memory [MB]',
+                                                      'saved [MB]'))
+    for name, step in steps.items():
+        def run_step():
+            autoencoder.zero_grad()
+            step(autoencoder, spectrogram, input_batch, target_batch)
+        step_time = time_function(run_step, device, n_warmup=2, n_repeat=benchmark_args.n_repeat)
+        peak_memory = measure_peak_memory(run_step, device)
+        saved_activations = measure_saved_activations(
+            lambda: spectrogram.l2_loss(autoencoder(stream_batches[name]), stream_batches[name]),
+            autoencoder.parameters())
+        print('{:>12} {:>10.4f} {:>16.1f} {:>16} {:>16.1f}'.format(
+            name, step_time, 2 * benchmark_args.batch_size / step_time,
+            '-' if peak_memory is None else '{:.1f}'.format(peak_memory / 2 ** 20), saved_activations / 2 ** 20))
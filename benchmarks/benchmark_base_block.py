@@ -0,0 +1,75 @@
+from benchmarks.common import get_benchmark_general_args, get_generator_level_configs, time_function
+from blocks.base_block import BaseBlock
+import argparse
+import torch
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the benchmark of the multi-scale convolutions.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Compares the direct multi-scale convolutions of the generator blocks '
+                                                 'with another implementation.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Number of samples per batch.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
+    parser.add_argument('--n_repeat', default=10, type=int, help='Number of measured calls per configuration.')
+    parser.add_argument('--implementation', default='fft', choices=['fft', 'auto'], type=str,
+                        help='Implementation of the multi-scale convolutions to compare against "direct".')
+    args = parser.parse_args()
+    return args
+
+
+def benchmark_base_block(config, general_args, batch_size, implementation, device, n_repeat):
+    """
+    Times the forward and forward + backward passes of a BaseBlock with the direct implementation and with a given
+    implementation sharing the same state dict.
+    :param config: configuration of the block as returned by get_generator_level_configs (dictionary).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param batch_size: number of samples per batch (scalar int).
+    :param implementation: implementation to compare against 'direct' (string).
+    :param device: either 'cpu' or 'cuda' (string).
+    :param n_repeat: number of measured calls (scalar int).
+    :return: timings in seconds and maximal absolute difference of the outputs (dictionary).
+    """
+    blocks = {}
+    for name in ['direct', implementation]:
+        blocks[name] = BaseBlock(config['in_channels'], general_args.kernel_sizes, config['channel_sizes'],
+                                 config['bottleneck_channels'], general_args.generator_use_bottleneck,
+                                 conv_implementation=name).to(device)
+    blocks[implementation].load_state_dict(blocks['direct'].state_dict())
+    x = torch.randn(batch_size, config['in_channels'], config['width'], device=device)
+
+    results = {'name': config['name'], 'width': config['width'], 'in_channels': config['in_channels']}
+    with torch.no_grad():
+        results['max_abs_error'] = (blocks['direct'].forward_base(x) -
+                                    blocks[implementation].forward_base(x)).abs().max().item()
+    for name, block in blocks.items():
+        with torch.no_grad():
+            results['{}_forward'.format(name)] = time_function(lambda: block.forward_base(x), device,
+                                                               n_repeat=n_repeat)
+        results['{}_backward'.format(name)] = time_function(lambda: block.forward_base(x).sum().backward(), device,
+                                                            n_repeat=n_repeat)
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length)
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+    implementation = benchmark_args.implementation
+
+    print('{:<12} {:>6} {:>12} {:>12} {:>8} {:>12} {:>12} {:>8} {:>10}'.format(
+        'block', 'width', 'direct fw', implementation + ' fw', 'speedup', 'direct bw', implementation + ' bw',
+        'speedup', 'error'))
+    for config in get_generator_level_configs(general_args):
+        results = benchmark_base_block(config, general_args, benchmark_args.batch_size, implementation, device,
+                                       benchmark_args.n_repeat)
+        print('{:<12} {:>6} {:>12.6f} {:>12.6f} {:>8.2f} {:>12.6f} {:>12.6f} {:>8.2f} {:>10.2e}'.format(
+            results['name'], results['width'],
+            results['direct_forward'], results['{}_forward'.format(implementation)],
+            results['direct_forward'] / results['{}_forward'.format(implementation)],
+            results['direct_backward'], results['{}_backward'.format(implementation)],
+            results['direct_backward'] / results['{}_backward'.format(implementation)],
+            results['max_abs_error']))
@@ -0,0 +1,125 @@
+from benchmarks.common import get_benchmark_general_args, synchronize, time_function
+from models.discriminator import Discriminator
+from models.autoencoder import AutoEncoder
+from models.generator import Generator
+import argparse
+import torch
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the benchmark of activation checkpointing.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Measures the step time and the peak memory of a model for each number '
+                                                 'of checkpointed levels.')
+    parser.add_argument('--model', default='generator', choices=['generator', 'autoencoder', 'discriminator'],
+                        type=str, help='Model to benchmark.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Number of samples per batch.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
+    parser.add_argument('--n_repeat', default=5, type=int, help='Number of measured steps per setting.')
+    parser.add_argument('--levels', default=None, nargs='+', type=int,
+                        help='Numbers of checkpointed levels to benchmark, all of them by default.')
+    args = parser.parse_args()
+    return args
+
+
+def get_model(name, general_args):
+    """
+    :param name: either 'generator', 'autoencoder' or 'discriminator' (string).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :return: model in training mode (nn.Module).
+    """
+    if name == 'generator':
+        return Generator(general_args)
+    if name == 'autoencoder':
+        return AutoEncoder(general_args, return_embedding=False)
+    return Discriminator(general_args)
+
+
+def measure_peak_memory(function, device):
+    """
+    Measures the peak memory allocated by a function on top of the memory allocated before the call.
+    :param function: function without arguments.
+    :param device: either 'cpu' or 'cuda' (string).
+    :return: peak memory in bytes, None if the device is not a GPU (scalar int).
+    """
+    if not str(device).startswith('cuda'):
+        return None
+    synchronize(device)
+    baseline = torch.cuda.memory_allocated()
+    torch.cuda.reset_peak_memory_stats()
+    function()
+    synchronize(device)
+    return torch.cuda.max_memory_allocated() - baseline
+
+
+def measure_saved_activations(function, parameters=()):
+    """
+    Measures the memory of the tensors saved by a forward pass for the backward pass, on any device. It is the memory
+    reduced by activation checkpointing, the tensors sharing a storage are counted once.
+    :param function: function without arguments running a forward pass.
+    :param parameters: tensors excluded from the measure, e.g. the parameters of the model (iterable).
+    :return: memory of the saved tensors in bytes (scalar int).
+    """
+    excluded = set(p.untyped_storage().data_ptr() for p in parameters)
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in excluded:
+            storages[storage.data_ptr()] = storage.nbytes()
+
+        # A detached view shares the storage, the saved tensor itself would keep its graph alive through a cycle
+        return tensor.detach()
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        function()
+    return sum(storages.values())
+
+
+def benchmark_checkpointing(name, n_levels, general_args, batch_size, device, n_repeat):
+    """
+    Measures the time and the peak memory of a training step (forward and backward passes) of a model with a given
+    number of checkpointed levels.
+    :param name: either 'generator', 'autoencoder' or 'discriminator' (string).
+    :param n_levels: number of checkpointed levels (scalar int).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param batch_size: number of samples per batch (scalar int).
+    :param device: either 'cpu' or 'cuda' (string).
+    :param n_repeat: number of measured steps (scalar int).
+    :return: step time in seconds, peak memory in bytes (None if the device is not a GPU) and memory of the
+    activations saved for the backward pass in bytes (tuple).
+    """
+    setattr(general_args, '{}_checkpoint_levels'.format(name), n_levels)
+    model = get_model(name, general_args).to(device)
+    model.train()
+    x = torch.randn(batch_size, 1, general_args.window_length, device=device)
+
+    def step():
+        model.zero_grad()
+        model(x).sum().backward()
+
+    step_time = time_function(step, device, n_warmup=1, n_repeat=n_repeat)
+    peak_memory = measure_peak_memory(step, device)
+    saved_activations = measure_saved_activations(lambda: model(x).sum(), model.parameters())
+    return step_time, peak_memory, saved_activations
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length)
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+    if device == 'cpu':
+        print('The peak memory is only measured on GPU, the saved activations are measured on any device.')
+
+    print('{:>8} {:>12} {:>14} {:>14}'.format('levels', 'step [s]', 'peak [MiB]', 'saved [MiB]'))
+    n_blocks = getattr(general_args, '{}_n_block'.format(benchmark_args.model))
+    for n_levels in benchmark_args.levels or range(n_blocks + 1):
+        step_time, peak_memory, saved_activations = benchmark_checkpointing(
+            benchmark_args.model, n_levels, general_args, benchmark_args.batch_size, device, benchmark_args.n_repeat)
+        print('{:>8} {:>12.4f} {:>14} {:>14.1f}'.format(n_levels, step_time, 'n/a' if peak_memory is None else
+                                                        '{:.1f}'.format(peak_memory / 2 ** 20),
+                                                        saved_activations / 2 ** 20))
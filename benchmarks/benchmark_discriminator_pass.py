@@ -0,0 +1,91 @@
+from benchmarks.common import get_benchmark_general_args, time_function
+from models.discriminator import Discriminator
+from torch import autograd
+import argparse
+import torch
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the benchmark of the fused discriminator pass.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Compares the discriminator step with separate forward passes on the '
+                                                 'real, generated and interpolated batches to a single fused pass on '
+                                                 'the real and generated batches. The interpolated batch of the '
+                                                 'gradient penalty keeps its own pass in both settings.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Number of samples per batch.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
+    parser.add_argument('--n_repeat', default=10, type=int, help='Number of measured steps per setting.')
+    args = parser.parse_args()
+    return args
+
+
+def get_penalty(interpolation, interpolation_logits):
+    """
+    :param interpolation: interpolated batch (torch tensor).
+    :param interpolation_logits: discriminator's prediction for the interpolated batch (torch tensor).
+    :return: gradient penalty (torch tensor).
+    """
+    gradients = autograd.grad(outputs=interpolation_logits, inputs=interpolation,
+                              grad_outputs=torch.ones_like(interpolation_logits), create_graph=True)[0]
+    return ((gradients.view(interpolation.size(0), -1).norm(dim=1) - 1) ** 2).mean()
+
+
+def get_step(discriminator, real_batch, generated_batch, use_penalty, fused):
+    """
+    :param discriminator: discriminator in training mode (nn.Module).
+    :param real_batch: batch of real data (torch tensor).
+    :param generated_batch: batch of generated data (torch tensor).
+    :param use_penalty: boolean indicating if the gradient penalty of the wgan-gp is computed (boolean).
+    :param fused: boolean indicating if the real and generated batches share a single forward pass (boolean).
+    :return: function running a forward and backward pass of the discriminator.
+    """
+    def step():
+        discriminator.zero_grad()
+        if fused:
+            generated_logits, real_logits = discriminator.forward_batches(generated_batch, real_batch)
+        else:
+            generated_logits, real_logits = discriminator(generated_batch), discriminator(real_batch)
+        loss = generated_logits.mean() - real_logits.mean()
+        if use_penalty:
+            epsilon = torch.rand(real_batch.size(0), 1, 1, device=real_batch.device)
+            interpolation = (epsilon * real_batch + (1 - epsilon) * generated_batch).requires_grad_(True)
+            loss = loss + get_penalty(interpolation, discriminator(interpolation))
+        loss.backward()
+    return step
+
+
+def check_outputs(discriminator, real_batch, generated_batch):
+    """
+    Checks that the fused pass returns the same logits as the separate passes.
+    :param discriminator: discriminator in evaluation mode (nn.Module).
+    :param real_batch: batch of real data (torch tensor).
+    :param generated_batch: batch of generated data (torch tensor).
+    :return: largest absolute difference between the logits (scalar float).
+    """
+    with torch.no_grad():
+        fused_logits = discriminator.forward_batches(real_batch, generated_batch)
+        separate_logits = [discriminator(real_batch), discriminator(generated_batch)]
+    return max((fused - separate).abs().max().item() for fused, separate in zip(fused_logits, separate_logits))
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length, use_layer_norm=True)
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+
+    discriminator = Discriminator(general_args).to(device)
+    real_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length, device=device)
+    generated_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length, device=device)
+    discriminator.eval()
+    print('Largest difference between the fused and separate logits: {:.3e}'.format(
+        check_outputs(discriminator, real_batch, generated_batch)))
+    discriminator.train()
+
+    print('{:>10} {:>14} {:>14} {:>10}'.format('penalty', 'separate [s]', 'fused [s]', 'speed-up'))
+    for use_penalty in [False, True]:
+        times = [time_function(get_step(discriminator, real_batch, generated_batch, use_penalty, fused), device,
+                               n_warmup=2, n_repeat=benchmark_args.n_repeat) for fused in [False, True]]
+        print('{:>10} {:>14.4f} {:>14.4f} {:>10.2f}'.format(str(use_penalty), times[0], times[1],
+                                                            times[0] / times[1]))
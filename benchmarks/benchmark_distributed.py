@@ -0,0 +1,99 @@
+from benchmarks.common import get_benchmark_general_args
+from utils.distributed import all_reduce_gradients, broadcast_parameters, init_distributed, cleanup_distributed
+from models.generator import Generator
+import torch.multiprocessing as mp
+import numpy as np
+import argparse
+import tempfile
+import torch
+import time
+import os
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the scaling benchmark of the data-parallel training.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Measures the throughput of the data-parallel training of the '
+                                                 'generator on CPU for several numbers of processes.')
+    parser.add_argument('--world_sizes', default=[1, 2, 4, 8], nargs='+', type=int,
+                        help='Numbers of processes to benchmark.')
+    parser.add_argument('--batch_size', default=8, type=int, help='Number of samples per batch and per process.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
+    parser.add_argument('--n_warmup', default=2, type=int, help='Number of steps before measuring.')
+    parser.add_argument('--n_steps', default=10, type=int, help='Number of measured steps.')
+    args = parser.parse_args()
+    return args
+
+
+def run_rank(rank, world_size, init_method, benchmark_args, queue):
+    """
+    Trains the generator on random data in one of the processes and reports the median step time of the main process.
+    :param rank: rank of the process (scalar int).
+    :param world_size: number of processes (scalar int).
+    :param init_method: rendezvous of the processes (string).
+    :param benchmark_args: parsed arguments of the benchmark.
+    :param queue: queue in which the main process puts its median step time (multiprocessing queue).
+    :return: None
+    """
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length, world_size=world_size,
+                                              rank=rank, dist_init_method=init_method)
+    init_distributed(general_args)
+    torch.manual_seed(rank)
+
+    generator = Generator(general_args)
+    broadcast_parameters(generator)
+    optimizer = torch.optim.Adam(generator.parameters())
+    criterion = torch.nn.MSELoss()
+    input_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length)
+    target_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length)
+
+    times = []
+    for step in range(benchmark_args.n_warmup + benchmark_args.n_steps):
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        criterion(generator(input_batch), target_batch).backward()
+        all_reduce_gradients(generator)
+        optimizer.step()
+        if step >= benchmark_args.n_warmup:
+            times.append(time.perf_counter() - start)
+
+    if rank == 0:
+        queue.put(float(np.median(times)))
+    cleanup_distributed()
+
+
+def benchmark_world_size(world_size, benchmark_args):
+    """
+    Spawns the processes of a data-parallel training with a file rendezvous.
+    :param world_size: number of processes (scalar int).
+    :param benchmark_args: parsed arguments of the benchmark.
+    :return: median step time in seconds (scalar float).
+    """
+    context = mp.get_context('spawn')
+    queue = context.SimpleQueue()
+    with tempfile.TemporaryDirectory() as directory:
+        init_method = 'file://' + os.path.join(directory, 'rendezvous')
+        mp.spawn(run_rank, args=(world_size, init_method, benchmark_args, queue), nprocs=world_size, join=True)
+    return queue.get()
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+
+    # The processes share the cores of the host, beyond one process per core they only share the time of the cores
+    n_cores = os.cpu_count() or 1
+    print('Cores of the host: {}'.format(n_cores))
+    if max(benchmark_args.world_sizes) > n_cores:
+        print('The world sizes larger than {} measure the overhead of the processes sharing the cores, not the '
+              'scaling.'.format(n_cores))
+    print('{:>6} {:>12} {:>14} {:>9} {:>11}'.format('ranks', 'step [s]', 'samples / s', 'speedup', 'efficiency'))
+    reference_throughput = None
+    for world_size in benchmark_args.world_sizes:
+        step_time = benchmark_world_size(world_size, benchmark_args)
+        throughput = world_size * benchmark_args.batch_size / step_time
+        reference_throughput = reference_throughput or throughput / world_size
+        speedup = throughput / reference_throughput
+        print('{:>6} {:>12.4f} {:>14.1f} {:>9.2f} {:>11.2f}'.format(world_size, step_time, throughput, speedup,
+                                                                    speedup / world_size))
@@ -0,0 +1,89 @@
+from benchmarks.common import get_benchmark_general_args, get_generator_level_configs, time_function
+from layers.fft_conv import FFT_EFFICIENCY_PENALTY, direct_conv_cost, fft_conv1d, fft_conv_cost, get_fft_length, \
+    select_conv_backend
+from torch.nn import functional as F
+import numpy as np
+import argparse
+import torch
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the benchmark of the FFT convolution.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Compares the direct and FFT convolutions for each scale of each '
+                                                 'generator level.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Number of samples per batch.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
+    parser.add_argument('--n_repeat', default=10, type=int, help='Number of measured calls per configuration.')
+    args = parser.parse_args()
+    return args
+
+
+def benchmark_conv(in_channels, out_channels, kernel_size, width, batch_size, device, n_repeat):
+    """
+    Times a single convolution with 'same' padding computed directly and in the frequency domain.
+    :param in_channels: number of input channels (scalar int).
+    :param out_channels: number of output channels (scalar int).
+    :param kernel_size: size of the kernel (scalar int).
+    :param width: width of the input (scalar int).
+    :param batch_size: number of samples per batch (scalar int).
+    :param device: either 'cpu' or 'cuda' (string).
+    :param n_repeat: number of measured calls (scalar int).
+    :return: selected backend, timings in seconds, maximal absolute difference of the outputs and value of
+    FFT_EFFICIENCY_PENALTY for which the cost model matches the measured ratio of the timings (dictionary).
+    """
+    x = torch.randn(batch_size, in_channels, width, device=device)
+    weight = torch.randn(out_channels, in_channels, kernel_size, device=device) / (in_channels * kernel_size) ** 0.5
+    bias = torch.randn(out_channels, device=device)
+    padding = (kernel_size - 1) // 2
+    backend, fft_length = select_conv_backend(in_channels, out_channels, kernel_size, width, batch_size)
+    fft_length = fft_length or get_fft_length(width + 2 * padding)
+
+    with torch.no_grad():
+        y_direct = F.conv1d(x, weight, bias, padding=padding)
+        y_fft = fft_conv1d(x, weight, bias, padding=padding, fft_length=fft_length)
+        results = {'selected': backend,
+                   'fft_length': fft_length,
+                   'max_abs_error': (y_direct - y_fft).abs().max().item(),
+                   'direct': time_function(lambda: F.conv1d(x, weight, bias, padding=padding), device,
+                                           n_repeat=n_repeat),
+                   'fft': time_function(lambda: fft_conv1d(x, weight, bias, padding=padding, fft_length=fft_length),
+                                        device, n_repeat=n_repeat)}
+
+    # Penalty for which the ratio of the modeled costs equals the ratio of the measured times
+    modeled_ratio = fft_conv_cost(in_channels, out_channels, kernel_size, width, fft_length, batch_size) / \
+        direct_conv_cost(in_channels, out_channels, kernel_size, width, batch_size)
+    results['calibrated_penalty'] = FFT_EFFICIENCY_PENALTY * (results['fft'] / results['direct']) / modeled_ratio
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length)
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+
+    print('{:<12} {:>6} {:>6} {:>6} {:>6} {:>10} {:>10} {:>8} {:>8} {:>8} {:>10}'.format(
+        'block', 'width', 'c_in', 'c_out', 'kernel', 'direct', 'fft', 'speedup', 'selected', 'penalty', 'error'))
+    calibrated_penalties, mispredictions, n_convs = [], 0, 0
+    for config in get_generator_level_configs(general_args):
+        in_channels = config['bottleneck_channels'] if general_args.generator_use_bottleneck else \
+            [config['in_channels']] * len(config['channel_sizes'])
+        for in_channel, out_channel, kernel_size in zip(in_channels, config['channel_sizes'],
+                                                        general_args.kernel_sizes):
+            if kernel_size == 1:
+                continue
+            results = benchmark_conv(in_channel, out_channel, kernel_size, config['width'], benchmark_args.batch_size,
+                                     device, benchmark_args.n_repeat)
+            print('{:<12} {:>6} {:>6} {:>6} {:>6} {:>10.6f} {:>10.6f} {:>8.2f} {:>8} {:>8.2f} {:>10.2e}'.format(
+                config['name'], config['width'], in_channel, out_channel, kernel_size, results['direct'],
+                results['fft'], results['direct'] / results['fft'], results['selected'],
+                results['calibrated_penalty'], results['max_abs_error']))
+            calibrated_penalties.append(results['calibrated_penalty'])
+            mispredictions += results['selected'] != ('fft' if results['fft'] < results['direct'] else 'direct')
+            n_convs += 1
+
+    # The penalty to set in layers/fft_conv.py, the median is robust to the configurations far from the crossover
+    print('Slower backend selected for {} of {} convolutions with FFT_EFFICIENCY_PENALTY = {}, calibrated penalty: '
+          '{:.2f}'.format(mispredictions, n_convs, FFT_EFFICIENCY_PENALTY, float(np.median(calibrated_penalties))))
@@ -0,0 +1,85 @@
+from benchmarks.benchmark_discriminator_pass import get_penalty
+from benchmarks.common import get_benchmark_general_args, time_function
+from models.discriminator import Discriminator
+from torch import autograd
+import argparse
+import torch
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the benchmark of the regularization of the WGAN discriminator.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Measures the mean discriminator step time of the gradient penalty '
+                                                 'settings: interval, fraction of the samples and R1 variant.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Number of samples per batch.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
+    parser.add_argument('--n_repeat', default=5, type=int, help='Number of measured cycles per setting.')
+    args = parser.parse_args()
+    return args
+
+
+def get_r1_penalty(real_batch, real_logits):
+    """
+    :param real_batch: batch of real data that requires gradients (torch tensor).
+    :param real_logits: discriminator's prediction for the real batch (torch tensor).
+    :return: R1 penalty (torch tensor).
+    """
+    gradients = autograd.grad(outputs=real_logits.sum(), inputs=real_batch, create_graph=True)[0]
+    return gradients.pow(2).view(real_batch.size(0), -1).sum(dim=1).mean()
+
+
+def get_cycle(discriminator, real_batch, generated_batch, penalty_type, interval, fraction):
+    """
+    :param discriminator: discriminator in training mode (nn.Module).
+    :param real_batch: batch of real data (torch tensor).
+    :param generated_batch: batch of generated data (torch tensor).
+    :param penalty_type: either None, 'gp' or 'r1' (string).
+    :param interval: number of steps between two computations of the penalty (scalar int).
+    :param fraction: fraction of the samples on which the penalty is computed (scalar float).
+    :return: function running interval discriminator steps, the penalty being computed at the first one.
+    """
+    n_penalty = max(1, int(round(fraction * real_batch.size(0))))
+
+    def step(apply_penalty):
+        discriminator.zero_grad()
+        batches = [generated_batch, real_batch]
+        if apply_penalty and penalty_type == 'r1':
+            batches[1] = real_batch.detach().requires_grad_(True) if n_penalty == real_batch.size(0) else real_batch
+            if n_penalty < real_batch.size(0):
+                batches.append(real_batch[:n_penalty].detach().requires_grad_(True))
+        elif apply_penalty:
+            epsilon = torch.rand(n_penalty, 1, 1, device=real_batch.device)
+            batches.append((epsilon * real_batch[:n_penalty] + (1 - epsilon) * generated_batch[:n_penalty])
+                           .requires_grad_(True))
+        logits = discriminator.forward_batches(*batches)
+        loss = logits[0].mean() - logits[1].mean()
+        if apply_penalty and penalty_type == 'r1':
+            loss = loss + interval * get_r1_penalty(batches[-1], logits[-1])
+        elif apply_penalty:
+            loss = loss + interval * get_penalty(batches[2], logits[2])
+        loss.backward()
+
+    def cycle():
+        for k in range(interval):
+            step(penalty_type is not None and k == 0)
+    return cycle
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length, use_layer_norm=True)
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+
+    discriminator = Discriminator(general_args).to(device).train()
+    real_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length, device=device)
+    generated_batch = torch.randn(benchmark_args.batch_size, 1, benchmark_args.window_length, device=device)
+
+    settings = [(None, 1, 1.), ('gp', 1, 1.), ('gp', 4, 1.), ('gp', 16, 1.), ('gp', 1, .25), ('gp', 4, .25),
+                ('r1', 1, 1.), ('r1', 4, 1.), ('r1', 16, 1.)]
+    print('{:>8} {:>10} {:>10} {:>12}'.format('penalty', 'interval', 'fraction', 'step [s]'))
+    for penalty_type, interval, fraction in settings:
+        cycle_time = time_function(get_cycle(discriminator, real_batch, generated_batch, penalty_type, interval,
+                                             fraction), device, n_warmup=1, n_repeat=benchmark_args.n_repeat)
+        print('{:>8} {:>10} {:>10.2f} {:>12.4f}'.format(str(penalty_type), interval, fraction, cycle_time / interval))
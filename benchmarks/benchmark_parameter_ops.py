@@ -0,0 +1,89 @@
+from utils.parameters import ParameterGroup, clamp_parameters_, get_adam_implementation_kwargs
+from benchmarks.common import get_benchmark_general_args, time_function
+from models.discriminator import Discriminator
+import argparse
+import inspect
+import torch
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the benchmark of the parameter operations.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Measures the per-step overhead of the weight clipping, of the '
+                                                 'requires_grad toggling and of the Adam update of the discriminator, '
+                                                 'with per-parameter loops and with multi-tensor operations.')
+    parser.add_argument('--n_repeat', default=50, type=int, help='Number of measured calls per operation.')
+    args = parser.parse_args()
+    return args
+
+
+def clamp_loop(discriminator, limit):
+    """
+    Weight clipping with one kernel per parameter.
+    :param discriminator: discriminator (nn.Module).
+    :param limit: maximum absolute value (scalar float).
+    :return: None
+    """
+    for p in discriminator.parameters():
+        p.data.clamp_(min=-limit, max=limit)
+
+
+def toggle_loop(discriminator):
+    """
+    Toggles the requires_grad flag of the parameters twice, as done at each step of the WGAN.
+    :param discriminator: discriminator (nn.Module).
+    :return: None
+    """
+    for requires_grad in [True, False]:
+        for p in discriminator.parameters():
+            p.requires_grad_(requires_grad)
+
+
+def toggle_group(parameter_group):
+    """
+    :param parameter_group: cached parameters of the discriminator (ParameterGroup).
+    :return: None
+    """
+    for requires_grad in [True, False]:
+        parameter_group.set_requires_grad(requires_grad)
+
+
+def get_adam_step(discriminator, implementation):
+    """
+    :param discriminator: discriminator whose parameters have gradients (nn.Module).
+    :param implementation: either 'default' (per-parameter loop), 'foreach' or 'fused' (string).
+    :return: function running an optimizer step and the effective keyword arguments of Adam (tuple).
+    """
+    parameters = list(discriminator.parameters())
+    implementation_kwargs = get_adam_implementation_kwargs(parameters, implementation)
+    if implementation == 'default' and 'foreach' in inspect.signature(torch.optim.Adam).parameters:
+        # Recent versions of torch select the foreach implementation by default on the GPU
+        implementation_kwargs = {'foreach': False}
+    optimizer = torch.optim.Adam(parameters, lr=1e-4, **implementation_kwargs)
+    return optimizer.step, implementation_kwargs
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    general_args = get_benchmark_general_args()
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+    discriminator = Discriminator(general_args).to(device)
+    for p in discriminator.parameters():
+        p.grad = torch.randn_like(p)
+    print('Discriminator: {} parameter tensors'.format(len(list(discriminator.parameters()))))
+
+    parameter_group = ParameterGroup(discriminator)
+    parameters = list(discriminator.parameters())
+    timings = [('clamp, loop', lambda: clamp_loop(discriminator, 0.01)),
+               ('clamp, foreach', lambda: clamp_parameters_(parameters, 0.01)),
+               ('requires_grad, loop', lambda: toggle_loop(discriminator)),
+               ('requires_grad, cached group', lambda: toggle_group(parameter_group))]
+    for implementation in ['default', 'foreach', 'fused']:
+        step, implementation_kwargs = get_adam_step(discriminator, implementation)
+        timings.append(('adam, {} {}'.format(implementation, implementation_kwargs), step))
+
+    print('{:>40} {:>14}'.format('operation', 'time [ms]'))
+    for name, function in timings:
+        print('{:>40} {:>14.4f}'.format(name, 1e3 * time_function(function, device, n_repeat=benchmark_args.n_repeat)))
@@ -0,0 +1,183 @@
+from processing.synthetic_data import create_synthetic_hdf5_file, create_synthetic_npy_files
+from train_autoencoder import get_autoencoder_trainer_args, get_autoencoder_trainer
+from train_generator import get_generator_trainer_args, get_generator_trainer
+from benchmarks.common import get_benchmark_general_args, synchronize
+from train_wgan import get_wgan_trainer_args, get_wgan_trainer
+from train_gan import get_gan_trainer_args, get_gan_trainer
+import torch.multiprocessing as mp
+import argparse
+import tempfile
+import resource
+import torch
+import time
+import json
+import os
+
+TRAINERS = {'generator': (get_generator_trainer_args, get_generator_trainer),
+            'gan': (get_gan_trainer_args, get_gan_trainer),
+            'wgan': (get_wgan_trainer_args, get_wgan_trainer),
+            'autoencoder': (get_autoencoder_trainer_args, get_autoencoder_trainer)}
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the end-to-end benchmark of the trainers.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Runs a few training steps of each trainer on a synthetic dataset '
+                                                 'and reports the throughput, the fraction of the time spent waiting '
+                                                 'for the data loader and the peak resident memory.')
+    parser.add_argument('--trainers', default=list(TRAINERS), nargs='+', choices=list(TRAINERS), type=str,
+                        help='Trainers to benchmark.')
+    parser.add_argument('--n_warmup', default=3, type=int, help='Number of steps before measuring.')
+    parser.add_argument('--n_steps', default=20, type=int, help='Number of measured steps.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Number of samples per batch.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per window.')
+    parser.add_argument('--num_worker', default=2, type=int, help='Number of workers used by the data loaders.')
+    parser.add_argument('--use_npy', default=True, type=bool,
+                        help='Flag indicating if the synthetic data is stored as .npy files or a single .hdf5 file.')
+    parser.add_argument('--data_dir', default='data/synthetic', type=str,
+                        help='Directory of the synthetic dataset, created if it does not contain the files yet.')
+    parser.add_argument('--output', default=None, type=str, help='Location of a JSON file where to write the results.')
+    args = parser.parse_args()
+    return args
+
+
+def get_data_args(benchmark_args):
+    """
+    Creates the synthetic dataset if needed, large enough for the measured steps of a single pseudo-epoch.
+    :param benchmark_args: parsed arguments of the benchmark.
+    :return: values of the data related arguments of the trainers (dictionary).
+    """
+    n_train = (benchmark_args.n_warmup + benchmark_args.n_steps + 1) * benchmark_args.batch_size
+    n_windows = {'train': n_train, 'test': 2 * benchmark_args.batch_size, 'valid': 2 * benchmark_args.batch_size}
+    os.makedirs(benchmark_args.data_dir, exist_ok=True)
+    if benchmark_args.use_npy:
+        savepath = {phase: os.path.join(benchmark_args.data_dir, '{}_{}.npy'.format(phase,
+                                                                                      benchmark_args.window_length))
+                    for phase in ['train', 'test', 'valid']}
+        if not all(os.path.exists(path) for path in savepath.values()):
+            create_synthetic_npy_files(savepath, n_windows, benchmark_args.window_length)
+        return {'use_npy': True, 'train_npy_filepath': savepath['train'], 'test_npy_filepath': savepath['test'],
+                'valid_npy_filepath': savepath['valid']}
+    hdf5_path = os.path.join(benchmark_args.data_dir, 'synthetic_{}.hdf5'.format(benchmark_args.window_length))
+    if not os.path.exists(hdf5_path):
+        create_synthetic_hdf5_file(hdf5_path, n_windows, benchmark_args.window_length)
+    return {'use_npy': False, 'hdf5_filepath': hdf5_path}
+
+
+class TimedIterator(object):
+    def __init__(self, iterator):
+        """
+        Initializes the class TimedIterator that records the time spent waiting for each batch of an iterator.
+        :param iterator: iterator over the batches of a data loader.
+        """
+        self.iterator = iterator
+        self.intervals = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        data_batch = next(self.iterator)
+        self.intervals.append((start, time.perf_counter()))
+        return data_batch
+
+
+def run_trainer(name, benchmark_args, data_args, directory, queue):
+    """
+    Trains a trainer for a single pseudo-epoch of n_warmup + n_steps + 1 steps and measures the steps following the
+    warm-up. The boundaries of the steps are given by the calls to get_train_micro_batches, the evaluation and the
+    checkpoint at the end of the pseudo-epoch are therefore not measured.
+    :param name: name of the trainer, see TRAINERS (string).
+    :param benchmark_args: parsed arguments of the benchmark.
+    :param data_args: values of the data related arguments of the trainers (dictionary).
+    :param directory: directory of the checkpoints (string).
+    :param queue: queue in which the results are put (multiprocessing queue).
+    :return: None
+    """
+    get_trainer_args, get_trainer = TRAINERS[name]
+    n_steps = benchmark_args.n_warmup + benchmark_args.n_steps + 1
+    general_args = get_benchmark_general_args(window_length=benchmark_args.window_length,
+                                              train_batches_per_epoch=n_steps, valid_batches_per_epoch=1,
+                                              test_batches_per_epoch=1, background_eval=False)
+    trainer_args = get_trainer_args([])
+    for key, value in dict(data_args, train_batch_size=benchmark_args.batch_size,
+                           valid_batch_size=benchmark_args.batch_size, test_batch_size=benchmark_args.batch_size,
+                           num_worker=benchmark_args.num_worker, epochs=1,
+                           savepath=os.path.join(directory, '{}.tar'.format(name)),
+                           loadpath=os.path.join(directory, '{}.tar'.format(name))).items():
+        setattr(trainer_args, key, value)
+    for key in ['autoencoder_path', 'generator_path']:
+        if hasattr(trainer_args, key):
+            setattr(trainer_args, key, None)
+    trainer = get_trainer(general_args, trainer_args)
+
+    # Time the steps and the data loading
+    trainer.train_loader_iter = TimedIterator(trainer.train_loader_iter)
+    step_starts = []
+    get_train_micro_batches = trainer.get_train_micro_batches
+
+    def timed_get_train_micro_batches():
+        synchronize(trainer.device)
+        step_starts.append(time.perf_counter())
+        return get_train_micro_batches()
+    trainer.get_train_micro_batches = timed_get_train_micro_batches
+    trainer.train(epochs=1)
+
+    # Measure the steps between the end of the warm-up and the start of the last step
+    start, end = step_starts[benchmark_args.n_warmup], step_starts[-1]
+    n_measured = len(step_starts) - 1 - benchmark_args.n_warmup
+    data_wait = sum(interval_end - interval_start for interval_start, interval_end in
+                    trainer.train_loader_iter.intervals if start <= interval_start < end)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    queue.put({'trainer': name,
+               'steps': n_measured,
+               'step_time': (end - start) / n_measured,
+               'samples_per_second': n_measured * general_args.accumulation_steps * benchmark_args.batch_size /
+                                     (end - start),
+               'data_wait_fraction': data_wait / (end - start),
+               'peak_rss_mb': usage.ru_maxrss / 1024,
+               'peak_rss_workers_mb': children_usage.ru_maxrss / 1024})
+
+
+def benchmark_trainer(name, benchmark_args, data_args):
+    """
+    Runs a trainer in a new process so that its peak memory is measured independently of the other trainers.
+    :param name: name of the trainer, see TRAINERS (string).
+    :param benchmark_args: parsed arguments of the benchmark.
+    :param data_args: values of the data related arguments of the trainers (dictionary).
+    :return: results of the trainer (dictionary).
+    """
+    context = mp.get_context('spawn')
+    queue = context.SimpleQueue()
+    with tempfile.TemporaryDirectory() as directory:
+        process = context.Process(target=run_trainer, args=(name, benchmark_args, data_args, directory, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError('The benchmark of the {} trainer failed with exit code {}'.format(name,
+                                                                                                 process.exitcode))
+    return queue.get()
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    data_args = get_data_args(benchmark_args)
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+
+    results = [benchmark_trainer(name, benchmark_args, data_args) for name in benchmark_args.trainers]
+    print('Device: {}, batch size: {}, window length: {}, data format: {}'.format(
+        device, benchmark_args.batch_size, benchmark_args.window_length, 'npy' if benchmark_args.use_npy else 'hdf5'))
+    print('{:>12} {:>10} {:>14} {:>11} {:>14} {:>17}'.format('trainer', 'step [s]', 'samples / s', 'data wait',
+                                                              'peak RSS [MB]', 'workers RSS [MB]'))
+    for result in results:
+        print('{:>12} {:>10.4f} {:>14.1f} {:>10.1f}% {:>14.1f} {:>17.1f}'.format(
+            result['trainer'], result['step_time'], result['samples_per_second'], 100 * result['data_wait_fraction'],
+            result['peak_rss_mb'], result['peak_rss_workers_mb']))
+
+    if benchmark_args.output is not None:
+        with open(benchmark_args.output, 'w') as f:
+            json.dump({'device': device, 'arguments': vars(benchmark_args), 'results': results}, f, indent=2)
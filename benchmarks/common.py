@@ -0,0 +1,76 @@
+from utils.constants_parser import get_general_args
+import numpy as np
+import torch
+import time
+
+
+def get_benchmark_general_args(**overrides):
+    """
+    Returns the default general arguments, ignoring the command line, with some values overridden.
+    :param overrides: values of the general arguments to override.
+    :return: argument parser that contains the arguments that are independent to the script being executed.
+    """
+    general_args = get_general_args([])
+    for key, value in overrides.items():
+        setattr(general_args, key, value)
+    return general_args
+
+
+def synchronize(device):
+    """
+    Waits for all the kernels queued on the device to complete so that the measured time is accurate.
+    :param device: either 'cpu' or 'cuda' (string).
+    :return: None
+    """
+    if str(device).startswith('cuda'):
+        torch.cuda.synchronize()
+
+
+def time_function(function, device='cpu', n_warmup=3, n_repeat=10):
+    """
+    Measures the execution time of a function.
+    :param function: function without arguments to time.
+    :param device: device on which the function runs (string).
+    :param n_warmup: number of calls before measuring (scalar int).
+    :param n_repeat: number of measured calls (scalar int).
+    :return: median execution time in seconds (scalar float).
+    """
+    for _ in range(n_warmup):
+        function()
+    synchronize(device)
+    times = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        function()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def get_generator_level_configs(general_args):
+    """
+    Lists the configuration of the multi-scale convolution of each DownBlock and UpBlock of the generator.
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :return: list of dictionaries with keys 'name', 'in_channels', 'channel_sizes', 'bottleneck_channels' and 'width'.
+    """
+    n_block = general_args.generator_n_block
+    channel_sizes = [list(map(lambda c_size: (2 ** min(i, general_args.generator_channel_factor_max)) * c_size,
+                              general_args.channel_sizes_min)) for i in range(n_block)]
+    bottleneck_channels = [list(map(lambda c: max(1, c // general_args.generator_bottleneck_reduction_factor),
+                                    channel_size)) for channel_size in channel_sizes]
+    configs = []
+    for i in range(n_block):
+        configs.append({'name': 'down_block_{}'.format(i + 1),
+                        'in_channels': 1 if i == 0 else 2 * sum(channel_sizes[i - 1]),
+                        'channel_sizes': channel_sizes[i],
+                        'bottleneck_channels': bottleneck_channels[i],
+                        'width': general_args.window_length // 2 ** i})
+    for i in reversed(range(n_block)):
+        configs.append({'name': 'up_block_{}'.format(n_block - i),
+                        'in_channels': 2 * sum(channel_sizes[i]) if i == n_block - 1 else
+                        sum(channel_sizes[i + 1]) // 2 + 2 * sum(channel_sizes[i]),
+                        'channel_sizes': channel_sizes[i],
+                        'bottleneck_channels': bottleneck_channels[i],
+                        'width': general_args.window_length // 2 ** (i + 1)})
+    return configs
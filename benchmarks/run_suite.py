@@ -0,0 +1,214 @@
+from benchmarks.common import get_benchmark_general_args, get_generator_level_configs, time_function
+from layers.superpixel import pixel_unshuffle_1d
+from layers.subpixel import pixel_shuffle_1d
+from models.discriminator import Discriminator
+from models.autoencoder import AutoEncoder
+from blocks.base_block import BaseBlock
+from blocks.down_block import DownBlock
+from models.generator import Generator
+from blocks.up_block import UpBlock
+import subprocess
+import itertools
+import datetime
+import platform
+import argparse
+import torch
+import json
+import os
+
+CASES = ['base_block', 'base_block_bottleneck', 'pixel_shuffle_1d', 'pixel_unshuffle_1d', 'down_block', 'up_block',
+         'generator', 'discriminator', 'autoencoder']
+
+
+def get_benchmark_args():
+    """
+    Parses the arguments related to the micro-benchmark suite.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Times the forward and forward + backward passes of the blocks, '
+                                                 'layers and models over a sweep of window lengths, batch sizes, '
+                                                 'kernel sizes and thread counts, and writes the results as JSON. '
+                                                 'Two result files of the same machine can be compared with '
+                                                 '--baseline.')
+    parser.add_argument('--cases', default=CASES, nargs='+', choices=CASES, type=str, help='Cases to benchmark.')
+    parser.add_argument('--window_lengths', default=[4096, 8192], nargs='+', type=int,
+                        help='Numbers of samples per input tensor of the models.')
+    parser.add_argument('--batch_sizes', default=[4, 16], nargs='+', type=int, help='Numbers of samples per batch.')
+    parser.add_argument('--kernel_sizes', default=['3,9,27,81'], nargs='+', type=str,
+                        help='Kernel sizes of the multi-scale convolutions, one comma-separated list per setting.')
+    parser.add_argument('--threads', default=[1, 4], nargs='+', type=int,
+                        help='Numbers of intra-op threads, only used on the CPU.')
+    parser.add_argument('--n_warmup', default=2, type=int, help='Number of calls before measuring.')
+    parser.add_argument('--n_repeat', default=5, type=int, help='Number of measured calls.')
+    parser.add_argument('--output', default=None, type=str,
+                        help='Location of the JSON file of the results, defaults to '
+                             '"objects/benchmarks/<commit>.json".')
+    parser.add_argument('--baseline', default=None, type=str,
+                        help='Location of a previous JSON file whose times are compared to the new ones.')
+    args = parser.parse_args()
+    return args
+
+
+def get_commit():
+    """
+    :return: hash of the current commit, followed by '-dirty' if the tree has local changes (string).
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit.decode().strip() + ('-dirty' if status.strip() else '')
+
+
+def get_metadata(device):
+    """
+    :param device: either 'cpu' or 'cuda' (string).
+    :return: description of the code and of the machine the results belong to (dictionary).
+    """
+    return {'commit': get_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'device': device,
+            'gpu': torch.cuda.get_device_name() if device == 'cuda' else None}
+
+
+def get_case(name, general_args, batch_size, device):
+    """
+    Builds the module and the input of a case.
+    :param name: name of the case, see CASES (string).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param batch_size: number of samples per batch (scalar int).
+    :param device: either 'cpu' or 'cuda' (string).
+    :return: function applying the case to its input and input tensor requiring gradients (tuple).
+    """
+    # The blocks are benchmarked with the configuration of the second level of the generator
+    config = get_generator_level_configs(general_args)[1]
+    in_channels, width = config['in_channels'], config['width']
+    if name in ['base_block', 'base_block_bottleneck']:
+        module = BaseBlock(in_channels, general_args.kernel_sizes, config['channel_sizes'],
+                           config['bottleneck_channels'], use_bottleneck=name == 'base_block_bottleneck',
+                           conv_implementation=general_args.conv_implementation)
+        function = module.forward_base
+    elif name == 'pixel_shuffle_1d':
+        module = None
+        function = lambda x: pixel_shuffle_1d(x, general_args.upscale_factor)
+        in_channels = general_args.upscale_factor * sum(config['channel_sizes'])
+    elif name == 'pixel_unshuffle_1d':
+        module = None
+        function = lambda x: pixel_unshuffle_1d(x, general_args.downscale_factor)
+        in_channels = sum(config['channel_sizes'])
+    elif name == 'down_block':
+        module = DownBlock(in_channels, config['channel_sizes'], config['bottleneck_channels'],
+                           general_args.generator_use_bottleneck, general_args)
+        function = module
+    elif name == 'up_block':
+        module = UpBlock(in_channels, config['channel_sizes'], config['bottleneck_channels'],
+                         general_args.generator_use_bottleneck, general_args)
+        function = module
+    else:
+        module = {'generator': lambda: Generator(general_args),
+                  'discriminator': lambda: Discriminator(general_args),
+                  'autoencoder': lambda: AutoEncoder(general_args, return_embedding=False)}[name]()
+        function = module
+        in_channels, width = 1, general_args.window_length
+    if module is not None:
+        module.to(device).train()
+    x = torch.randn(batch_size, in_channels, width, device=device, requires_grad=True)
+    return function, x
+
+
+def benchmark_case(name, general_args, batch_size, device, n_warmup, n_repeat):
+    """
+    :param name: name of the case, see CASES (string).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param batch_size: number of samples per batch (scalar int).
+    :param device: either 'cpu' or 'cuda' (string).
+    :param n_warmup: number of calls before measuring (scalar int).
+    :param n_repeat: number of measured calls (scalar int).
+    :return: median times in seconds of the forward and forward + backward passes (dictionary).
+    """
+    function, x = get_case(name, general_args, batch_size, device)
+
+    def forward_backward():
+        x.grad = None
+        function(x).sum().backward()
+
+    with torch.no_grad():
+        forward_time = time_function(lambda: function(x), device, n_warmup=n_warmup, n_repeat=n_repeat)
+    backward_time = time_function(forward_backward, device, n_warmup=n_warmup, n_repeat=n_repeat)
+    return {'forward': forward_time, 'forward_backward': backward_time}
+
+
+def get_key(result):
+    """
+    :param result: entry of the results (dictionary).
+    :return: key identifying the setting of the entry (tuple).
+    """
+    return result['case'], result['window_length'], result['batch_size'], result['kernel_sizes'], result['threads']
+
+
+def print_results(results, baseline_results=None):
+    """
+    Prints the results, with the ratio of the baseline time to the new time if a baseline is given (> 1 is faster).
+    :param results: entries of the results (list of dictionaries).
+    :param baseline_results: entries of a previous run (list of dictionaries).
+    :return: None
+    """
+    baseline = {get_key(result): result for result in baseline_results or []}
+    print('{:<22} {:>7} {:>6} {:>14} {:>8} {:>12} {:>9} {:>12} {:>9}'.format(
+        'case', 'window', 'batch', 'kernels', 'threads', 'fw [ms]', 'fw ratio', 'fw+bw [ms]', 'bw ratio'))
+    for result in results:
+        reference = baseline.get(get_key(result))
+        ratios = ['{:.2f}'.format(reference[key] / result[key]) if reference else '-'
+                  for key in ['forward', 'forward_backward']]
+        print('{:<22} {:>7} {:>6} {:>14} {:>8} {:>12.3f} {:>9} {:>12.3f} {:>9}'.format(
+            result['case'], result['window_length'], result['batch_size'], result['kernel_sizes'],
+            result['threads'], 1e3 * result['forward'], ratios[0], 1e3 * result['forward_backward'], ratios[1]))
+
+
+if __name__ == '__main__':
+    benchmark_args = get_benchmark_args()
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+    threads = benchmark_args.threads if device == 'cpu' else [torch.get_num_threads()]
+    metadata = get_metadata(device)
+    torch.manual_seed(0)
+
+    results = []
+    for window_length, kernel_sizes, n_threads, batch_size, name in itertools.product(
+            benchmark_args.window_lengths, benchmark_args.kernel_sizes, threads, benchmark_args.batch_sizes,
+            benchmark_args.cases):
+        torch.set_num_threads(n_threads)
+        general_args = get_benchmark_general_args(window_length=window_length,
+                                                  kernel_sizes=[int(size) for size in kernel_sizes.split(',')])
+        result = {'case': name, 'window_length': window_length, 'batch_size': batch_size,
+                  'kernel_sizes': kernel_sizes, 'threads': n_threads}
+        result.update(benchmark_case(name, general_args, batch_size, device, benchmark_args.n_warmup,
+                                     benchmark_args.n_repeat))
+        results.append(result)
+
+    # Compare to a previous run
+    baseline_results = None
+    if benchmark_args.baseline is not None:
+        with open(benchmark_args.baseline, 'r') as f:
+            baseline = json.load(f)
+        baseline_results = baseline['results']
+        print('Baseline: commit {} of {}'.format(baseline['metadata']['commit'], baseline['metadata']['date']))
+        if baseline['metadata'].get('processor') != metadata['processor']:
+            print('Warning: the baseline was measured on another processor')
+    print_results(results, baseline_results)
+
+    # Write the results
+    output = benchmark_args.output or os.path.join('objects', 'benchmarks', '{}.json'.format(metadata['commit']))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'metadata': metadata, 'results': results}, f, indent=2)
+    print('Results written to {}'.format(output))
@@ -1,9 +1,13 @@
+from layers.fft_conv import fft_conv1d, select_conv_backend
+from torch.utils.checkpoint import checkpoint
 from torch import nn
+import inspect
 import torch
 
 
 class BaseBlock(nn.Module):
-    def __init__(self, in_channels, kernel_sizes, channel_sizes, bottleneck_channels, use_bottleneck=True):
+    def __init__(self, in_channels, kernel_sizes, channel_sizes, bottleneck_channels, use_bottleneck=True,
+                 conv_implementation='direct'):
         """
         Initializes the class BaseBlock which is the parent class to all blocks.
         :param in_channels: Number of input channel.
@@ -12,10 +16,20 @@ class BaseBlock(nn.Module):
         :param bottleneck_channels: number of output channel of the intermediate convolution used to reduce
         computational cost.
         :param use_bottleneck: boolean indicating whether to use the bottleneck channels or not.
+        :param conv_implementation: either 'direct' to run one convolution per scale, 'fft' to compute the multi-scale
+        convolutions in the frequency domain or 'auto' to choose between 'direct' and 'fft' for each scale according to
+        a cost model (string).
         """
         super(BaseBlock, self).__init__()
         paddings = [(kernel_size - 1) // 2 for kernel_size in kernel_sizes]
         self.use_bottleneck = use_bottleneck
+        self.conv_implementation = conv_implementation
+
+        # Boolean indicating if the activations of the block are recomputed during the backward pass
+        self.use_checkpointing = False
+
+        # Backend of each multi-scale convolution, selected for each input shape
+        self.conv_backends = {}
 
         # Define convolution layers
         if use_bottleneck:
@@ -37,13 +51,74 @@ class BaseBlock(nn.Module):
                                               for kernel_size, channel_size, padding in zip(kernel_sizes, channel_sizes,
                                                                                             paddings)])
 
+    def get_conv_backends(self, batch_size, width):
+        """
+        Returns the backend used by each multi-scale convolution for a given input shape. With the 'auto'
+        implementation the backends are selected by the cost model of layers.fft_conv and cached.
+        :param batch_size: number of samples per batch (scalar int).
+        :param width: width of the input feature map (scalar int).
+        :return: list of (backend, fft_length) tuples, one entry per scale (list).
+        """
+        key = (batch_size, width)
+        if key not in self.conv_backends:
+            conv_layers = self.conv_layers_2 if self.use_bottleneck else self.conv_layers
+            if self.conv_implementation == 'fft':
+                self.conv_backends[key] = [('fft', None) if conv_layer.kernel_size[0] > 1 else ('direct', None)
+                                           for conv_layer in conv_layers]
+            else:
+                self.conv_backends[key] = [select_conv_backend(conv_layer.in_channels, conv_layer.out_channels,
+                                                               conv_layer.kernel_size[0], width, batch_size)
+                                           for conv_layer in conv_layers]
+        return self.conv_backends[key]
+
+    @staticmethod
+    def apply_conv_layer(x, conv_layer, backend):
+        """
+        Applies a convolution layer with the given backend.
+        :param x: Input feature map.
+        :param conv_layer: convolution layer whose parameters are used (nn.Conv1d).
+        :param backend: tuple (backend, fft_length) with backend either 'direct' or 'fft' (tuple).
+        :return: Output feature map.
+        """
+        name, fft_length = backend
+        if name == 'fft':
+            return fft_conv1d(x, conv_layer.weight, conv_layer.bias, padding=conv_layer.padding[0],
+                              fft_length=fft_length)
+        return conv_layer(x)
+
     def forward_base(self, x):
         """
         :param x: Input feature map.
         :return: Stacked output of the multi-scale convolutions.
         """
+        if self.conv_implementation in ['fft', 'auto']:
+            backends = self.get_conv_backends(x.shape[0], x.shape[-1])
+            if self.use_bottleneck:
+                x = [conv_layer(x) for conv_layer in self.conv_layers_1]
+                return torch.cat([self.apply_conv_layer(temp_x, conv_layer, backend) for temp_x, conv_layer, backend
+                                  in zip(x, self.conv_layers_2, backends)], dim=1)
+            return torch.cat([self.apply_conv_layer(x, conv_layer, backend) for conv_layer, backend in
+                              zip(self.conv_layers, backends)], dim=1)
         if self.use_bottleneck:
             x = [conv_layer(x) for conv_layer in self.conv_layers_1]
             x = torch.cat(list(map(lambda temp_x, conv_layer: conv_layer(temp_x), x, self.conv_layers_2)), dim=1)
             return x
         return torch.cat([conv_layer(x) for conv_layer in self.conv_layers], dim=1)
+
+    def run_checkpointed(self, function, *inputs):
+        """
+        Runs a function of the block. If activation checkpointing is enabled, only the inputs of the function are stored
+        and its intermediate activations are recomputed during the backward pass.
+        :param function: function to run.
+        :param inputs: input tensors of the function.
+        :return: output of the function.
+        """
+        if not (self.use_checkpointing and self.training and torch.is_grad_enabled()):
+            return function(*inputs)
+        if 'use_reentrant' in inspect.signature(checkpoint).parameters:
+            return checkpoint(function, *inputs, use_reentrant=False)
+
+        # The re-entrant implementation does not propagate gradients to the parameters if no input requires them
+        if not any(x.requires_grad for x in inputs):
+            return function(*inputs)
+        return checkpoint(function, *inputs)
@@ -16,7 +16,8 @@ class DiscriminatorBlock(BaseBlock):
         executed.
         """
         super(DiscriminatorBlock, self).__init__(in_channels, general_args.kernel_sizes, channel_sizes,
-                                                 bottleneck_channels, general_args.discriminator_use_bottleneck)
+                                                 bottleneck_channels, general_args.discriminator_use_bottleneck,
+                                                 general_args.conv_implementation)
         if general_args.use_layer_norm:
             self.normalization = nn.LayerNorm([sum(channel_sizes), input_width])
         else:
@@ -32,10 +33,17 @@ class DiscriminatorBlock(BaseBlock):
         :param x: input feature map.
         :return: output feature map.
         """
-        x = self.forward_base(x)
-        x = self.superpixel(self.activation(self.dropout(self.normalization(x))))
+        x = self.run_checkpointed(self.forward_features, x)
+        x = self.superpixel(x)
         return x
 
+    def forward_features(self, x):
+        """
+        :param x: input feature map.
+        :return: normalized and activated output of the multi-scale convolutions.
+        """
+        return self.activation(self.dropout(self.normalization(self.forward_base(x))))
+
 
 class DiscriminatorInput(BaseBlock):
     def __init__(self, in_channels, channel_sizes, bottleneck_channels, general_args):
@@ -49,7 +57,8 @@ class DiscriminatorInput(BaseBlock):
         executed.
         """
         super(DiscriminatorInput, self).__init__(in_channels, general_args.kernel_sizes, channel_sizes,
-                                                 bottleneck_channels, general_args.discriminator_use_bottleneck)
+                                                 bottleneck_channels, general_args.discriminator_use_bottleneck,
+                                                 general_args.conv_implementation)
         self.activation = nn.LeakyReLU(negative_slope=general_args.leaky_relu_slope)
 
     def forward(self, x):
@@ -57,9 +66,14 @@ class DiscriminatorInput(BaseBlock):
         :param x: input feature map.
         :return: output feature map
         """
-        x = self.forward_base(x)
-        x = self.activation(x)
-        return x
+        return self.run_checkpointed(self.forward_features, x)
+
+    def forward_features(self, x):
+        """
+        :param x: input feature map.
+        :return: activated output of the multi-scale convolutions.
+        """
+        return self.activation(self.forward_base(x))
 
 
 class DiscriminatorOutput(nn.Module):
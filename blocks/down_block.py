@@ -16,17 +16,25 @@ class DownBlock(BaseBlock):
         executed.
         """
         super(DownBlock, self).__init__(in_channels, general_args.kernel_sizes, channel_sizes, bottleneck_channels,
-                                        use_bottleneck)
+                                        use_bottleneck, general_args.conv_implementation)
         self.superpixel = SuperPixel1D(in_channels=sum(channel_sizes),
                                        out_channels=general_args.downscale_factor * sum(channel_sizes),
                                        downscale_factor=general_args.downscale_factor)
         self.activation = nn.PReLU(sum(channel_sizes))
 
-    def forward(self, x):
+    def forward(self, x, out=None):
         """
         :param x: input feature map.
+        :param out: optional tensor in which the output feature map is written.
         :return: output feature map
         """
-        x = self.forward_base(x)
-        x = self.superpixel(self.activation(x))
+        x = self.run_checkpointed(self.forward_features, x)
+        x = self.superpixel(x, out=out)
         return x
+
+    def forward_features(self, x):
+        """
+        :param x: input feature map.
+        :return: activated output of the multi-scale convolutions.
+        """
+        return self.activation(self.forward_base(x))
@@ -1,6 +1,5 @@
 from layers.subpixel import SubPixel1D
 from blocks.base_block import BaseBlock
-import torch
 from torch import nn
 
 
@@ -17,22 +16,39 @@ class UpBlock(BaseBlock):
         executed.
         """
         super(UpBlock, self).__init__(in_channels, general_args.kernel_sizes, channel_sizes, bottleneck_channels,
-                                      use_bottleneck)
+                                      use_bottleneck, general_args.conv_implementation)
         self.subpixel = SubPixel1D(in_channels=sum(channel_sizes),
                                    out_channels=sum(channel_sizes) // general_args.upscale_factor,
                                    upscale_factor=general_args.upscale_factor)
         self.dropout = nn.Dropout(general_args.dropout_probability)
         self.activation = nn.PReLU(sum(channel_sizes))
 
-    def forward(self, x, x_shortcut=None):
+    def forward(self, x, x_shortcut=None, out=None):
         """
         :param x: input feature map.
         :param x_shortcut: short-cut feature map from the encoding part.
+        :param out: optional pre-allocated concatenation tensor, its last channels may already contain the short-cut.
         :return: output feature map.
         """
-        x = self.forward_base(x)
-        x = self.activation(self.dropout(x))
-        x = self.subpixel(x)
+        x = self.run_checkpointed(self.forward_features, x)
         if x_shortcut is None:
-            return x
-        return torch.cat([x, x_shortcut], dim=1)
+            return self.subpixel(x)
+
+        # Shuffle directly into the first channels of the concatenated output instead of concatenating a copy
+        B, _, W = x.shape
+        C = self.subpixel.out_channels
+        if out is None:
+            out = x.new_empty(B, C + x_shortcut.shape[1], W * self.subpixel.upscale_factor)
+            out[:, C:].copy_(x_shortcut)
+        elif x_shortcut.data_ptr() != out[:, C:].data_ptr():
+            # The short-cut was not written in place by the encoder
+            out[:, C:].copy_(x_shortcut)
+        self.subpixel(x, out=out[:, :C])
+        return out
+
+    def forward_features(self, x):
+        """
+        :param x: input feature map.
+        :return: activated output of the multi-scale convolutions.
+        """
+        return self.activation(self.dropout(self.forward_base(x)))
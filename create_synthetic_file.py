@@ -0,0 +1,63 @@
+from processing.synthetic_data import create_synthetic_hdf5_file, create_synthetic_npy_files
+import argparse
+import os
+
+
+def get_synthetic_dataset_args(args=None):
+    """
+    Parses the arguments related to the creation of the synthetic dataset if provided by the user, otherwise uses
+    default values.
+    :param args: list of strings to parse, defaults to the command line arguments.
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Creates a synthetic dataset of paired windows (band-limited additive tones played by two synthetic '
+                    'instruments) with the same layout as the Maestro files, e.g. to benchmark the trainers without '
+                    'the Maestro dataset and Timidity++.')
+    parser.add_argument('--use_npy', default=True, type=bool,
+                        help='Flag indicating if the data is stored as multiple .npy files or a single .hdf5 file.')
+    parser.add_argument('--hdf5_savepath', default='data/synthetic.hdf5', type=str,
+                        help='Location of the .hdf5 file to create if this data format is selected')
+    parser.add_argument('--train_npy_filepath', default='data/synthetic_train.npy', type=str,
+                        help='Location of the train .npy file if this data format is selected.')
+    parser.add_argument('--test_npy_filepath', default='data/synthetic_test.npy', type=str,
+                        help='Location of the test .npy file if this data format is selected.')
+    parser.add_argument('--valid_npy_filepath', default='data/synthetic_valid.npy', type=str,
+                        help='Location of the valid .npy file if this data format is selected.')
+    parser.add_argument('--n_train', default=2048, type=int, help='Number of train windows.')
+    parser.add_argument('--n_test', default=256, type=int, help='Number of test windows.')
+    parser.add_argument('--n_valid', default=256, type=int, help='Number of validation windows.')
+    parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per window.')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the random generator.')
+    args, _ = parser.parse_known_args(args)
+    return args
+
+
+def create_synthetic_dataset(dataset_args):
+    """
+    Creates the synthetic files of all phases (train, test and validation).
+    :param dataset_args: argument parser that contains the parameters of the dataset.
+    :return: None
+    """
+    n_windows = {'train': dataset_args.n_train, 'test': dataset_args.n_test, 'valid': dataset_args.n_valid}
+    if dataset_args.use_npy:
+        savepath = {'train': dataset_args.train_npy_filepath,
+                    'test': dataset_args.test_npy_filepath,
+                    'valid': dataset_args.valid_npy_filepath}
+        for path in savepath.values():
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        create_synthetic_npy_files(savepath, n_windows, dataset_args.window_length, dataset_args.seed)
+    else:
+        if os.path.dirname(dataset_args.hdf5_savepath):
+            os.makedirs(os.path.dirname(dataset_args.hdf5_savepath), exist_ok=True)
+        create_synthetic_hdf5_file(dataset_args.hdf5_savepath, n_windows, dataset_args.window_length,
+                                   dataset_args.seed)
+
+
+if __name__ == '__main__':
+    # Get the parameters related to the dataset creation
+    dataset_args = get_synthetic_dataset_args()
+
+    # Create the dataset
+    create_synthetic_dataset(dataset_args)
@@ -205,3 +205,32 @@ class DatasetMaestroNPY(data.Dataset):
     def __getitem__(self, index):
         x_input, x_target = self.data[index, 0, :][None], self.data[index, 1, :][None]
         return torch.from_numpy(x_input).float(), torch.from_numpy(x_target).float()
+
+
+class DatasetWithEmbeddings(data.Dataset):
+    def __init__(self, dataset, embeddings_path):
+        """
+        Initializes the class DatasetWithEmbeddings that appends to each pair of signals of a dataset the precomputed
+        embedding of its target. The embeddings are stored in a .npy file with the same ordering as the dataset, which
+        is memory-mapped so that only the queried rows are read from disk. The file is opened at the first query,
+        hence once per worker of the data loader.
+        :param dataset: dataset returning (x_input, x_target) pairs (torch Dataset).
+        :param embeddings_path: location of the .npy file of the embeddings (string).
+        """
+        self.dataset = dataset
+        self.embeddings_path = embeddings_path
+        self.embeddings = None
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        """
+        Loads a single triplet (x_input, x_target, phi_target).
+        :param index: index of the sample to load (scalar int).
+        :return: corresponding signals and embedding of the target (tuple of torch tensors).
+        """
+        if self.embeddings is None:
+            self.embeddings = np.load(self.embeddings_path, mmap_mode='r')
+        x_input, x_target = self.dataset[index]
+        return x_input, x_target, torch.from_numpy(np.array(self.embeddings[index]))
@@ -5,10 +5,11 @@ import argparse
 import torch
 
 
-def get_track_generation_args():
+def get_track_generation_args(args=None):
     """
     Parses the arguments related to the generation of a track if provided by the user, otherwise uses default
     values.
+    :param args: list of strings to parse, defaults to the command line arguments.
     :return: Parsed arguments.
     """
     parser = argparse.ArgumentParser(description='Generates a track from an input .midi file.')
@@ -44,7 +45,7 @@ def get_track_generation_args():
     parser.add_argument('--target_control_value', default=None, type=int,
                         help='The control value is typically set to zero to remove a specific effect selected with the'
                              ' control argument.')
-    args = parser.parse_args()
+    args, _ = parser.parse_known_args(args)
     return args
 
 
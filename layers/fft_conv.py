@@ -0,0 +1,145 @@
+from torch.nn import functional as F
+import math
+import torch
+
+# Cost of a complex multiply-accumulate relative to a real one
+COMPLEX_MULTIPLY_COST = 4.
+
+# Number of real operations of a real-to-complex FFT of length n, divided by n * log2(n)
+FFT_COST = 2.5
+
+# Factor applied to the cost of the FFT path to account for the higher efficiency of the direct convolution kernels.
+# Calibrated with benchmarks/benchmark_fft_conv.py on a single CPU core (median over the convolutions of the default
+# generator), it should be calibrated again on other devices, e.g. a GPU
+FFT_EFFICIENCY_PENALTY = 5.
+
+
+def is_fft_available():
+    """
+    Checks if the torch.fft module is available (torch >= 1.7).
+    :return: boolean indicating if the FFT convolution can be used (boolean).
+    """
+    return hasattr(torch, 'fft') and hasattr(torch.fft, 'rfft')
+
+
+def get_fft_length(length):
+    """
+    Returns the smallest length larger or equal to the given length whose prime factors are 2, 3 and 5 only, the FFT is
+    efficient for such lengths.
+    :param length: minimal length of the FFT (scalar int).
+    :return: length of the FFT (scalar int).
+    """
+    candidate = length
+    while True:
+        remainder = candidate
+        for factor in [2, 3, 5]:
+            while remainder % factor == 0:
+                remainder //= factor
+        if remainder == 1:
+            return candidate
+        candidate += 1
+
+
+def direct_conv_cost(in_channels, out_channels, kernel_size, width, batch_size=1):
+    """
+    Estimates the number of multiply-accumulates of a direct convolution with 'same' padding.
+    :param in_channels: number of input channels (scalar int).
+    :param out_channels: number of output channels (scalar int).
+    :param kernel_size: size of the kernel (scalar int).
+    :param width: width of the input (scalar int).
+    :param batch_size: number of samples per batch (scalar int).
+    :return: estimated cost (scalar float).
+    """
+    return float(batch_size * in_channels * out_channels * kernel_size * width)
+
+
+def fft_conv_cost(in_channels, out_channels, kernel_size, width, fft_length, batch_size=1):
+    """
+    Estimates the cost of an overlap-save FFT convolution with 'same' padding, in multiply-accumulates.
+    :param in_channels: number of input channels (scalar int).
+    :param out_channels: number of output channels (scalar int).
+    :param kernel_size: size of the kernel (scalar int).
+    :param width: width of the input (scalar int).
+    :param fft_length: length of the FFT of each block (scalar int).
+    :param batch_size: number of samples per batch (scalar int).
+    :return: estimated cost (scalar float).
+    """
+    n_blocks = math.ceil(width / (fft_length - kernel_size + 1))
+    transform_cost = FFT_COST * fft_length * math.log2(fft_length)
+    signal_transforms = batch_size * n_blocks * (in_channels + out_channels) * transform_cost
+    kernel_transforms = in_channels * out_channels * transform_cost
+    product = COMPLEX_MULTIPLY_COST * batch_size * n_blocks * in_channels * out_channels * (fft_length // 2 + 1)
+    return FFT_EFFICIENCY_PENALTY * (signal_transforms + kernel_transforms + product)
+
+
+def select_conv_backend(in_channels, out_channels, kernel_size, width, batch_size=1):
+    """
+    Selects the cheapest way to compute a convolution with 'same' padding according to the cost model. The candidate
+    FFT lengths are a single block covering the whole (padded) input and overlap-save blocks of increasing length.
+    :param in_channels: number of input channels (scalar int).
+    :param out_channels: number of output channels (scalar int).
+    :param kernel_size: size of the kernel (scalar int).
+    :param width: width of the input (scalar int).
+    :param batch_size: number of samples per batch (scalar int).
+    :return: either ('direct', None) or ('fft', fft_length) (tuple).
+    """
+    best_backend = ('direct', None)
+    if kernel_size == 1 or not is_fft_available():
+        return best_backend
+    best_cost = direct_conv_cost(in_channels, out_channels, kernel_size, width, batch_size)
+
+    # Single block FFT and overlap-save with blocks at least twice as long as the kernel
+    fft_lengths = {get_fft_length(width + kernel_size - 1)}
+    fft_length = 2 ** math.ceil(math.log2(2 * kernel_size))
+    while fft_length < width + kernel_size - 1:
+        fft_lengths.add(fft_length)
+        fft_length *= 2
+
+    for fft_length in sorted(fft_lengths):
+        cost = fft_conv_cost(in_channels, out_channels, kernel_size, width, fft_length, batch_size)
+        if cost < best_cost:
+            best_backend, best_cost = ('fft', fft_length), cost
+    return best_backend
+
+
+def fft_conv1d(x, weight, bias=None, padding=0, fft_length=None):
+    """
+    Computes the same cross-correlation as torch.nn.functional.conv1d in the frequency domain with the overlap-save
+    method. The input is cut in overlapping blocks of length fft_length, each block produces
+    fft_length - kernel_size + 1 valid output samples.
+    :param x: input feature map with shape [B, C_in, W] (torch tensor).
+    :param weight: kernels with shape [C_out, C_in, K] (torch tensor).
+    :param bias: bias with shape [C_out] (torch tensor).
+    :param padding: number of zeros added on both sides of the input (scalar int).
+    :param fft_length: length of the FFT of each block, defaults to a single block covering the input (scalar int).
+    :return: output feature map with shape [B, C_out, W + 2 * padding - K + 1] (torch tensor).
+    """
+    out_channels, in_channels, kernel_size = weight.shape
+    if padding:
+        x = F.pad(x, (padding, padding))
+    batch_size, _, width = x.shape
+    out_width = width - kernel_size + 1
+    if fft_length is None:
+        fft_length = get_fft_length(width)
+    step = fft_length - kernel_size + 1
+    if step < 1:
+        raise ValueError('The FFT length ({}) must be larger than the kernel size ({}).'.format(fft_length,
+                                                                                              kernel_size))
+
+    # Cut the input in overlapping blocks with shape [B, C_in, n_blocks, fft_length]
+    n_blocks = math.ceil(out_width / step)
+    x = F.pad(x, (0, (n_blocks - 1) * step + fft_length - width))
+    blocks = x.unfold(-1, fft_length, step)
+
+    # The cross-correlation is the product with the conjugate spectrum of the kernel, only the first samples of the
+    # circular cross-correlation of each block are not affected by the wrap-around
+    blocks_f = torch.fft.rfft(blocks, n=fft_length)
+    weight_f = torch.fft.rfft(weight, n=fft_length).conj()
+    y_f = torch.einsum('binf,oif->bonf', blocks_f, weight_f)
+    y = torch.fft.irfft(y_f, n=fft_length)[..., :step]
+
+    # Stitch the blocks together
+    y = y.reshape(batch_size, out_channels, n_blocks * step)[..., :out_width]
+    if bias is not None:
+        y = y + bias[:, None]
+    return y
@@ -0,0 +1,125 @@
+from torch.nn import functional as F
+from torch import nn
+import torch
+
+# Resolution of the STFT used by the LSD metric, (n_fft, hop_length)
+METRIC_RESOLUTION = (512, 128)
+
+# Engines shared by the callers that do not hold their own, one per device
+_SHARED_ENGINES = {}
+
+
+class STFTEngine(nn.Module):
+    def __init__(self, resolutions=(METRIC_RESOLUTION,), normalized=True):
+        """
+        Initializes the class STFTEngine that computes the power spectrograms of signals at several resolutions. The
+        Hann windows are created once and stored as buffers, the FFT plans are cached by torch for the repeated shapes.
+        The frequency loss averages the L2 losses of all the resolutions and the LSD metric is computed from the
+        spectrograms of the same pass at METRIC_RESOLUTION, which is added to the resolutions if needed. Calling the
+        engine returns the spectrogram of the first resolution like torchaudio.transforms.Spectrogram.
+        :param resolutions: resolutions of the frequency loss, (n_fft, hop_length) pairs (list of tuples).
+        :param normalized: boolean indicating if the spectrograms are normalized by the norm of the window, the LSD
+        metric does not depend on it (boolean).
+        """
+        super(STFTEngine, self).__init__()
+        self.loss_resolutions = [tuple(resolution) for resolution in resolutions]
+        self.resolutions = list(self.loss_resolutions)
+        if METRIC_RESOLUTION not in self.resolutions:
+            self.resolutions.append(METRIC_RESOLUTION)
+        self.normalized = normalized
+
+        # One window per FFT size, not saved in the state dicts
+        for n_fft in set(n_fft for n_fft, _ in self.resolutions):
+            self.register_buffer('window_{}'.format(n_fft), torch.hann_window(n_fft), persistent=False)
+
+    def get_window(self, n_fft):
+        """
+        :param n_fft: size of the FFT (scalar int).
+        :return: Hann window of length n_fft (torch tensor).
+        """
+        return getattr(self, 'window_{}'.format(n_fft))
+
+    def compute(self, x, resolution):
+        """
+        Computes the power spectrogram of a batch of signals with the same conventions as
+        torchaudio.transforms.Spectrogram (centered frames, reflection padding, one-sided spectrum).
+        :param x: signals with shape [..., W] (torch tensor).
+        :param resolution: (n_fft, hop_length) pair (tuple).
+        :return: power spectrogram with shape [..., n_fft // 2 + 1, n_frames] (torch tensor).
+        """
+        n_fft, hop_length = resolution
+        window = self.get_window(n_fft)
+        shape = x.shape
+        spectrum = torch.stft(x.reshape(-1, shape[-1]), n_fft=n_fft, hop_length=hop_length, win_length=n_fft,
+                              window=window, center=True, pad_mode='reflect', normalized=False, onesided=True,
+                              return_complex=True)
+        if self.normalized:
+            spectrum = spectrum / window.pow(2).sum().sqrt()
+        spectrogram = spectrum.real.pow(2) + spectrum.imag.pow(2)
+        return spectrogram.reshape(shape[:-1] + spectrogram.shape[-2:])
+
+    def forward(self, x):
+        """
+        :param x: signals with shape [..., W] (torch tensor).
+        :return: power spectrogram at the first resolution (torch tensor).
+        """
+        return self.compute(x, self.resolutions[0])
+
+    def get_spectrograms(self, x, resolutions=None):
+        """
+        :param x: signals with shape [..., W] (torch tensor).
+        :param resolutions: resolutions to compute, all the resolutions of the engine by default (list of tuples).
+        :return: power spectrogram at each resolution (dictionary of torch tensors).
+        """
+        resolutions = self.resolutions if resolutions is None else resolutions
+        return {resolution: self.compute(x, resolution) for resolution in resolutions}
+
+    def get_pair_spectrograms(self, generated_batch, target_batch, resolutions=None):
+        """
+        Computes the spectrograms of the generated and target batches with a single STFT per resolution on their
+        concatenation.
+        :param generated_batch: generated signals (torch tensor).
+        :param target_batch: target signals with the same shape (torch tensor).
+        :param resolutions: resolutions to compute, all the resolutions of the engine by default, e.g. loss_resolutions
+        when the LSD metric is not needed (list of tuples).
+        :return: spectrograms of the generated and target batches (tuple of dictionaries of torch tensors).
+        """
+        n_samples = generated_batch.shape[0]
+        spectrograms = self.get_spectrograms(torch.cat([generated_batch, target_batch.to(generated_batch.dtype)]),
+                                             resolutions=resolutions)
+        generated_spectrograms = {key: value[:n_samples] for key, value in spectrograms.items()}
+        target_spectrograms = {key: value[n_samples:] for key, value in spectrograms.items()}
+        return generated_spectrograms, target_spectrograms
+
+    def l2_loss_from_spectrograms(self, generated_spectrograms, target_spectrograms):
+        """
+        :param generated_spectrograms: spectrograms of the generated batch (dictionary of torch tensors).
+        :param target_spectrograms: spectrograms of the target batch (dictionary of torch tensors).
+        :return: L2 loss between the spectrograms averaged over the loss resolutions (torch tensor).
+        """
+        losses = [F.mse_loss(generated_spectrograms[resolution], target_spectrograms[resolution])
+                  for resolution in self.loss_resolutions]
+        return sum(losses) / len(losses)
+
+    def l2_loss(self, generated_batch, target_batch):
+        """
+        :param generated_batch: generated signals (torch tensor).
+        :param target_batch: target signals with the same shape (torch tensor).
+        :return: L2 loss in frequency domain averaged over the loss resolutions (torch tensor).
+        """
+        generated_spectrograms, target_spectrograms = self.get_pair_spectrograms(generated_batch, target_batch,
+                                                                                 resolutions=self.loss_resolutions)
+        return self.l2_loss_from_spectrograms(generated_spectrograms, target_spectrograms)
+
+
+def get_shared_stft_engine(device):
+    """
+    Returns an engine with the metric resolution only, created once per device, e.g. for the metrics computed outside
+    of a trainer.
+    :param device: device of the signals (torch device or string).
+    :return: STFT engine (STFTEngine).
+    """
+    device = torch.device(device)
+    if device not in _SHARED_ENGINES:
+        _SHARED_ENGINES[device] = STFTEngine(normalized=False).to(device)
+    return _SHARED_ENGINES[device]
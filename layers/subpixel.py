@@ -1,6 +1,21 @@
 from torch import nn
 
 
+def drop_unused_conv_layer(module, state_dict, prefix):
+    """
+    Removes from a state dict the parameters of the convolution of a sub-pixel or super-pixel layer that does not use
+    it. Previous versions of these layers always built the convolution, therefore such parameters are stored in old
+    checkpoints.
+    :param module: layer in which the state dict is being loaded (nn.Module).
+    :param state_dict: state dict being loaded (dictionary).
+    :param prefix: prefix of the keys of the layer in the state dict (string).
+    :return: None
+    """
+    if not module.use_convolution:
+        for key in [key for key in state_dict if key.startswith(prefix + 'conv_layer.')]:
+            del state_dict[key]
+
+
 def pixel_shuffle(x, upscale_factor):
     """
     Shuffles the pixels inside the tensor x to change the shape from [B, r^2 * C, H, W] to [B, C, r * H, r * W]
@@ -21,12 +36,14 @@ def pixel_shuffle(x, upscale_factor):
     return x
 
 
-def pixel_shuffle_1d(x, upscale_factor):
+def pixel_shuffle_1d(x, upscale_factor, out=None):
     """
     Shuffles the pixels inside the tensor x to change the shape from [B, r * C, W] to [B, C, r * W]
     where r is the upscale factor
     :param x: Original input signal with r * C channels
     :param upscale_factor: Factor to increase the width of x
+    :param out: Optional tensor with shape [B, C, r * W] in which the result is written, typically a slice of a larger
+    pre-allocated tensor. The shuffle is then done by the copy into out, without intermediate tensor.
     :return: Reshaped tensor
     """
     B_in, C_in, W_in = x.size()
@@ -34,9 +51,11 @@ def pixel_shuffle_1d(x, upscale_factor):
     W_out = W_in * upscale_factor
 
     x = x.view(B_in, C_out, upscale_factor, W_in)
-    x = x.permute(0, 1, 3, 2).contiguous()
-    x = x.view(B_in, C_out, W_out)
-    return x
+    x = x.permute(0, 1, 3, 2)
+    if out is not None:
+        out.view(B_in, C_out, W_in, upscale_factor).copy_(x)
+        return out
+    return x.reshape(B_in, C_out, W_out)
 
 
 class SubPixel(nn.Module):
@@ -54,10 +73,16 @@ class SubPixel(nn.Module):
         self.upscale_factor = upscale_factor
         self.use_convolution = use_convolution
         self.padding = (kernel_size - 1) // 2
-        self.conv_layer = nn.Conv2d(in_channels=in_channels,
-                                    out_channels=out_channels * upscale_factor ** 2,
-                                    kernel_size=kernel_size,
-                                    padding=self.padding)
+        self.conv_layer = None
+        if use_convolution:
+            self.conv_layer = nn.Conv2d(in_channels=in_channels,
+                                        out_channels=out_channels * upscale_factor ** 2,
+                                        kernel_size=kernel_size,
+                                        padding=self.padding)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        drop_unused_conv_layer(self, state_dict, prefix)
+        super(SubPixel, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(self, x):
         """
@@ -88,14 +113,22 @@ class SubPixel1D(nn.Module):
         self.upscale_factor = upscale_factor
         self.use_convolution = use_convolution
         self.padding = (kernel_size - 1) // 2
-        self.conv_layer = nn.Conv1d(in_channels=in_channels,
-                                    out_channels=out_channels * upscale_factor,
-                                    kernel_size=kernel_size,
-                                    padding=self.padding)
+        self.out_channels = out_channels if use_convolution else in_channels // upscale_factor
+        self.conv_layer = None
+        if use_convolution:
+            self.conv_layer = nn.Conv1d(in_channels=in_channels,
+                                        out_channels=out_channels * upscale_factor,
+                                        kernel_size=kernel_size,
+                                        padding=self.padding)
 
-    def forward(self, x):
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        drop_unused_conv_layer(self, state_dict, prefix)
+        super(SubPixel1D, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def forward(self, x, out=None):
         """
         :param x: input feature map.
+        :param out: optional tensor in which the output feature map is written.
         :return: output feature map
         """
         # Convolution in LR space
@@ -103,5 +136,5 @@ class SubPixel1D(nn.Module):
             x = self.conv_layer(x)
 
         # Pixel shuffling
-        x = pixel_shuffle_1d(x, self.upscale_factor)
+        x = pixel_shuffle_1d(x, self.upscale_factor, out=out)
         return x
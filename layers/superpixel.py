@@ -1,3 +1,4 @@
+from layers.subpixel import drop_unused_conv_layer
 from torch import nn
 
 
@@ -21,12 +22,14 @@ def pixel_unshuffle(x, downscale_factor):
     return x
 
 
-def pixel_unshuffle_1d(x, downscale_factor):
+def pixel_unshuffle_1d(x, downscale_factor, out=None):
     """
     Shuffles the pixels inside the tensor x to change the shape from [B, C, r * W] to [B, r * C, W]
     where r is the upscale factor
     :param x: original input signal with surface [r * H, r * W]
     :param downscale_factor: factor to decrease the height and width of x
+    :param out: optional tensor with shape [B, r * C, W] in which the result is written, typically a slice of a larger
+    pre-allocated tensor. The shuffle is then done by the copy into out, without intermediate tensor.
     :return: reshaped tensor
     """
     B_in, C_in, W_in = x.size()
@@ -35,9 +38,11 @@ def pixel_unshuffle_1d(x, downscale_factor):
     W_out = int(W_in / downscale_factor)
 
     x = x.view(B_in, C_in, W_out, downscale_factor)
-    x = x.permute(0, 1, 3, 2).contiguous()
-    x = x.view(B_in, C_out, W_out)
-    return x
+    x = x.permute(0, 1, 3, 2)
+    if out is not None:
+        out.view(B_in, C_in, downscale_factor, W_out).copy_(x)
+        return out
+    return x.reshape(B_in, C_out, W_out)
 
 
 class SuperPixel(nn.Module):
@@ -55,10 +60,16 @@ class SuperPixel(nn.Module):
         self.downscale_factor = downscale_factor
         self.use_convolution = use_convolution
         padding = (kernel_size - 1) // 2
-        self.conv_layer = nn.Conv2d(in_channels=in_channels * downscale_factor ** 2,
-                                    out_channels=out_channels,
-                                    kernel_size=kernel_size,
-                                    padding=padding)
+        self.conv_layer = None
+        if use_convolution:
+            self.conv_layer = nn.Conv2d(in_channels=in_channels * downscale_factor ** 2,
+                                        out_channels=out_channels,
+                                        kernel_size=kernel_size,
+                                        padding=padding)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        drop_unused_conv_layer(self, state_dict, prefix)
+        super(SuperPixel, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(self, x):
         """
@@ -89,22 +100,35 @@ class SuperPixel1D(nn.Module):
         self.downscale_factor = downscale_factor
         self.use_convolution = use_convolution
         padding = (kernel_size - 1) // 2
-        self.conv_layer = nn.Conv1d(in_channels=in_channels * downscale_factor,
-                                    out_channels=out_channels,
-                                    kernel_size=kernel_size,
-                                    padding=padding)
-
-    def forward(self, x):
+        self.out_channels = out_channels if use_convolution else in_channels * downscale_factor
+        self.conv_layer = None
+        if use_convolution:
+            self.conv_layer = nn.Conv1d(in_channels=in_channels * downscale_factor,
+                                        out_channels=out_channels,
+                                        kernel_size=kernel_size,
+                                        padding=padding)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        drop_unused_conv_layer(self, state_dict, prefix)
+        super(SuperPixel1D, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def forward(self, x, out=None):
         """
         :param x: input feature map.
+        :param out: optional tensor in which the output feature map is written, only used without convolution.
         :return: output feature map
         """
         # Pixel un-shuffling
-        x = pixel_unshuffle_1d(x, self.downscale_factor)
+        if self.use_convolution:
+            x = pixel_unshuffle_1d(x, self.downscale_factor)
+        else:
+            return pixel_unshuffle_1d(x, self.downscale_factor, out=out)
 
         # Convolution in LR space
-        if self.use_convolution:
-            x = self.conv_layer(x)
+        x = self.conv_layer(x)
+        if out is not None:
+            out.copy_(x)
+            return out
         return x
 
 
@@ -63,6 +63,11 @@ class AutoEncoder(nn.Module):
         # Boolean indicating if the auto-encoder should return the latent space representation
         self.return_embedding = return_embedding
 
+        # Recompute the activations of the highest resolution levels during the backward pass
+        for level in range(min(general_args.autoencoder_checkpoint_levels, general_args.autoencoder_n_block)):
+            self.encoder[level].use_checkpointing = True
+            self.decoder[-level - 1].use_checkpointing = True
+
     def forward(self, x):
         # Encoder
         phi = self.encoder(x)
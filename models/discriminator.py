@@ -1,5 +1,6 @@
 from blocks.discriminator_block import DiscriminatorInput, DiscriminatorBlock, DiscriminatorOutput
 from torch import nn
+import torch
 
 
 class Discriminator(nn.Module):
@@ -41,7 +42,27 @@ class Discriminator(nn.Module):
                               discriminator_n_block),
             out_features_1=general_args.fc1_output_features, general_args=general_args)
 
+        # Boolean indicating if the normalization is computed per sample, several batches can then share a forward pass
+        self.use_layer_norm = general_args.use_layer_norm
+
+        # Recompute the activations of the first blocks during the backward pass
+        for block in ([self.in_block] + list(self.mid_blocks))[:general_args.discriminator_checkpoint_levels]:
+            block.use_checkpointing = True
+
     def forward(self, x):
         x = self.in_block(x)
         x = self.mid_blocks(x)
         return self.out_block(x)
+
+    def forward_batches(self, *batches):
+        """
+        Runs the discriminator on several batches, e.g. real, generated and interpolated ones, with a single forward
+        pass on their concatenation. The outputs are identical to separate passes only if the normalization is computed
+        per sample (layer normalization), the batches are therefore processed separately with batch normalization.
+        :param batches: input batches (torch tensors).
+        :return: logits of each batch (tuple of torch tensors).
+        """
+        if not self.use_layer_norm:
+            return tuple(self.forward(batch) for batch in batches)
+        logits = self.forward(torch.cat(batches))
+        return logits.split([batch.shape[0] for batch in batches])
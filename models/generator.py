@@ -1,6 +1,7 @@
 from blocks.down_block import DownBlock
 from blocks.up_block import UpBlock
 from torch import nn
+import torch
 
 
 class Generator(nn.Module):
@@ -9,6 +10,12 @@ class Generator(nn.Module):
         # Specify if the last additive skip connection must be used
         self.use_additive_skip = use_additive_skip
 
+        # Specify if the skip-connection buffers are planned once per input shape and reused across calls, only the
+        # buffers of the last input shape are kept
+        self.plan_buffers = general_args.generator_plan_buffers
+        self.planned_buffers_key = None
+        self.planned_buffers = None
+
         # Compute channel sizes at each level
         channel_sizes = [list(map(lambda c_size: (2 ** min(i, general_args.generator_channel_factor_max)) * c_size,
                                   general_args.channel_sizes_min))
@@ -80,7 +87,107 @@ class Generator(nn.Module):
         # Output activation
         self.tanh = nn.Tanh()
 
+        # Recompute the activations of the highest resolution levels during the backward pass
+        for level in range(1, min(general_args.generator_checkpoint_levels, general_args.generator_n_block) + 1):
+            getattr(self, 'down_block_{}'.format(level)).use_checkpointing = True
+            getattr(self, 'up_block_{}'.format(general_args.generator_n_block + 1 - level)).use_checkpointing = True
+
+    def use_planned_buffers(self):
+        """
+        The planned buffers are written in place, which autograd does not allow for tensors saved for the backward
+        pass, and they would be baked as constants in a traced or compiled graph.
+        :return: boolean indicating if the planned buffers can be used for the current call (boolean).
+        """
+        if not self.plan_buffers or torch.is_grad_enabled() or torch.jit.is_tracing() or torch.jit.is_scripting():
+            return False
+        is_compiling = getattr(getattr(torch, 'compiler', None), 'is_compiling', None)
+        return is_compiling is None or not is_compiling()
+
+    def get_buffers(self, x_input):
+        """
+        Returns the concatenation buffers of the skip connections for the shape, device and type of the input and the
+        inference mode, the buffers of a previous input are released. The buffer of level k has shape
+        [B, C_up + C_dk, W / r^k] where the first C_up channels receive the output of the sub-pixel layer of the decoder
+        and the last C_dk channels receive the output d_k of the encoder.
+        :param x_input: input of the generator (torch tensor).
+        :return: one buffer for each of the levels 1 to 7 (list of torch tensors).
+        """
+        # Tensors created in inference mode cannot be written in place outside of it
+        is_inference = getattr(torch, 'is_inference_mode_enabled', lambda: False)()
+        key = (tuple(x_input.shape), x_input.device, x_input.dtype, is_inference)
+        if key != self.planned_buffers_key:
+            self.clear_buffers()
+            B, _, W = x_input.shape
+            down_blocks = [self.down_block_1, self.down_block_2, self.down_block_3, self.down_block_4,
+                           self.down_block_5, self.down_block_6, self.down_block_7]
+            up_blocks = [self.up_block_7, self.up_block_6, self.up_block_5, self.up_block_4, self.up_block_3,
+                         self.up_block_2, self.up_block_1]
+            buffers = []
+            for down_block, up_block in zip(down_blocks, up_blocks):
+                W //= down_block.superpixel.downscale_factor
+                C = up_block.subpixel.out_channels + down_block.superpixel.out_channels
+                buffers.append(x_input.new_empty(B, C, W))
+            self.planned_buffers_key, self.planned_buffers = key, buffers
+        return self.planned_buffers
+
+    def clear_buffers(self):
+        """
+        Releases the planned buffers.
+        :return: None
+        """
+        self.planned_buffers_key = None
+        self.planned_buffers = None
+
+    def forward_planned(self, x_input):
+        """
+        Runs the generator with the planned buffers. The encoder writes d_k directly in the last channels of the
+        buffer of level k whenever this slice is contiguous (batch size of 1), otherwise d_k is copied by the decoder.
+        The sub-pixel layers of the decoder write their output in the first channels, so that no concatenation is
+        needed.
+        :param x_input: input of the generator (torch tensor).
+        :return: output of the generator (torch tensor).
+        """
+        b1, b2, b3, b4, b5, b6, b7 = self.get_buffers(x_input)
+
+        # Encoder
+        d1 = self.down_block_1(x_input, out=self.get_shortcut_slice(b1, self.down_block_1))
+        d2 = self.down_block_2(d1, out=self.get_shortcut_slice(b2, self.down_block_2))
+        d3 = self.down_block_3(d2, out=self.get_shortcut_slice(b3, self.down_block_3))
+        d4 = self.down_block_4(d3, out=self.get_shortcut_slice(b4, self.down_block_4))
+        d5 = self.down_block_5(d4, out=self.get_shortcut_slice(b5, self.down_block_5))
+        d6 = self.down_block_6(d5, out=self.get_shortcut_slice(b6, self.down_block_6))
+        d7 = self.down_block_7(d6, out=self.get_shortcut_slice(b7, self.down_block_7))
+        d8 = self.down_block_8(d7)
+
+        # Decoder
+        x = self.up_block_1(d8, d7, out=b7)
+        x = self.up_block_2(x, d6, out=b6)
+        x = self.up_block_3(x, d5, out=b5)
+        x = self.up_block_4(x, d4, out=b4)
+        x = self.up_block_5(x, d3, out=b3)
+        x = self.up_block_6(x, d2, out=b2)
+        x = self.up_block_7(x, d1, out=b1)
+        x = self.up_block_8(x, None)
+        if self.use_additive_skip:
+            return self.tanh(self.output_conv(x) + x_input)
+        return self.tanh(self.output_conv(x))
+
+    @staticmethod
+    def get_shortcut_slice(buffer, down_block):
+        """
+        :param buffer: concatenation buffer of a level (torch tensor).
+        :param down_block: block of the encoder at the same level (DownBlock).
+        :return: slice of the buffer that receives the output of the block if it is contiguous, None otherwise.
+        """
+        shortcut_slice = buffer[:, -down_block.superpixel.out_channels:]
+        if shortcut_slice.is_contiguous():
+            return shortcut_slice
+        return None
+
     def forward(self, x_input):
+        if self.use_planned_buffers():
+            return self.forward_planned(x_input)
+
         # Encoder
         d1 = self.down_block_1(x_input)
         d2 = self.down_block_2(d1)
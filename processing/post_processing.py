@@ -49,7 +49,9 @@ def generate_single_track(original_midi_filepath, temporary_directory_path, tran
     :return:None
     """
     # Load the pre-trained generator
-    generator = get_generator(loadpath=generator_path, device=device, general_args=general_args)
+    batch_size = 10
+    generator = get_generator(loadpath=generator_path, device=device, general_args=general_args,
+                              batch_size=batch_size)
 
     # Create a temporary directory
     if os.path.exists(temporary_directory_path):
@@ -79,7 +81,6 @@ def generate_single_track(original_midi_filepath, temporary_directory_path, tran
 
     # # Generate the output
     generated_tensor = torch.zeros_like(input_tensor)
-    batch_size = 10
     with torch.no_grad():
         for batch in range(0, input_tensor.shape[0], batch_size):
             batch_generated = generator(input_tensor.narrow(0, batch, batch_size))
@@ -0,0 +1,122 @@
+import numpy as np
+import h5py
+
+# Relative amplitudes of the harmonics of the two synthetic instruments, the input instrument has a darker timbre
+TARGET_HARMONIC_DECAY = 1.
+INPUT_HARMONIC_DECAY = 2.
+
+
+def get_note_frequencies(rng, n_notes, min_midi=36, max_midi=96):
+    """
+    Draws random notes on the range of a piano.
+    :param rng: random generator (numpy Generator).
+    :param n_notes: number of notes (scalar int).
+    :param min_midi: lowest MIDI note number (scalar int).
+    :param max_midi: highest MIDI note number (scalar int).
+    :return: fundamental frequencies in Hz (numpy array).
+    """
+    midi_notes = rng.integers(min_midi, max_midi, size=n_notes)
+    return 440. * 2. ** ((midi_notes - 69) / 12.)
+
+
+def render_notes(frequencies, onsets, decays, amplitudes, window_length, fs, harmonic_decay, max_frequency):
+    """
+    Renders notes as sums of harmonics with exponentially decaying envelopes. Only the harmonics below max_frequency
+    are added, the signal is therefore band-limited.
+    :param frequencies: fundamental frequency of each note in Hz (numpy array).
+    :param onsets: start of each note in samples (numpy array).
+    :param decays: decay rate of each note in 1/s (numpy array).
+    :param amplitudes: amplitude of each note (numpy array).
+    :param window_length: number of samples (scalar int).
+    :param fs: sampling frequency in Hz (scalar int).
+    :param harmonic_decay: exponent of the decay of the harmonic amplitudes, 1 / k ** harmonic_decay (scalar float).
+    :param max_frequency: highest frequency of the harmonics in Hz (scalar float).
+    :return: signal (numpy array).
+    """
+    t = np.arange(window_length) / fs
+    x = np.zeros(window_length)
+    for frequency, onset, decay, amplitude in zip(frequencies, onsets, decays, amplitudes):
+        t_note = np.clip(t - onset / fs, 0., None)
+        envelope = amplitude * (t >= onset / fs) * np.exp(-decay * t_note)
+        n_harmonics = max(1, int(max_frequency // frequency))
+        for k in range(1, n_harmonics + 1):
+            x += envelope * np.sin(2 * np.pi * k * frequency * t_note) / k ** harmonic_decay
+    return x
+
+
+def generate_pair(rng, window_length, fs=16000, max_notes=4, input_bandwidth=4000.):
+    """
+    Generates a pair of windows playing the same notes with two synthetic instruments. The target is band-limited to
+    the Nyquist frequency, the input instrument has weaker harmonics and is further band-limited to input_bandwidth,
+    which mimics the instrument change and the loss of the high frequencies of the MAESTRO pairs.
+    :param rng: random generator (numpy Generator).
+    :param window_length: number of samples per window (scalar int).
+    :param fs: sampling frequency in Hz (scalar int).
+    :param max_notes: maximum number of notes per window (scalar int).
+    :param input_bandwidth: highest frequency of the input in Hz (scalar float).
+    :return: input and target windows (tuple of numpy arrays).
+    """
+    n_notes = rng.integers(1, max_notes + 1)
+    frequencies = get_note_frequencies(rng, n_notes)
+    onsets = rng.integers(0, window_length // 2, size=n_notes)
+    decays = rng.uniform(1., 8., size=n_notes)
+    amplitudes = rng.uniform(.2, 1., size=n_notes)
+    x_target = render_notes(frequencies, onsets, decays, amplitudes, window_length, fs, TARGET_HARMONIC_DECAY, fs / 2)
+    x_input = render_notes(frequencies, onsets, decays, amplitudes, window_length, fs, INPUT_HARMONIC_DECAY,
+                           input_bandwidth)
+
+    # Same peak level as the normalized tracks
+    scale = .9 / max(np.abs(x_target).max(), 1e-6)
+    return (scale * x_input).astype(np.float32), (scale * x_target).astype(np.float32)
+
+
+def generate_phase(n_windows, window_length, seed, **kwargs):
+    """
+    :param n_windows: number of pairs (scalar int).
+    :param window_length: number of samples per window (scalar int).
+    :param seed: seed of the random generator (scalar int).
+    :param kwargs: parameters of generate_pair.
+    :return: input and target windows with shape [n_windows, 1, window_length] (tuple of numpy arrays).
+    """
+    rng = np.random.default_rng(seed)
+    pairs = [generate_pair(rng, window_length, **kwargs) for _ in range(n_windows)]
+    input_data = np.stack([x_input for x_input, _ in pairs])[:, None]
+    target_data = np.stack([x_target for _, x_target in pairs])[:, None]
+    return input_data, target_data
+
+
+def create_synthetic_npy_files(savepath, n_windows, window_length=8192, seed=0, **kwargs):
+    """
+    Creates one .npy file per phase with the layout of create_npy_files: [n_windows, 2, window_length], the input
+    being stored at index 0 of the second axis and the target at index 1.
+    :param savepath: location of the file of each phase (dictionary of strings).
+    :param n_windows: number of pairs of each phase (dictionary of scalar int).
+    :param window_length: number of samples per window (scalar int).
+    :param seed: seed of the random generator, each phase uses its own seed (scalar int).
+    :param kwargs: parameters of generate_pair.
+    :return: None
+    """
+    for i, phase in enumerate(['train', 'test', 'valid']):
+        input_data, target_data = generate_phase(n_windows[phase], window_length, seed + i, **kwargs)
+        np.save(savepath[phase], np.concatenate([input_data, target_data], axis=1))
+
+
+def create_synthetic_hdf5_file(hdf5_path, n_windows, window_length=8192, seed=0, **kwargs):
+    """
+    Creates a .hdf5 file with the layout of create_hdf5_file: one group per phase holding the 'input' and 'target'
+    datasets with shape [n_windows, 1, window_length].
+    :param hdf5_path: location of the file (string).
+    :param n_windows: number of pairs of each phase (dictionary of scalar int).
+    :param window_length: number of samples per window (scalar int).
+    :param seed: seed of the random generator, each phase uses its own seed (scalar int).
+    :param kwargs: parameters of generate_pair.
+    :return: None
+    """
+    with h5py.File(hdf5_path, 'w') as hdf:
+        for i, phase in enumerate(['train', 'test', 'valid']):
+            input_data, target_data = generate_phase(n_windows[phase], window_length, seed + i, **kwargs)
+            hdf.create_group(name=phase)
+            chunks = (min(32, n_windows[phase]), 1, window_length)
+            hdf[phase].create_dataset(name='input', data=input_data, maxshape=(None, 1, window_length), chunks=chunks)
+            hdf[phase].create_dataset(name='target', data=target_data, maxshape=(None, 1, window_length),
+                                      chunks=chunks)
@@ -1,14 +1,16 @@
 from utils.utils import prepare_maestro_data
 from trainers.autoencoder_trainer import AutoEncoderTrainer
-from utils.constants_parser import get_general_args
+from utils.constants_parser import get_general_args, str2bool
+from utils.memory_planner import auto_tune_batch_size
 import argparse
 import os
 
 
-def get_autoencoder_trainer_args():
+def get_autoencoder_trainer_args(args=None):
     """
     Parses the arguments related to the training of the auto-encoder if provided by the user, otherwise uses default
     values.
+    :param args: list of strings to parse, defaults to the command line arguments.
     :return: Parsed arguments.
     """
     parser = argparse.ArgumentParser(description='Trains the auto-encoder.')
@@ -47,7 +49,13 @@ def get_autoencoder_trainer_args():
     parser.add_argument('--scheduler_gamma', default=0.5, type=float,
                         help='Factor by which the learning rate is reduced after a specified number of steps.')
     parser.add_argument('--epochs', default=10, type=int, help='Number of epochs to train the models on.')
-    args = parser.parse_args()
+    parser.add_argument('--dual_stream_step', default=False, type=str2bool,
+                        help='Flag indicating if the input and target samples of a step are reconstructed with a single '
+                             'forward and backward pass on their concatenation instead of two passes. The losses are '
+                             'the same but the activations of both streams are kept at once, which doubles the peak '
+                             'memory of the step. Compare both settings with benchmarks/benchmark_autoencoder_step.py '
+                             'before enabling it.')
+    args, _ = parser.parse_known_args(args)
     return args
 
 
@@ -77,6 +85,9 @@ if __name__ == '__main__':
     # Get the general parameters
     general_args = get_general_args()
 
+    # Choose the train batch size w.r.t. the memory budget if required
+    auto_tune_batch_size(general_args, trainer_args, 'autoencoder')
+
     autoencoder_trainer = get_autoencoder_trainer(general_args, trainer_args)
 
     # Start training
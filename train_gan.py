@@ -1,12 +1,14 @@
-from utils.constants_parser import get_general_args
+from utils.constants_parser import get_general_args, str2bool
+from utils.memory_planner import auto_tune_batch_size
 from trainers.gan_trainer import GanTrainer
 from utils.utils import prepare_maestro_data
 import argparse
 
 
-def get_gan_trainer_args():
+def get_gan_trainer_args(args=None):
     """
     Parses the arguments related to the training of the gan if provided by the user, otherwise uses default values.
+    :param args: list of strings to parse, defaults to the command line arguments.
     :return: Parsed arguments.
     """
     parser = argparse.ArgumentParser(description='Trains the GAN.')
@@ -55,6 +57,17 @@ def get_gan_trainer_args():
                         type=str,
                         help='Location of a pre-trained auto-encoder used to extract features from the samples. If not '
                              'provided the gan will be trained without the auto-encoder loss.')
+    parser.add_argument('--precompute_target_embeddings', default=True, type=str2bool,
+                        help='Flag indicating if the embeddings of the train targets are computed once and stored in a '
+                             'memory-mapped file next to the data set, keyed by the hash of the auto-encoder '
+                             'checkpoint and by the size and modification time of the data file. Only the generated '
+                             'batches then go through the auto-encoder.')
+    parser.add_argument('--autoencoder_precision', default='float32', type=str,
+                        choices=['float32', 'float16', 'bfloat16'],
+                        help='Precision of the forward pass of the frozen auto-encoder on the generated batches. '
+                             'Reduced precision is only used on the GPU. The precomputed target embeddings are always '
+                             'in float32, a reduced precision therefore biases the auto-encoder loss by the rounding '
+                             'error of the generated side.')
 
     # Generator related constants
     parser.add_argument('--generator_path', default=None, type=str,
@@ -73,7 +86,7 @@ def get_gan_trainer_args():
                         help='Number of steps before the learning step is reduced by a factor gamma.')
     parser.add_argument('--discriminator_scheduler_gamma', default=0.5, type=float,
                         help='Factor by which the learning rate is reduced after a specified number of steps.')
-    args = parser.parse_args()
+    args, _ = parser.parse_known_args(args)
     return args
 
 
@@ -102,6 +115,9 @@ if __name__ == '__main__':
     # Get the general parameters
     general_args = get_general_args()
 
+    # Choose the train batch size w.r.t. the memory budget if required
+    auto_tune_batch_size(general_args, trainer_args, 'gan')
+
     # Get the trainer
     gan_trainer = get_gan_trainer(general_args, trainer_args)
 
@@ -1,13 +1,16 @@
 from trainers.generator_trainer import GeneratorTrainer
+from utils.distributed import init_distributed, cleanup_distributed
 from utils.constants_parser import get_general_args
+from utils.memory_planner import auto_tune_batch_size
 from utils.utils import prepare_maestro_data
 import argparse
 
 
-def get_generator_trainer_args():
+def get_generator_trainer_args(args=None):
     """
     Parses the arguments related to the training of the generator if provided by the user, otherwise uses default
     values.
+    :param args: list of strings to parse, defaults to the command line arguments.
     :return: Parsed arguments.
     """
     parser = argparse.ArgumentParser(description='Trains the generator.')
@@ -50,7 +53,7 @@ def get_generator_trainer_args():
     parser.add_argument('--lambda_freq', default=100., type=float,
                         help='Weight given to the l2 loss in frequency domain during the generator training')
     parser.add_argument('--epochs', default=10, type=int, help='Number of epochs to train the models on.')
-    args = parser.parse_args()
+    args, _ = parser.parse_known_args(args)
     return args
 
 
@@ -80,8 +83,15 @@ if __name__ == '__main__':
     # Get the general parameters
     general_args = get_general_args()
 
+    # Join the process group if the training is distributed
+    init_distributed(general_args)
+
+    # Choose the train batch size w.r.t. the memory budget if required
+    auto_tune_batch_size(general_args, trainer_args, 'generator')
+
     # Get the trainer
     generator_trainer = get_generator_trainer(general_args, trainer_args)
 
     # Start training
-    generator_trainer.train(epochs=trainer_args.epochs)
\ No newline at end of file
+    generator_trainer.train(epochs=trainer_args.epochs)
+    cleanup_distributed()
\ No newline at end of file
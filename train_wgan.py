@@ -1,12 +1,15 @@
+from utils.distributed import init_distributed, cleanup_distributed
 from utils.constants_parser import get_general_args
+from utils.memory_planner import auto_tune_batch_size
 from trainers.wgan_trainer import WGanTrainer
 from utils.utils import prepare_maestro_data
 import argparse
 
 
-def get_wgan_trainer_args():
+def get_wgan_trainer_args(args=None):
     """
     Parses the arguments related to the training of the gan if provided by the user, otherwise uses default values.
+    :param args: list of strings to parse, defaults to the command line arguments.
     :return: Parsed arguments.
     """
     parser = argparse.ArgumentParser(description='Trains the GAN.')
@@ -50,6 +53,14 @@ def get_wgan_trainer_args():
                         help='Maximum absolute value for the weights of the discriminator.')
     parser.add_argument('--gamma_wgan_gp', default=10, type=float,
                         help='Weight given to the gradient penalty in the discriminator loss.')
+    parser.add_argument('--penalty_type', default='gp', choices=['gp', 'r1'], type=str,
+                        help='Penalty used with use_penalty, either "gp" for the gradient penalty on interpolated '
+                             'samples or "r1" for the squared gradient norm on real samples.')
+    parser.add_argument('--penalty_interval', default=1, type=int,
+                        help='Number of discriminator steps between two computations of the penalty (lazy '
+                             'regularization), the weight of the penalty is scaled by this interval.')
+    parser.add_argument('--penalty_fraction', default=1., type=float,
+                        help='Fraction of the samples of each batch on which the penalty is computed.')
     parser.add_argument('--n_critic', default=1, type=int,
                         help='Number of discriminator update before doing a single generator update.')
     parser.add_argument('--coupling_epoch', default=0, type=int,
@@ -73,7 +84,7 @@ def get_wgan_trainer_args():
                         help='Number of steps before the learning step is reduced by a factor gamma.')
     parser.add_argument('--discriminator_scheduler_gamma', default=0.5, type=float,
                         help='Factor by which the learning rate is reduced after a specified number of steps.')
-    args = parser.parse_args()
+    args, _ = parser.parse_known_args(args)
     return args
 
 
@@ -102,8 +113,15 @@ if __name__ == '__main__':
     # Get the general parameters
     general_args = get_general_args()
 
+    # Join the process group if the training is distributed
+    init_distributed(general_args)
+
+    # Choose the train batch size w.r.t. the memory budget if required
+    auto_tune_batch_size(general_args, trainer_args, 'wgan')
+
     # Get the trainer
     gan_trainer = get_wgan_trainer(general_args, trainer_args)
 
     # Start training
     gan_trainer.train(epochs=trainer_args.epochs)
+    cleanup_distributed()
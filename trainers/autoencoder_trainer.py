@@ -1,5 +1,8 @@
 from models.autoencoder import AutoEncoder
 from trainers.base_trainer import Trainer
+from utils.checkpoints import filter_optimizer_state_dict
+from utils.distributed import get_adam_optimizer
+from utils.compilation import compile_model
 from torch.optim import lr_scheduler
 from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
@@ -20,22 +23,63 @@ class AutoEncoderTrainer(Trainer):
         self.autoencoder = AutoEncoder(general_args=general_args).to(self.device)
 
         # Optimizer and scheduler
-        self.optimizer = torch.optim.Adam(params=self.autoencoder.parameters(), lr=trainer_args.lr)
+        self.optimizer = get_adam_optimizer(self.autoencoder.parameters(), lr=trainer_args.lr,
+                                            implementation=general_args.adam_implementation)
         self.scheduler = lr_scheduler.StepLR(optimizer=self.optimizer,
                                              step_size=trainer_args.scheduler_step,
                                              gamma=trainer_args.scheduler_gamma)
 
+        # Store the losses in a log next to the checkpoints
+        self.init_loss_log(self.savepath or self.loadpath, resume=os.path.exists(self.loadpath))
+
         # Load saved states
         if os.path.exists(trainer_args.loadpath):
             self.load()
 
+        # Profile the first training steps if required
+        self.start_profiler(general_args, {'autoencoder': self.autoencoder})
+        self.start_telemetry(general_args)
+
+        # Run the model in graph mode if required
+        compile_model(self.autoencoder, general_args)
+
         # Loss function
         self.time_criterion = nn.MSELoss()
-        self.frequency_criterion = nn.MSELoss()
 
         # Boolean to differentiate generator from auto-encoder
         self.is_autoencoder = True
 
+        # Train on the input and target samples with a single forward and backward pass
+        self.dual_stream_step = trainer_args.dual_stream_step
+
+    def compute_dual_stream_losses(self, input_batch, target_batch):
+        """
+        Reconstructs the input and target batches with a single forward pass on their concatenation and a single STFT
+        per resolution. Each stream is averaged over its own samples, the losses are therefore the ones of two separate
+        passes as the auto-encoder has no batch statistics.
+        :param input_batch: batch of input data (torch tensor).
+        :param target_batch: batch of target data (torch tensor).
+        :return: time and frequency losses of the input stream followed by the ones of the target stream (tuple of
+        torch tensors).
+        """
+        data_batch = torch.cat([input_batch, target_batch])
+        generated_batch, _ = self.autoencoder(data_batch)
+
+        # Squared error of each sample and spectrograms of all the samples
+        time_l2 = (generated_batch - data_batch).pow(2).flatten(start_dim=1).mean(dim=1)
+        generated_spectrograms, data_spectrograms = self.spectrogram.get_pair_spectrograms(
+            generated_batch, data_batch, resolutions=self.spectrogram.loss_resolutions)
+
+        # Split the losses w.r.t. the stream
+        losses = []
+        n_samples = input_batch.shape[0]
+        for stream in [slice(None, n_samples), slice(n_samples, None)]:
+            losses.append(time_l2[stream].mean())
+            losses.append(self.spectrogram.l2_loss_from_spectrograms(
+                {key: value[stream] for key, value in generated_spectrograms.items()},
+                {key: value[stream] for key, value in data_spectrograms.items()}))
+        return tuple(losses)
+
     def train(self, epochs):
         """
         Trains the auto-encoder for a given number of pseudo-epochs
@@ -45,43 +89,61 @@ class AutoEncoderTrainer(Trainer):
         for epoch in range(epochs):
             self.autoencoder.train()
             for i in range(self.train_batches_per_epoch):
-                data_batch = next(self.train_loader_iter)
-                # Transfer to GPU
-                input_batch, target_batch = data_batch[0].to(self.device), data_batch[1].to(self.device)
+                # Get the micro-batches of the step, transferred to GPU
+                micro_batches = self.get_train_micro_batches()
 
-                # Concatenate the input and target signals along first dimension and transfer to GPU
                 self.optimizer.zero_grad()
-
-                # Train with input samples
-                generated_batch, _ = self.autoencoder(input_batch)
-                specgram_input_batch = self.spectrogram(input_batch)
-                specgram_generated_batch = self.spectrogram(generated_batch)
-
-                # Compute the input losses
-                input_time_l2_loss = self.time_criterion(generated_batch, input_batch)
-                input_freq_l2_loss = self.frequency_criterion(specgram_generated_batch, specgram_input_batch)
-                input_loss = input_time_l2_loss + input_freq_l2_loss
-                input_loss.backward()
-
-                # Train with target samples
-                generated_batch, _ = self.autoencoder(target_batch)
-                specgram_target_batch = self.spectrogram(target_batch)
-                specgram_generated_batch = self.spectrogram(generated_batch)
-
-                # Compute the input losses
-                target_time_l2_loss = self.time_criterion(generated_batch, target_batch)
-                target_freq_l2_loss = self.frequency_criterion(specgram_generated_batch, specgram_target_batch)
-                target_loss = target_time_l2_loss + target_freq_l2_loss
-                target_loss.backward()
+                self.telemetry.mark('optimizer')
+                batch_losses = {'time_l2': [], 'freq_l2': []}
+                for input_batch, target_batch in micro_batches:
+                    if self.dual_stream_step:
+                        # Train with input and target samples at once, the gradients are averaged over the
+                        # micro-batches
+                        input_time_l2_loss, input_freq_l2_loss, target_time_l2_loss, target_freq_l2_loss = \
+                            self.compute_dual_stream_losses(input_batch, target_batch)
+                        loss = input_time_l2_loss + input_freq_l2_loss + target_time_l2_loss + target_freq_l2_loss
+                        self.telemetry.mark('generator_forward')
+                        (loss / self.accumulation_steps).backward()
+                        self.telemetry.mark('backward')
+                    else:
+                        # Train with input samples
+                        generated_batch, _ = self.autoencoder(input_batch)
+
+                        # Compute the input losses, the gradients are averaged over the micro-batches
+                        input_time_l2_loss = self.time_criterion(generated_batch, input_batch)
+                        input_freq_l2_loss = self.spectrogram.l2_loss(generated_batch, input_batch)
+                        input_loss = input_time_l2_loss + input_freq_l2_loss
+                        self.telemetry.mark('generator_forward')
+                        (input_loss / self.accumulation_steps).backward()
+                        self.telemetry.mark('backward')
+
+                        # Train with target samples
+                        generated_batch, _ = self.autoencoder(target_batch)
+
+                        # Compute the input losses
+                        target_time_l2_loss = self.time_criterion(generated_batch, target_batch)
+                        target_freq_l2_loss = self.spectrogram.l2_loss(generated_batch, target_batch)
+                        target_loss = target_time_l2_loss + target_freq_l2_loss
+                        self.telemetry.mark('generator_forward')
+                        (target_loss / self.accumulation_steps).backward()
+                        self.telemetry.mark('backward')
+
+                    # Store losses
+                    batch_losses['time_l2'].append(input_time_l2_loss + target_time_l2_loss)
+                    batch_losses['freq_l2'].append(input_freq_l2_loss + target_freq_l2_loss)
 
                 # Update weights
                 self.optimizer.step()
+                self.telemetry.mark('optimizer')
 
-                # Store losses
-                self.train_losses['time_l2'].append((input_time_l2_loss + target_time_l2_loss).item())
-                self.train_losses['freq_l2'].append((input_freq_l2_loss + target_freq_l2_loss).item())
+                # Store the losses of the step
+                self.loss_accumulator.append_mean(batch_losses['time_l2'], 'time_l2')
+                self.loss_accumulator.append_mean(batch_losses['freq_l2'], 'freq_l2')
+                self.telemetry.end_step()
 
             # Print message
+            self.loss_accumulator.flush(self.train_losses)
+            self.telemetry.flush(self.epoch)
             message = 'Train, epoch {}: \n' \
                       '\t Time: {} \n' \
                       '\t Frequency: {} \n'.format(
@@ -107,24 +169,23 @@ class AutoEncoderTrainer(Trainer):
         """
         with torch.no_grad():
             self.autoencoder.eval()
-            batch_losses = {'time_l2': [], 'freq_l2': []}
-            for i in range(self.valid_batches_per_epoch):
-                # Transfer to GPU
-                data_batch = next(self.valid_loader_iter)
-                data_batch = torch.cat(data_batch).to(self.device)
-
-                # Forward pass
-                generated_batch, _ = self.autoencoder.forward(data_batch)
-
-                # Get the spectrogram
-                specgram_batch = self.spectrogram(data_batch)
-                specgram_generated_batch = self.spectrogram(generated_batch)
-
-                # Compute and store the loss
-                time_l2_loss = self.time_criterion(generated_batch, data_batch)
-                freq_l2_loss = self.frequency_criterion(specgram_generated_batch, specgram_batch)
-                batch_losses['time_l2'].append(time_l2_loss.item())
-                batch_losses['freq_l2'].append(freq_l2_loss.item())
+            if self.validation_set is not None:
+                batch_losses = self.evaluate_validation_set(self.autoencoder)
+            else:
+                batch_losses = {'time_l2': [], 'freq_l2': []}
+                for i in range(self.valid_batches_per_epoch):
+                    # Transfer to GPU
+                    data_batch = next(self.valid_loader_iter)
+                    data_batch = torch.cat(data_batch).to(self.device)
+
+                    # Forward pass
+                    generated_batch, _ = self.autoencoder.forward(data_batch)
+
+                    # Compute and store the loss
+                    time_l2_loss = self.time_criterion(generated_batch, data_batch)
+                    freq_l2_loss = self.spectrogram.l2_loss(generated_batch, data_batch)
+                    batch_losses['time_l2'].append(time_l2_loss.item())
+                    batch_losses['freq_l2'].append(freq_l2_loss.item())
 
             # Store the validation losses
             self.valid_losses['time_l2'].append(np.mean(batch_losses['time_l2']))
@@ -146,15 +207,13 @@ class AutoEncoderTrainer(Trainer):
         Saves the model(s), optimizer(s), scheduler(s) and losses
         :return: None
         """
-        torch.save({
+        self.save_checkpoint({
             'epoch': self.epoch,
             'autoencoder_state_dict': self.autoencoder.state_dict(),
             'optimizer_state_dict': self.optimizer.state_dict(),
             'scheduler_state_dict': self.scheduler.state_dict(),
-            'train_losses': self.train_losses,
-            'test_losses': self.test_losses,
-            'valid_losses': self.valid_losses
-        }, self.savepath)
+            **self.get_loss_log_state()
+        })
 
     def load(self):
         """
@@ -164,11 +223,11 @@ class AutoEncoderTrainer(Trainer):
         checkpoint = torch.load(self.loadpath, map_location=self.device)
         self.epoch = checkpoint['epoch']
         self.autoencoder.load_state_dict(checkpoint['autoencoder_state_dict'])
-        self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        optimizer_state_dict = filter_optimizer_state_dict(checkpoint['optimizer_state_dict'],
+                                                           checkpoint['autoencoder_state_dict'], self.autoencoder)
+        self.optimizer.load_state_dict(optimizer_state_dict)
         self.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
-        self.train_losses = checkpoint['train_losses']
-        self.test_losses = checkpoint['test_losses']
-        self.valid_losses = checkpoint['valid_losses']
+        self.load_losses(checkpoint)
 
     def plot_autoencoder_embedding_space(self, n_batches, fig_savepath=None):
         """
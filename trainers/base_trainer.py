@@ -1,9 +1,25 @@
-from torchaudio.transforms import Spectrogram, AmplitudeToDB
+from torchaudio.transforms import AmplitudeToDB
+from utils.loss_log import LossLog, get_loss_log_directory
+from utils.distributed import any_process, get_rank, is_main_process
+from utils.loss_accumulator import LossAccumulator
+from utils.evaluation_worker import get_metrics_path, read_metrics, start_evaluation_worker, stop_evaluation_worker
+from utils.validation_set import ValidationSet, inference_mode
+from utils.checkpoints import CheckpointWriter
+from utils.profiling import get_training_profiler
+from utils.telemetry import StepTelemetry
+from layers.stft import STFTEngine
+from torch.nn import functional as F
 import matplotlib.pyplot as plt
 from itertools import cycle
 import numpy as np
+import threading
+import signal
+import atexit
 import torch
+import copy
 import abc
+import sys
+import os
 
 
 class Trainer(abc.ABC):
@@ -21,6 +37,15 @@ class Trainer(abc.ABC):
         self.valid_loader_iter = cycle(iter(self.valid_loader))
         self.test_loader_iter = cycle(iter(self.test_loader))
 
+        # Additional tensors of the current training micro-batches, set by get_train_micro_batches
+        self.micro_batch_extras = []
+
+        # Profiler of the first training steps, set by start_profiler if required
+        self.training_profiler = None
+
+        # Telemetry of the training steps, enabled by start_telemetry if required
+        self.telemetry = StepTelemetry(type(self).__name__, self.device)
+
         # Epoch counter
         self.epoch = 0
 
@@ -56,8 +81,16 @@ class Trainer(abc.ABC):
             }
         }
 
-        # Time to frequency converter
-        self.spectrogram = Spectrogram(normalized=True, n_fft=512, hop_length=128).to(self.device)
+        # Losses of the training steps kept on the device until they are flushed in train_losses
+        self.loss_accumulator = LossAccumulator()
+
+        # Log storing the losses, set by init_loss_log
+        self.loss_log = None
+        self.loss_log_capacity = general_args.loss_log_capacity
+
+        # Time to frequency converter, shared by the frequency losses, the metrics and the plots
+        self.spectrogram = STFTEngine(resolutions=[(n_fft, n_fft // 4) for n_fft in general_args.stft_n_ffts],
+                                      normalized=True).to(self.device)
         self.amplitude_to_db = AmplitudeToDB()
 
         # Boolean indicting if auto-encoder or generator
@@ -71,12 +104,45 @@ class Trainer(abc.ABC):
         self.test_batches_per_epoch = general_args.test_batches_per_epoch
         self.valid_batches_per_epoch = general_args.valid_batches_per_epoch
 
+        # Number of micro-batches per optimizer step
+        self.accumulation_steps = general_args.accumulation_steps
+
+        # Writer of the checkpoints, instantiated by the first call to save_checkpoint
+        self.checkpoint_writer = None
+        self.checkpoint_keep_last = general_args.checkpoint_keep_last
+        self.checkpoint_keep_best = general_args.checkpoint_keep_best
+        self.async_checkpoint = general_args.async_checkpoint
+
+        # Save and exit at the next optimizer step on SIGTERM, e.g. when a preemptible machine is reclaimed
+        self.stop_requested = False
+        self.save_on_sigterm = general_args.save_on_sigterm
+        if self.save_on_sigterm and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.request_stop)
+
+        # Evaluation of the checkpoints by a background process, set by start_background_eval
+        self.background_eval = general_args.background_eval
+        self.evaluation_process = None
+        self.evaluation_stop = None
+        self.metrics_path = None
+        self.metrics_offset = 0
+
+        # Fixed subset of the validation set loaded once, None to draw new batches from the data loader at each epoch
+        self.validation_set = None
+        if general_args.cache_validation_set:
+            self.validation_set = ValidationSet(self.valid_loader, self.valid_batches_per_epoch, self.device,
+                                                on_device=general_args.validation_set_on_device,
+                                                batch_size=general_args.validation_batch_size)
+
     def generate_single_validation_batch(self, model):
         """
-        Loads a batch
+        Loads a batch. With the cached validation set, the outputs computed by the validation of the current epoch are
+        reused.
         :param model: pre-trained model used to generate the fake samples
         :return: low resolution, high resolution and fake sample as torch tensor with dimension [B, 1, W]
         """
+        if self.validation_set is not None:
+            return self.validation_set.get_first_batch(model, self.epoch, self.valid_loader.batch_size,
+                                                       self.is_autoencoder)
         model.eval()
         with torch.no_grad():
             data_batch = next(self.valid_loader_iter)
@@ -87,8 +153,263 @@ class Trainer(abc.ABC):
                 generated_batch = model(input_batch)
         return input_batch, target_batch, generated_batch
 
+    def evaluate_validation_set(self, model, use_frequency=True):
+        """
+        Computes the validation losses of a model on the cached validation set. The outputs are kept for the plots of
+        the current epoch.
+        :param model: generator or auto-encoder (nn.Module).
+        :param use_frequency: boolean indicating if the loss in frequency domain is computed (boolean).
+        :return: mean losses over the subset, stored as single-entry lists (dictionary).
+        """
+        generated_batches = self.validation_set.generate(model, self.epoch, self.is_autoencoder)
+        time_l2, freq_l2 = [], []
+        with inference_mode():
+            for (input_batch, target_batch), generated_batch in zip(self.validation_set.get_batches(),
+                                                                    generated_batches):
+                if self.is_autoencoder:
+                    target_batch = torch.cat([input_batch, target_batch])
+
+                # Weight the losses by the number of samples of the batch, the last batch can be smaller
+                n_samples = generated_batch.shape[0]
+                time_l2.append(F.mse_loss(generated_batch, target_batch) * n_samples)
+                if use_frequency:
+                    freq_l2.append(self.spectrogram.l2_loss(generated_batch, target_batch) * n_samples)
+            n_samples = sum(generated_batch.shape[0] for generated_batch in generated_batches)
+            losses = torch.stack([torch.stack(time_l2).sum()] + ([torch.stack(freq_l2).sum()] if use_frequency else []))
+            losses = (losses / n_samples).tolist()
+        if use_frequency:
+            return {'time_l2': [losses[0]], 'freq_l2': [losses[1]]}
+        return {'time_l2': [losses[0]]}
+
+    def get_train_micro_batches(self):
+        """
+        Loads the micro-batches of a single optimizer step. They are transferred to the device once and shared by all
+        the updates of the step.
+        The additional tensors of the batches, e.g. the precomputed target embeddings, are stored in
+        self.micro_batch_extras.
+        :return: list of accumulation_steps (input_batch, target_batch) tuples (list of torch tensors).
+        """
+        self.check_stop_request()
+        if self.training_profiler is not None:
+            self.training_profiler.step()
+        self.telemetry.begin_step()
+        micro_batches = []
+        self.micro_batch_extras = []
+        for _ in range(self.accumulation_steps):
+            data_batch = next(self.train_loader_iter)
+            self.telemetry.mark('data_wait')
+            micro_batches.append((data_batch[0].to(self.device), data_batch[1].to(self.device)))
+            self.micro_batch_extras.append([tensor.to(self.device) for tensor in data_batch[2:]])
+            self.telemetry.mark('h2d')
+            self.telemetry.add_samples(data_batch[0].shape[0], data_batch[0].shape[-1])
+        return micro_batches
+
+    def start_profiler(self, general_args, models):
+        """
+        Profiles the blocks of the models during a few training steps if required, see utils.profiling.
+        :param general_args: argument parser that contains the arguments that are independent to the script being
+        executed.
+        :param models: models to profile, keyed by name (dictionary of nn.Module).
+        :return: None
+        """
+        self.training_profiler = get_training_profiler(models, self.device, self.savepath or self.loadpath,
+                                                       general_args)
+
+    def start_telemetry(self, general_args):
+        """
+        Measures the phases of the training steps if required, see utils.telemetry. The phases are delimited by the
+        calls to self.telemetry.mark in the training loops and the records are exported by self.telemetry.flush.
+        :param general_args: argument parser that contains the arguments that are independent to the script being
+        executed.
+        :return: None
+        """
+        self.telemetry = StepTelemetry(type(self).__name__, self.device, savepath=self.savepath or self.loadpath,
+                                       sample_rate=general_args.telemetry_sample_rate,
+                                       enabled=general_args.step_telemetry,
+                                       synchronize=general_args.telemetry_synchronize,
+                                       prometheus_path=general_args.prometheus_path)
+
+    def init_loss_log(self, savepath, resume):
+        """
+        Replaces the lists of losses by the series of a log stored next to the checkpoints. The values are written to
+        disk incrementally and only the last ones are kept in memory, the checkpoints store offsets in the log instead
+        of the losses. Must be called once the structure of the loss dictionaries is defined and before load().
+        :param savepath: location of the checkpoints (string).
+        :param resume: boolean indicating if the losses are restored from a checkpoint by load() (boolean).
+        :return: None
+        """
+        directory = get_loss_log_directory(savepath)
+        if not is_main_process():
+            directory = '{}_rank_{}'.format(directory, get_rank())
+        self.loss_log = LossLog(directory, self.loss_log_capacity)
+
+        # Start from an empty log unless the losses are restored from a checkpoint
+        if not resume:
+            self.loss_log.truncate({})
+        self.wrap_losses()
+
+    def wrap_losses(self):
+        """
+        Replaces the lists of the loss dictionaries by series of the loss log.
+        :return: None
+        """
+        self.train_losses = self.loss_log.wrap(self.train_losses, 'train')
+        self.test_losses = self.loss_log.wrap(self.test_losses, 'test')
+        self.valid_losses = self.loss_log.wrap(self.valid_losses, 'valid')
+
+    def get_loss_log_state(self):
+        """
+        :return: location of the loss log and length of each of its series, stored in the checkpoints instead of the
+        losses (dictionary).
+        """
+        return {'loss_log': self.loss_log.directory, 'loss_offsets': self.loss_log.get_offsets()}
+
+    def load_losses(self, checkpoint):
+        """
+        Restores the losses of a checkpoint in the loss log. The values logged after the checkpoint was saved are
+        dropped. Checkpoints of previous versions store the lists of losses, which are appended to the log.
+        :param checkpoint: loaded checkpoint (dictionary).
+        :return: None
+        """
+        if 'loss_offsets' not in checkpoint:
+            self.loss_log.truncate({})
+            self.train_losses = checkpoint['train_losses']
+            self.test_losses = checkpoint['test_losses']
+            self.valid_losses = checkpoint['valid_losses']
+        elif os.path.realpath(checkpoint['loss_log']) == self.loss_log.directory:
+            self.loss_log.truncate(checkpoint['loss_offsets'])
+        else:
+            # The checkpoint was saved by a run logging elsewhere
+            self.loss_log.truncate({})
+            self.loss_log.extend_from(checkpoint['loss_log'], checkpoint['loss_offsets'])
+        self.wrap_losses()
+
+    def get_validation_losses(self):
+        """
+        :return: validation losses used to select the best checkpoint, one entry per epoch (list or LossSeries).
+        """
+        return self.valid_losses['time_l2']
+
     def check_improvement(self):
-        self.need_saving = np.less_equal(self.valid_losses['time_l2'][-1], min(self.valid_losses['time_l2']))
+        valid_losses = self.get_validation_losses()
+        self.need_saving = np.less_equal(valid_losses[-1], min(valid_losses))
+
+    def save_checkpoint(self, state):
+        """
+        Hands the state of the trainer to the checkpoint writer. The state is copied to the CPU before returning and is
+        written to savepath in the background, together with the copies kept by the retention policy.
+        :param state: state of the trainer (dictionary).
+        :return: None
+        """
+        if self.checkpoint_writer is None:
+            self.checkpoint_writer = CheckpointWriter(self.savepath, keep_last=self.checkpoint_keep_last,
+                                                      keep_best=self.checkpoint_keep_best,
+                                                      asynchronous=self.async_checkpoint)
+        # With the background evaluation, the evaluation worker keeps the best checkpoint
+        valid_losses = self.get_validation_losses()
+        is_best = self.metrics_path is None and len(valid_losses) > 0 and valid_losses[-1] <= min(valid_losses)
+        self.checkpoint_writer.save(state, self.epoch, is_best=is_best)
+
+    def start_background_eval(self, general_args, trainer_args):
+        """
+        Starts the process evaluating the generator of each new checkpoint if the background evaluation is enabled.
+        The training is not blocked by the validation, the results are read from the metrics file at the end of the
+        following epochs. Only the main process starts a worker when the training is distributed.
+        :param general_args: argument parser that contains the arguments that are independent to the script being
+        executed.
+        :param trainer_args: argument parser that contains the arguments of the trainer, used by the worker to build
+        the validation data loader.
+        :return: None
+        """
+        if not self.background_eval or not is_main_process():
+            return
+
+        # Only the records of the checkpoints of this run are read
+        self.metrics_path = get_metrics_path(self.savepath)
+        self.metrics_offset = os.path.getsize(self.metrics_path) if os.path.exists(self.metrics_path) else 0
+        spectrogram = copy.deepcopy(self.spectrogram).to('cpu')
+        self.evaluation_process, self.evaluation_stop = start_evaluation_worker(self.savepath, spectrogram,
+                                                                                general_args, trainer_args)
+        atexit.register(self.stop_background_eval)
+
+    def stop_background_eval(self):
+        """
+        Stops the evaluation worker once the last checkpoint is written and evaluated.
+        :return: None
+        """
+        if self.evaluation_process is None:
+            return
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+        stop_evaluation_worker(self.evaluation_process, self.evaluation_stop)
+        self.evaluation_process = None
+
+    def store_background_metrics(self, record):
+        """
+        Stores the validation losses computed by the evaluation worker.
+        :param record: metrics of a checkpoint (dictionary).
+        :return: None
+        """
+        self.valid_losses['time_l2'].append(record['time_l2'])
+        self.valid_losses['freq_l2'].append(record['freq_l2'])
+
+    def read_background_eval(self):
+        """
+        Reads the metrics of the checkpoints evaluated since the last call and checks if the loss is decreasing.
+        :return: None
+        """
+        if self.metrics_path is None:
+            return
+        records, self.metrics_offset = read_metrics(self.metrics_path, self.metrics_offset)
+        for record in records:
+            self.store_background_metrics(record)
+            message = 'Validation, epoch {}: \n' \
+                      '\t Time: {} \n' \
+                      '\t Frequency: {} \n' \
+                      '\t SNR: {} +- {} \n' \
+                      '\t LSD: {} +- {} \n'.format(record['epoch'], record['time_l2'], record['freq_l2'],
+                                                   record['snr_mean'], record['snr_std'], record['lsd_mean'],
+                                                   record['lsd_std'])
+            print(message)
+        if records:
+            self.check_improvement()
+
+    def validate(self):
+        """
+        Runs the validation at the end of an epoch, either synchronously or by reading the results of the evaluation
+        worker.
+        :return: None
+        """
+        if self.background_eval:
+            self.read_background_eval()
+        else:
+            with torch.no_grad():
+                self.eval()
+
+    def request_stop(self, signum, frame):
+        """
+        Handler of SIGTERM, the training stops at the start of the next optimizer step where the models and optimizers
+        are in a consistent state. A second signal terminates the process immediately.
+        :param signum: number of the signal (scalar int).
+        :param frame: current stack frame.
+        :return: None
+        """
+        self.stop_requested = True
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    def check_stop_request(self):
+        """
+        Saves the trainer and exits if SIGTERM was received by any of the processes. The checkpoint holds the state
+        reached by the last optimizer step, the current epoch is restarted when the training is resumed.
+        :return: None
+        """
+        if not self.save_on_sigterm or not any_process(self.stop_requested):
+            return
+        self.loss_accumulator.flush(self.train_losses)
+        self.save()
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+        sys.exit(128 + signal.SIGTERM)
 
     def plot_reconstruction_time_domain(self, index, model):
         """
@@ -1,10 +1,15 @@
 from models.discriminator import Discriminator
-from torchaudio.transforms import Spectrogram
 from models.autoencoder import AutoEncoder
 from trainers.base_trainer import Trainer
+from utils.embeddings import add_target_embeddings, get_autocast, get_embeddings_path, get_train_datapath, \
+    prepare_target_embeddings
+from utils.checkpoints import filter_optimizer_state_dict
+from utils.distributed import get_adam_optimizer
+from utils.compilation import compile_model
 from models.generator import Generator
 from torch.optim import lr_scheduler
 from utils.metrics import snr, lsd
+from itertools import cycle
 from torch import nn
 import numpy as np
 import torch
@@ -18,13 +23,25 @@ class GanTrainer(Trainer):
         self.loadpath = trainer_args.loadpath
         self.savepath = trainer_args.savepath
 
-        # Load the auto-encoder
+        # Load the auto-encoder, frozen as it only provides the embeddings of the feature loss
         self.use_autoencoder = False
+        self.use_target_embeddings = False
         if trainer_args.autoencoder_path and os.path.exists(trainer_args.autoencoder_path):
             self.use_autoencoder = True
             self.autoencoder = AutoEncoder(general_args=general_args).to(self.device)
             self.load_pretrained_autoencoder(trainer_args.autoencoder_path)
             self.autoencoder.eval()
+            self.autoencoder.requires_grad_(False)
+            self.autoencoder_precision = trainer_args.autoencoder_precision
+
+            # The embeddings of the train targets are read from a file next to the data set
+            if trainer_args.precompute_target_embeddings:
+                embeddings_path = get_embeddings_path(get_train_datapath(trainer_args), trainer_args.autoencoder_path)
+                prepare_target_embeddings(self.autoencoder.encoder, train_loader.dataset, embeddings_path,
+                                          self.device, train_loader.batch_size, train_loader.num_workers)
+                self.train_loader = add_target_embeddings(train_loader, embeddings_path)
+                self.train_loader_iter = cycle(iter(self.train_loader))
+                self.use_target_embeddings = True
 
         # Load the generator
         self.generator = Generator(general_args=general_args).to(self.device)
@@ -34,9 +51,11 @@ class GanTrainer(Trainer):
         self.discriminator = Discriminator(general_args=general_args).to(self.device)
 
         # Optimizers and schedulers
-        self.generator_optimizer = torch.optim.Adam(params=self.generator.parameters(), lr=trainer_args.generator_lr)
-        self.discriminator_optimizer = torch.optim.Adam(params=self.discriminator.parameters(),
-                                                        lr=trainer_args.discriminator_lr)
+        self.generator_optimizer = get_adam_optimizer(self.generator.parameters(), lr=trainer_args.generator_lr,
+                                                      implementation=general_args.adam_implementation)
+        self.discriminator_optimizer = get_adam_optimizer(self.discriminator.parameters(),
+                                                          lr=trainer_args.discriminator_lr,
+                                                          implementation=general_args.adam_implementation)
         self.generator_scheduler = lr_scheduler.StepLR(optimizer=self.generator_optimizer,
                                                        step_size=trainer_args.generator_scheduler_step,
                                                        gamma=trainer_args.generator_scheduler_gamma)
@@ -44,14 +63,29 @@ class GanTrainer(Trainer):
                                                            step_size=trainer_args.discriminator_scheduler_step,
                                                            gamma=trainer_args.discriminator_scheduler_gamma)
 
+        # Store the losses in a log next to the checkpoints
+        self.init_loss_log(self.savepath or self.loadpath, resume=os.path.exists(self.loadpath))
+
         # Load saved states
         if os.path.exists(self.loadpath):
             self.load()
 
+        # Profile the first training steps if required
+        models = {'generator': self.generator, 'discriminator': self.discriminator}
+        if self.use_autoencoder:
+            models['autoencoder'] = self.autoencoder
+        self.start_profiler(general_args, models)
+        self.start_telemetry(general_args)
+
+        # Run the models in graph mode if required
+        compile_model(self.generator, general_args)
+        compile_model(self.discriminator, general_args)
+        if self.use_autoencoder:
+            compile_model(self.autoencoder.encoder, general_args)
+
         # Loss function and stored losses
         self.adversarial_criterion = nn.BCEWithLogitsLoss()
         self.generator_time_criterion = nn.MSELoss()
-        self.generator_frequency_criterion = nn.MSELoss()
         self.generator_autoencoder_criterion = nn.MSELoss()
 
         # Define labels
@@ -63,15 +97,18 @@ class GanTrainer(Trainer):
         self.lambda_freq = trainer_args.lambda_freq
         self.lambda_autoencoder = trainer_args.lambda_autoencoder
 
-        # Spectrogram converter
-        self.spectrogram = Spectrogram(normalized=True).to(self.device)
-
         # Boolean indicating if the model needs to be saved
         self.need_saving = True
 
         # Boolean if the generator receives the feedback from the discriminator
         self.use_adversarial = trainer_args.use_adversarial
 
+        # Run the discriminator on the real and generated batches with a single forward pass
+        self.fused_discriminator_pass = general_args.fused_discriminator_pass
+
+        # Evaluate the checkpoints in a background process if required
+        self.start_background_eval(general_args, trainer_args)
+
     def load_pretrained_generator(self, generator_path):
         """
         Loads a pre-trained generator. Can be used to stabilize the training.
@@ -90,6 +127,56 @@ class GanTrainer(Trainer):
         checkpoint = torch.load(autoencoder_path, map_location=self.device)
         self.autoencoder.load_state_dict(checkpoint['autoencoder_state_dict'])
 
+    def get_embedding(self, batch):
+        """
+        Embeds a batch with the frozen encoder of the auto-encoder, in reduced precision if required. The decoder is not
+        needed by the feature loss and is skipped.
+        :param batch: batch of signals (torch tensor).
+        :return: embedding of the batch in full precision (torch tensor).
+        """
+        with get_autocast(self.device, self.autoencoder_precision):
+            return self.autoencoder.encoder(batch).float()
+
+    def get_target_embedding(self, target_batch, micro_batch_index):
+        """
+        :param target_batch: batch of target data (torch tensor).
+        :param micro_batch_index: index of the micro-batch in the current step (scalar int).
+        :return: embedding of the target batch, precomputed if available (torch tensor).
+        """
+        if self.use_target_embeddings:
+            return self.micro_batch_extras[micro_batch_index][0]
+        with torch.no_grad():
+            return self.get_embedding(target_batch)
+
+    def train_discriminator_fused(self, input_batch, target_batch, keep_graph, batch_losses):
+        """
+        Computes the discriminator losses of a micro-batch on real and generated data with a single forward pass and
+        accumulates their gradients.
+        :param input_batch: batch of input data (torch tensor).
+        :param target_batch: batch of target data (torch tensor).
+        :param keep_graph: boolean indicating if the graph of the generated batch is kept to be reused by the generator
+        update (boolean).
+        :param batch_losses: losses of the step, the losses on real and generated data are appended (dictionary).
+        :return: generated batch (torch tensor).
+        """
+        with torch.set_grad_enabled(keep_graph):
+            generated_batch = self.generator(input_batch)
+        self.telemetry.mark('generator_forward')
+        output_real, output_generated = self.discriminator.forward_batches(target_batch, generated_batch.detach())
+
+        # Compute and store the discriminator losses, the gradients are averaged over the micro-batches
+        loss_discriminator_real = self.adversarial_criterion(output_real,
+                                                             torch.full_like(output_real, self.real_label))
+        loss_discriminator_generated = self.adversarial_criterion(output_generated,
+                                                                  torch.full_like(output_generated,
+                                                                                  self.generated_label))
+        batch_losses['real'].append(loss_discriminator_real)
+        batch_losses['fake'].append(loss_discriminator_generated)
+        self.telemetry.mark('discriminator_forward')
+        ((loss_discriminator_real + loss_discriminator_generated) / self.accumulation_steps).backward()
+        self.telemetry.mark('backward')
+        return generated_batch
+
     def train(self, epochs):
         """
         Trains the GAN for a given number of pseudo-epochs.
@@ -100,86 +187,127 @@ class GanTrainer(Trainer):
             for i in range(self.train_batches_per_epoch):
                 self.generator.train()
                 self.discriminator.train()
-                # Transfer to GPU
-                local_batch = next(self.train_loader_iter)
-                input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
-                batch_size = input_batch.shape[0]
+                # Get the micro-batches of the step, transferred to GPU
+                micro_batches = self.get_train_micro_batches()
+
+                # With a single micro-batch the generator update reuses the batch generated for the discriminator, with
+                # several micro-batches their graphs would all be kept alive at once and they are generated again
+                reuse_generated = self.accumulation_steps == 1
+                generated_batches = []
+                batch_losses = {'real': [], 'fake': [], 'generator_adversarial': [], 'time_l2': [], 'freq_l2': [],
+                                'autoencoder_l2': []}
 
                 ############################
                 # (1) Update D network: maximize log(D(x)) + log(1 - D(G(z)))
                 ###########################
-                # Train the discriminator with real data
                 self.discriminator_optimizer.zero_grad()
-                label = torch.full((batch_size,), self.real_label, device=self.device)
-                output = self.discriminator(target_batch)
-
-                # Compute and store the discriminator loss on real data
-                loss_discriminator_real = self.adversarial_criterion(output, torch.unsqueeze(label, dim=1))
-                self.train_losses['discriminator_adversarial']['real'].append(loss_discriminator_real.item())
-                loss_discriminator_real.backward()
-
-                # Train the discriminator with fake data
-                generated_batch = self.generator(input_batch)
-                label.fill_(self.generated_label)
-                output = self.discriminator(generated_batch.detach())
-
-                # Compute and store the discriminator loss on fake data
-                loss_discriminator_generated = self.adversarial_criterion(output, torch.unsqueeze(label, dim=1))
-                self.train_losses['discriminator_adversarial']['fake'].append(loss_discriminator_generated.item())
-                loss_discriminator_generated.backward()
+                self.telemetry.mark('optimizer')
+                for input_batch, target_batch in micro_batches:
+                    batch_size = input_batch.shape[0]
+                    if self.fused_discriminator_pass:
+                        generated_batches.append(self.train_discriminator_fused(input_batch, target_batch,
+                                                                                reuse_generated, batch_losses))
+                        continue
+
+                    # Train the discriminator with real data
+                    label = torch.full((batch_size,), self.real_label, device=self.device)
+                    output = self.discriminator(target_batch)
+
+                    # Compute and store the discriminator loss on real data, the gradients are averaged over the
+                    # micro-batches
+                    loss_discriminator_real = self.adversarial_criterion(output, torch.unsqueeze(label, dim=1))
+                    batch_losses['real'].append(loss_discriminator_real)
+                    self.telemetry.mark('discriminator_forward')
+                    (loss_discriminator_real / self.accumulation_steps).backward()
+                    self.telemetry.mark('backward')
+
+                    # Train the discriminator with fake data
+                    with torch.set_grad_enabled(reuse_generated):
+                        generated_batch = self.generator(input_batch)
+                    generated_batches.append(generated_batch)
+                    self.telemetry.mark('generator_forward')
+                    label.fill_(self.generated_label)
+                    output = self.discriminator(generated_batch.detach())
+
+                    # Compute and store the discriminator loss on fake data
+                    loss_discriminator_generated = self.adversarial_criterion(output, torch.unsqueeze(label, dim=1))
+                    batch_losses['fake'].append(loss_discriminator_generated)
+                    self.telemetry.mark('discriminator_forward')
+                    (loss_discriminator_generated / self.accumulation_steps).backward()
+                    self.telemetry.mark('backward')
 
                 # Update the discriminator weights
                 self.discriminator_optimizer.step()
+                self.telemetry.mark('optimizer')
 
                 ############################
                 # Update G network: maximize log(D(G(z)))
                 ###########################
                 self.generator_optimizer.zero_grad()
-
-                # Get the spectrogram
-                specgram_target_batch = self.spectrogram(target_batch)
-                specgram_fake_batch = self.spectrogram(generated_batch)
-
-                # Fake labels are real for the generator cost
-                label.fill_(self.real_label)
-                output = self.discriminator(generated_batch)
-
-                # Compute the generator loss on fake data
-                # Get the adversarial loss
-                loss_generator_adversarial = torch.zeros(size=[1], device=self.device)
-                if self.use_adversarial:
-                    loss_generator_adversarial = self.adversarial_criterion(output, torch.unsqueeze(label, dim=1))
-                self.train_losses['generator_adversarial'].append(loss_generator_adversarial.item())
-
-                # Get the L2 loss in time domain
-                loss_generator_time = self.generator_time_criterion(generated_batch, target_batch)
-                self.train_losses['time_l2'].append(loss_generator_time.item())
-
-                # Get the L2 loss in frequency domain
-                loss_generator_frequency = self.generator_frequency_criterion(specgram_fake_batch, specgram_target_batch)
-                self.train_losses['freq_l2'].append(loss_generator_frequency.item())
-
-                # Get the L2 loss in embedding space
-                loss_generator_autoencoder = torch.zeros(size=[1], device=self.device, requires_grad=True)
-                if self.use_autoencoder:
-                    # Get the embeddings
-                    _, embedding_target_batch = self.autoencoder(target_batch)
-                    _, embedding_generated_batch = self.autoencoder(generated_batch)
-                    loss_generator_autoencoder = self.generator_autoencoder_criterion(embedding_generated_batch,
-                                                                                      embedding_target_batch)
-                    self.train_losses['autoencoder_l2'].append(loss_generator_autoencoder.item())
-
-                # Combine the different losses
-                loss_generator = self.lambda_adv * loss_generator_adversarial + loss_generator_time + \
-                                 self.lambda_freq * loss_generator_frequency + \
-                                 self.lambda_autoencoder * loss_generator_autoencoder
-
-                # Back-propagate and update the generator weights
-                loss_generator.backward()
+                self.telemetry.mark('optimizer')
+                for k, ((input_batch, target_batch), generated_batch) in enumerate(zip(micro_batches,
+                                                                                       generated_batches)):
+                    if not reuse_generated:
+                        generated_batch = self.generator(input_batch)
+                        self.telemetry.mark('generator_forward')
+
+                    # Fake labels are real for the generator cost
+                    label = torch.full((input_batch.shape[0],), self.real_label, device=self.device)
+                    output = self.discriminator(generated_batch)
+                    self.telemetry.mark('discriminator_forward')
+
+                    # Compute the generator loss on fake data
+                    # Get the adversarial loss
+                    loss_generator_adversarial = torch.zeros(size=[1], device=self.device)
+                    if self.use_adversarial:
+                        loss_generator_adversarial = self.adversarial_criterion(output, torch.unsqueeze(label, dim=1))
+                    batch_losses['generator_adversarial'].append(loss_generator_adversarial)
+
+                    # Get the L2 loss in time domain
+                    loss_generator_time = self.generator_time_criterion(generated_batch, target_batch)
+                    batch_losses['time_l2'].append(loss_generator_time)
+
+                    # Get the L2 loss in frequency domain
+                    loss_generator_frequency = self.spectrogram.l2_loss(generated_batch, target_batch)
+                    batch_losses['freq_l2'].append(loss_generator_frequency)
+
+                    # Get the L2 loss in embedding space
+                    loss_generator_autoencoder = torch.zeros(size=[1], device=self.device, requires_grad=True)
+                    if self.use_autoencoder:
+                        # Get the embeddings, the gradients only flow through the generated batch
+                        embedding_target_batch = self.get_target_embedding(target_batch, k)
+                        embedding_generated_batch = self.get_embedding(generated_batch)
+                        loss_generator_autoencoder = self.generator_autoencoder_criterion(embedding_generated_batch,
+                                                                                          embedding_target_batch)
+                    batch_losses['autoencoder_l2'].append(loss_generator_autoencoder)
+
+                    # Combine the different losses
+                    loss_generator = self.lambda_adv * loss_generator_adversarial + loss_generator_time + \
+                                     self.lambda_freq * loss_generator_frequency + \
+                                     self.lambda_autoencoder * loss_generator_autoencoder
+
+                    self.telemetry.mark('generator_forward')
+
+                    # Back-propagate the gradients averaged over the micro-batches
+                    (loss_generator / self.accumulation_steps).backward()
+                    self.telemetry.mark('backward')
+
+                # Update the generator weights
                 self.generator_optimizer.step()
+                self.telemetry.mark('optimizer')
+
+                # Store the losses of the step
+                self.loss_accumulator.append_mean(batch_losses['real'], 'discriminator_adversarial', 'real')
+                self.loss_accumulator.append_mean(batch_losses['fake'], 'discriminator_adversarial', 'fake')
+                self.loss_accumulator.append_mean(batch_losses['generator_adversarial'], 'generator_adversarial')
+                self.loss_accumulator.append_mean(batch_losses['time_l2'], 'time_l2')
+                self.loss_accumulator.append_mean(batch_losses['freq_l2'], 'freq_l2')
+                if self.use_autoencoder:
+                    self.loss_accumulator.append_mean(batch_losses['autoencoder_l2'], 'autoencoder_l2')
 
                 # Print message
                 if not (i % 10):
+                    self.loss_accumulator.flush(self.train_losses)
                     message = 'Batch {}: \n' \
                               '\t Generator: \n' \
                               '\t\t Time: {} \n' \
@@ -189,17 +317,20 @@ class GanTrainer(Trainer):
                               '\t Discriminator: \n' \
                               '\t\t Real {} \n' \
                               '\t\t Fake {} \n'.format(i,
-                                                       loss_generator_time.item(),
-                                                       loss_generator_frequency.item(),
-                                                       loss_generator_autoencoder.item(),
-                                                       loss_generator_adversarial.item(),
-                                                       loss_discriminator_real.item(),
-                                                       loss_discriminator_generated.item())
+                                                       self.train_losses['time_l2'][-1],
+                                                       self.train_losses['freq_l2'][-1],
+                                                       self.train_losses['autoencoder_l2'][-1] if
+                                                       self.use_autoencoder else 0.,
+                                                       self.train_losses['generator_adversarial'][-1],
+                                                       self.train_losses['discriminator_adversarial']['real'][-1],
+                                                       self.train_losses['discriminator_adversarial']['fake'][-1])
                     print(message)
+                self.telemetry.end_step()
 
             # Evaluate the model
-            with torch.no_grad():
-                self.eval()
+            self.loss_accumulator.flush(self.train_losses)
+            self.telemetry.flush(self.epoch)
+            self.validate()
 
             # Save the trainer state
             self.save()
@@ -214,22 +345,21 @@ class GanTrainer(Trainer):
     def eval(self):
         self.generator.eval()
         self.discriminator.eval()
-        batch_losses = {'time_l2': [], 'freq_l2': []}
-        for i in range(self.valid_batches_per_epoch):
-            # Transfer to GPU
-            local_batch = next(self.valid_loader_iter)
-            input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
-
-            generated_batch = self.generator(input_batch)
+        if self.validation_set is not None:
+            batch_losses = self.evaluate_validation_set(self.generator)
+        else:
+            batch_losses = {'time_l2': [], 'freq_l2': []}
+            for i in range(self.valid_batches_per_epoch):
+                # Transfer to GPU
+                local_batch = next(self.valid_loader_iter)
+                input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
 
-            # Get the spectrogram
-            specgram_target_batch = self.spectrogram(target_batch)
-            specgram_generated_batch = self.spectrogram(generated_batch)
+                generated_batch = self.generator(input_batch)
 
-            loss_generator_time = self.generator_time_criterion(generated_batch, target_batch)
-            batch_losses['time_l2'].append(loss_generator_time.item())
-            loss_generator_frequency = self.generator_frequency_criterion(specgram_generated_batch, specgram_target_batch)
-            batch_losses['freq_l2'].append(loss_generator_frequency.item())
+                loss_generator_time = self.generator_time_criterion(generated_batch, target_batch)
+                batch_losses['time_l2'].append(loss_generator_time.item())
+                loss_generator_frequency = self.spectrogram.l2_loss(generated_batch, target_batch)
+                batch_losses['freq_l2'].append(loss_generator_frequency.item())
 
         # Store the validation losses
         self.valid_losses['time_l2'].append(np.mean(batch_losses['time_l2']))
@@ -251,7 +381,7 @@ class GanTrainer(Trainer):
         Saves the model(s), optimizer(s), scheduler(s) and losses
         :return: None
         """
-        torch.save({
+        self.save_checkpoint({
             'epoch': self.epoch,
             'generator_state_dict': self.generator.state_dict(),
             'discriminator_state_dict': self.discriminator.state_dict(),
@@ -259,10 +389,8 @@ class GanTrainer(Trainer):
             'discriminator_optimizer_state_dict': self.discriminator_optimizer.state_dict(),
             'generator_scheduler_state_dict': self.generator_scheduler.state_dict(),
             'discriminator_scheduler_state_dict': self.discriminator_scheduler.state_dict(),
-            'train_losses': self.train_losses,
-            'test_losses': self.test_losses,
-            'valid_losses': self.valid_losses
-        }, self.savepath)
+            **self.get_loss_log_state()
+        })
 
     def load(self):
         """
@@ -273,13 +401,15 @@ class GanTrainer(Trainer):
         self.epoch = checkpoint['epoch']
         self.generator.load_state_dict(checkpoint['generator_state_dict'])
         self.discriminator.load_state_dict(checkpoint['discriminator_state_dict'])
-        self.generator_optimizer.load_state_dict(checkpoint['generator_optimizer_state_dict'])
-        self.discriminator_optimizer.load_state_dict(checkpoint['discriminator_optimizer_state_dict'])
+        generator_optimizer_state_dict = filter_optimizer_state_dict(checkpoint['generator_optimizer_state_dict'],
+                                                                     checkpoint['generator_state_dict'], self.generator)
+        self.generator_optimizer.load_state_dict(generator_optimizer_state_dict)
+        discriminator_optimizer_state_dict = filter_optimizer_state_dict(
+            checkpoint['discriminator_optimizer_state_dict'], checkpoint['discriminator_state_dict'], self.discriminator)
+        self.discriminator_optimizer.load_state_dict(discriminator_optimizer_state_dict)
         self.generator_scheduler.load_state_dict(checkpoint['generator_scheduler_state_dict'])
         self.discriminator_scheduler.load_state_dict(checkpoint['discriminator_scheduler_state_dict'])
-        self.train_losses = checkpoint['train_losses']
-        self.test_losses = checkpoint['test_losses']
-        self.valid_losses = checkpoint['valid_losses']
+        self.load_losses(checkpoint)
 
     def evaluate_metrics(self, n_batches):
         """
@@ -302,7 +432,7 @@ class GanTrainer(Trainer):
 
                 # Get the metrics
                 snrs.append(snr(x=generated_batch.squeeze(), x_ref=target_batch.squeeze()))
-                lsds.append(lsd(x=generated_batch.squeeze(), x_ref=target_batch.squeeze()))
+                lsds.append(lsd(x=generated_batch.squeeze(), x_ref=target_batch.squeeze(), stft=self.spectrogram))
 
             snrs = torch.cat(snrs).cpu().numpy()
             lsds = torch.cat(lsds).cpu().numpy()
@@ -1,4 +1,8 @@
 from trainers.base_trainer import Trainer
+from utils.checkpoints import filter_optimizer_state_dict
+from utils.distributed import all_reduce_gradients, broadcast_parameters, get_adam_optimizer, \
+    get_optimizer_state_dict, is_main_process
+from utils.compilation import compile_model
 from models.generator import Generator
 from torch.optim import lr_scheduler
 from utils.metrics import snr, lsd
@@ -19,20 +23,37 @@ class GeneratorTrainer(Trainer):
         self.generator = Generator(general_args).to(self.device)
 
         # Optimizer and scheduler
-        self.optimizer = torch.optim.Adam(params=self.generator.parameters(), lr=trainer_args.lr)
+        self.optimizer = get_adam_optimizer(self.generator.parameters(), lr=trainer_args.lr,
+                                            shard_state=general_args.shard_optimizer_state,
+                                            implementation=general_args.adam_implementation)
         self.scheduler = lr_scheduler.StepLR(optimizer=self.optimizer,
                                              step_size=trainer_args.scheduler_step,
                                              gamma=trainer_args.scheduler_gamma)
 
+        # Store the losses in a log next to the checkpoints
+        self.init_loss_log(self.savepath or self.loadpath, resume=os.path.exists(self.loadpath))
+
         # Load saved states
         if os.path.exists(trainer_args.loadpath):
             self.load()
 
+        # Start all the data-parallel replicas from the same state
+        broadcast_parameters(self.generator)
+
+        # Profile the first training steps if required
+        self.start_profiler(general_args, {'generator': self.generator})
+        self.start_telemetry(general_args)
+
+        # Run the model in graph mode if required
+        compile_model(self.generator, general_args)
+
         # Loss function
         self.time_criterion = nn.MSELoss()
         self.use_freq_criterion = trainer_args.use_freq_criterion
         self.lambda_freq = trainer_args.lambda_freq
-        self.frequency_criterion = nn.MSELoss()
+
+        # Evaluate the checkpoints in a background process if required
+        self.start_background_eval(general_args, trainer_args)
 
     def train(self, epochs):
         """
@@ -43,35 +64,42 @@ class GeneratorTrainer(Trainer):
         for epoch in range(epochs):
             self.generator.train()
             for i in range(self.train_batches_per_epoch):
-                # Get the next batch
-                data_batch = next(self.train_loader_iter)
-                # Transfer to GPU
-                input_batch, target_batch = data_batch[0].to(self.device), data_batch[1].to(self.device)
+                # Get the micro-batches of the step, transferred to GPU
+                micro_batches = self.get_train_micro_batches()
 
                 # Reset all gradients in the graph
                 self.optimizer.zero_grad()
-
-                # Generates a fake batch
-                generated_batch = self.generator(input_batch)
-
-                # Get the spectrogram
-                specgram_target_batch = self.spectrogram(target_batch)
-                specgram_generated_batch = self.spectrogram(generated_batch)
-
-                # Compute and store the loss
-                time_l2_loss = self.time_criterion(generated_batch, target_batch)
-                freq_l2_loss = self.frequency_criterion(specgram_generated_batch, specgram_target_batch)
-                self.train_losses['time_l2'].append(time_l2_loss.item())
-                self.train_losses['freq_l2'].append(freq_l2_loss.item())
-                loss = time_l2_loss
-                if self.use_freq_criterion:
-                    loss = loss + self.lambda_freq * freq_l2_loss
-
-                # Backward pass
-                loss.backward()
+                self.telemetry.mark('optimizer')
+                batch_losses = {'time_l2': [], 'freq_l2': []}
+                for input_batch, target_batch in micro_batches:
+                    # Generates a fake batch
+                    generated_batch = self.generator(input_batch)
+
+                    # Compute and store the loss, the spectrograms share a single STFT per resolution
+                    time_l2_loss = self.time_criterion(generated_batch, target_batch)
+                    freq_l2_loss = self.spectrogram.l2_loss(generated_batch, target_batch)
+                    batch_losses['time_l2'].append(time_l2_loss)
+                    batch_losses['freq_l2'].append(freq_l2_loss)
+                    loss = time_l2_loss
+                    if self.use_freq_criterion:
+                        loss = loss + self.lambda_freq * freq_l2_loss
+                    self.telemetry.mark('generator_forward')
+
+                    # Backward pass, the gradients are averaged over the micro-batches
+                    (loss / self.accumulation_steps).backward()
+                    self.telemetry.mark('backward')
+                all_reduce_gradients(self.generator)
                 self.optimizer.step()
+                self.telemetry.mark('optimizer')
+
+                # Store the losses of the step
+                self.loss_accumulator.append_mean(batch_losses['time_l2'], 'time_l2')
+                self.loss_accumulator.append_mean(batch_losses['freq_l2'], 'freq_l2')
+                self.telemetry.end_step()
 
             # Print message
+            self.loss_accumulator.flush(self.train_losses)
+            self.telemetry.flush(self.epoch)
             message = 'Train, epoch {}: \n' \
                       '\t Time: {} \n' \
                       '\t Frequency: {} \n'.format(
@@ -79,8 +107,7 @@ class GeneratorTrainer(Trainer):
                 np.mean(self.train_losses['freq_l2'][-self.train_batches_per_epoch:]))
             print(message)
 
-            with torch.no_grad():
-                self.eval()
+            self.validate()
 
             # Save the trainer state
             # if self.need_saving:
@@ -98,25 +125,24 @@ class GeneratorTrainer(Trainer):
         :return: None
         """
         self.generator.eval()
-        batch_losses = {'time_l2': [], 'freq_l2': []}
-        for i in range(self.valid_batches_per_epoch):
-            # Get the next batch
-            local_batch = next(self.valid_loader_iter)
-            # Transfer to GPU
-            input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
-
-            # Generates a batch
-            generated_batch = self.generator(input_batch)
-
-            # Get the spectrogram
-            specgram_target_batch = self.spectrogram(target_batch)
-            specgram_fake_batch = self.spectrogram(generated_batch)
-
-            # Compute and store the loss
-            time_l2_loss = self.time_criterion(generated_batch, target_batch)
-            freq_l2_loss = self.frequency_criterion(specgram_fake_batch, specgram_target_batch)
-            batch_losses['time_l2'].append(time_l2_loss.item())
-            batch_losses['freq_l2'].append(freq_l2_loss.item())
+        if self.validation_set is not None:
+            batch_losses = self.evaluate_validation_set(self.generator)
+        else:
+            batch_losses = {'time_l2': [], 'freq_l2': []}
+            for i in range(self.valid_batches_per_epoch):
+                # Get the next batch
+                local_batch = next(self.valid_loader_iter)
+                # Transfer to GPU
+                input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
+
+                # Generates a batch
+                generated_batch = self.generator(input_batch)
+
+                # Compute and store the loss
+                time_l2_loss = self.time_criterion(generated_batch, target_batch)
+                freq_l2_loss = self.spectrogram.l2_loss(generated_batch, target_batch)
+                batch_losses['time_l2'].append(time_l2_loss.item())
+                batch_losses['freq_l2'].append(freq_l2_loss.item())
 
         # Store validation losses
         self.valid_losses['time_l2'].append(np.mean(batch_losses['time_l2']))
@@ -135,18 +161,21 @@ class GeneratorTrainer(Trainer):
 
     def save(self):
         """
-        Saves the model(s), optimizer(s), scheduler(s) and losses
+        Saves the model(s), optimizer(s), scheduler(s) and losses. Only the main process saves when the training is
+        distributed.
         :return: None
         """
-        torch.save({
+        # Gather the optimizer state on the main process if it is sharded
+        optimizer_state_dict = get_optimizer_state_dict(self.optimizer)
+        if not is_main_process():
+            return
+        self.save_checkpoint({
             'epoch': self.epoch,
             'generator_state_dict': self.generator.state_dict(),
-            'optimizer_state_dict': self.optimizer.state_dict(),
+            'optimizer_state_dict': optimizer_state_dict,
             'scheduler_state_dict': self.scheduler.state_dict(),
-            'train_losses': self.train_losses,
-            'test_losses': self.test_losses,
-            'valid_losses': self.valid_losses
-        }, self.savepath)
+            **self.get_loss_log_state()
+        })
 
     def load(self):
         """
@@ -156,11 +185,11 @@ class GeneratorTrainer(Trainer):
         checkpoint = torch.load(self.loadpath, map_location=self.device)
         self.epoch = checkpoint['epoch']
         self.generator.load_state_dict(checkpoint['generator_state_dict'])
-        self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        optimizer_state_dict = filter_optimizer_state_dict(checkpoint['optimizer_state_dict'],
+                                                           checkpoint['generator_state_dict'], self.generator)
+        self.optimizer.load_state_dict(optimizer_state_dict)
         self.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
-        self.train_losses = checkpoint['train_losses']
-        self.test_losses = checkpoint['test_losses']
-        self.valid_losses = checkpoint['valid_losses']
+        self.load_losses(checkpoint)
 
     def evaluate_metrics(self, n_batches):
         """
@@ -183,7 +212,7 @@ class GeneratorTrainer(Trainer):
 
                 # Get the metrics
                 snrs.append(snr(x=generated_batch.squeeze(), x_ref=target_batch.squeeze()))
-                lsds.append(lsd(x=generated_batch.squeeze(), x_ref=target_batch.squeeze()))
+                lsds.append(lsd(x=generated_batch.squeeze(), x_ref=target_batch.squeeze(), stft=self.spectrogram))
 
             snrs = torch.cat(snrs).cpu().numpy()
             lsds = torch.cat(lsds).cpu().numpy()
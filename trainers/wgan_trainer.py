@@ -1,5 +1,10 @@
 from models.discriminator import Discriminator
 from trainers.base_trainer import Trainer
+from utils.checkpoints import filter_optimizer_state_dict
+from utils.distributed import all_reduce_gradients, broadcast_parameters, get_adam_optimizer, \
+    get_optimizer_state_dict, is_main_process
+from utils.compilation import compile_model
+from utils.parameters import ParameterGroup
 from models.generator import Generator
 from torch.optim import lr_scheduler
 from utils.metrics import snr, lsd
@@ -7,6 +12,7 @@ from torch import autograd
 from torch import nn
 import numpy as np
 import torch
+import time
 import os
 
 
@@ -24,10 +30,17 @@ class WGanTrainer(Trainer):
 
         self.discriminator = Discriminator(general_args=general_args).to(self.device)
 
+        # Cached parameters of the discriminator, toggled and clipped at each step
+        self.discriminator_parameters = ParameterGroup(self.discriminator)
+
         # Optimizers and schedulers
-        self.generator_optimizer = torch.optim.Adam(params=self.generator.parameters(), lr=trainer_args.generator_lr)
-        self.discriminator_optimizer = torch.optim.Adam(params=self.discriminator.parameters(),
-                                                        lr=trainer_args.discriminator_lr)
+        self.generator_optimizer = get_adam_optimizer(self.generator.parameters(), lr=trainer_args.generator_lr,
+                                                      shard_state=general_args.shard_optimizer_state,
+                                                      implementation=general_args.adam_implementation)
+        self.discriminator_optimizer = get_adam_optimizer(self.discriminator.parameters(),
+                                                          lr=trainer_args.discriminator_lr,
+                                                          shard_state=general_args.shard_optimizer_state,
+                                                          implementation=general_args.adam_implementation)
         self.generator_scheduler = lr_scheduler.StepLR(optimizer=self.generator_optimizer,
                                                        step_size=trainer_args.generator_scheduler_step,
                                                        gamma=trainer_args.generator_scheduler_gamma)
@@ -35,20 +48,6 @@ class WGanTrainer(Trainer):
                                                            step_size=trainer_args.discriminator_scheduler_step,
                                                            gamma=trainer_args.discriminator_scheduler_gamma)
 
-        # Load saved states
-        if os.path.exists(self.loadpath):
-            self.load()
-
-        # Loss function and stored losses
-        self.generator_time_criterion = nn.MSELoss()
-
-        # Loss scaling factors
-        self.lambda_adv = trainer_args.lambda_adversarial
-        self.lambda_time = trainer_args.lambda_time
-
-        # Boolean indicating if the model needs to be saved
-        self.need_saving = True
-
         # Overrides losses from parent class
         self.train_losses = {
             'generator': {'time_l2': [], 'adversarial': []},
@@ -63,6 +62,30 @@ class WGanTrainer(Trainer):
             'discriminator': {'penalty': [], 'adversarial': []}
         }
 
+        # Store the losses in a log next to the checkpoints
+        self.init_loss_log(self.savepath or self.loadpath, resume=os.path.exists(self.loadpath))
+
+        # Number of discriminator steps, which schedules the lazy regularization, restored with the saved states
+        self.discriminator_steps = 0
+
+        # Load saved states
+        if os.path.exists(self.loadpath):
+            self.load()
+
+        # Start all the data-parallel replicas from the same state
+        broadcast_parameters(self.generator)
+        broadcast_parameters(self.discriminator)
+
+        # Loss function and stored losses
+        self.generator_time_criterion = nn.MSELoss()
+
+        # Loss scaling factors
+        self.lambda_adv = trainer_args.lambda_adversarial
+        self.lambda_time = trainer_args.lambda_time
+
+        # Boolean indicating if the model needs to be saved
+        self.need_saving = True
+
         # Select either wgan or wgan-gp method
         self.use_penalty = trainer_args.use_penalty
         self.gamma = trainer_args.gamma_wgan_gp
@@ -70,6 +93,28 @@ class WGanTrainer(Trainer):
         self.n_critic = trainer_args.n_critic
         self.coupling_epoch = trainer_args.coupling_epoch
 
+        # Lazy regularization: the penalty is applied every penalty_interval discriminator steps with its weight scaled
+        # by penalty_interval, on a fraction of the samples of each batch
+        self.penalty_type = trainer_args.penalty_type
+        self.penalty_interval = max(1, trainer_args.penalty_interval)
+        self.penalty_fraction = trainer_args.penalty_fraction
+
+        # Run the discriminator on the generated and target batches with a single forward pass
+        self.fused_discriminator_pass = general_args.fused_discriminator_pass
+
+        # Profile the first training steps if required
+        self.start_profiler(general_args, {'generator': self.generator, 'discriminator': self.discriminator})
+        self.start_telemetry(general_args)
+
+        # Run the models in graph mode if required, the gradient penalty needs a double backward through the
+        # discriminator which is not supported by compiled graphs
+        compile_model(self.generator, general_args)
+        if not self.use_penalty:
+            compile_model(self.discriminator, general_args)
+
+        # Evaluate the checkpoints in a background process if required
+        self.start_background_eval(general_args, trainer_args)
+
     def load_pretrained_generator(self, generator_path):
         """
         Loads a pre-trained generator. Can be used to stabilize the training.
@@ -79,13 +124,13 @@ class WGanTrainer(Trainer):
         checkpoint = torch.load(generator_path, map_location=self.device)
         self.generator.load_state_dict(checkpoint['generator_state_dict'])
 
-    def compute_gradient_penalty(self, input_batch, generated_batch):
+    def get_interpolation(self, input_batch, generated_batch):
         """
-        Compute the gradient penalty as described in the original paper
-        (https://papers.nips.cc/paper/7159-improved-training-of-wasserstein-gans.pdf).
+        Randomly interpolates between the samples of two batches, the gradient penalty is computed on the
+        interpolation.
         :param input_batch: batch of input data (torch tensor).
         :param generated_batch: batch of generated data (torch tensor).
-        :return: penalty as a scalar (torch tensor).
+        :return: interpolated batch that requires gradients (torch tensor).
         """
         batch_size = input_batch.size(0)
         epsilon = torch.rand(batch_size, 1, 1)
@@ -93,11 +138,15 @@ class WGanTrainer(Trainer):
 
         # Interpolate
         interpolation = epsilon * input_batch.data + (1 - epsilon) * generated_batch.data
-        interpolation = interpolation.requires_grad_(True).to(self.device)
-
-        # Computes the discriminator's prediction for the interpolated input
-        interpolation_logits = self.discriminator(interpolation)
+        return interpolation.requires_grad_(True).to(self.device)
 
+    def get_gradient_penalty(self, interpolation, interpolation_logits):
+        """
+        Computes the penalty on the norm of the gradients of the discriminator's prediction for the interpolation.
+        :param interpolation: interpolated batch (torch tensor).
+        :param interpolation_logits: discriminator's prediction for the interpolated batch (torch tensor).
+        :return: penalty as a scalar (torch tensor).
+        """
         # Computes a vector of outputs to make it works with 2 output classes if needed
         grad_outputs = torch.ones_like(interpolation_logits).to(self.device).requires_grad_(True)
 
@@ -108,53 +157,148 @@ class WGanTrainer(Trainer):
                                   create_graph=True,
                                   retain_graph=True,
                                   only_inputs=True)[0]
-        gradients = gradients.view(batch_size, -1)
+        gradients = gradients.view(interpolation.size(0), -1)
 
         # Computes the norm of the gradients
         gradients_norm = torch.sqrt(torch.sum(gradients ** 2, dim=1))
         return ((gradients_norm - 1) ** 2).mean()
 
-    def train_discriminator_step(self, input_batch, target_batch):
+    def compute_gradient_penalty(self, input_batch, generated_batch):
+        """
+        Compute the gradient penalty as described in the original paper
+        (https://papers.nips.cc/paper/7159-improved-training-of-wasserstein-gans.pdf).
+        :param input_batch: batch of input data (torch tensor).
+        :param generated_batch: batch of generated data (torch tensor).
+        :return: penalty as a scalar (torch tensor).
+        """
+        interpolation = self.get_interpolation(input_batch, generated_batch)
+
+        # Computes the discriminator's prediction for the interpolated input
+        interpolation_logits = self.discriminator(interpolation)
+        return self.get_gradient_penalty(interpolation, interpolation_logits)
+
+    def get_r1_penalty(self, real_batch, real_logits):
         """
-        Trains the discriminator for a single step based on the wasserstein gan-gp framework.
+        Computes the R1 penalty, i.e. the squared norm of the gradients of the discriminator's prediction for real
+        samples. It does not need interpolated samples and reuses the logits of the real batch.
+        :param real_batch: batch of real data that requires gradients (torch tensor).
+        :param real_logits: discriminator's prediction for the real batch (torch tensor).
+        :return: penalty as a scalar (torch tensor).
+        """
+        gradients = autograd.grad(outputs=real_logits.sum(), inputs=real_batch, create_graph=True, retain_graph=True,
+                                  only_inputs=True)[0]
+        return gradients.pow(2).view(real_batch.size(0), -1).sum(dim=1).mean()
+
+    def compute_discriminator_loss(self, input_batch, target_batch, generated_batch, apply_penalty=True):
+        """
+        Computes the wasserstein loss of the discriminator and the penalty if needed. The penalty is computed on the
+        first penalty_fraction of the samples, either on the interpolation of the input and generated batches (wgan-gp)
+        or on the target batch (R1). With the fused pass, the generated and target batches go through the discriminator
+        in a single forward pass. The penalized samples have their own pass so that the double backward of the penalty
+        only goes through them.
         :param input_batch: batch of input data (torch tensor).
         :param target_batch: batch of target data (torch tensor).
-        :return: a batch of generated data (torch tensor).
+        :param generated_batch: batch of generated data, detached from the generator (torch tensor).
+        :param apply_penalty: boolean indicating if the penalty is computed at this step (boolean).
+        :return: loss and penalty, None if the penalty is not computed (torch tensors).
+        """
+        apply_penalty = apply_penalty and self.use_penalty
+        n_penalty = max(1, int(round(self.penalty_fraction * target_batch.size(0))))
+        penalty_batch = None
+        if apply_penalty and self.penalty_type == 'r1':
+            # With the whole batch and separate passes the logits of the loss are reused
+            if n_penalty == target_batch.size(0) and not self.fused_discriminator_pass:
+                target_batch = target_batch.detach().requires_grad_(True)
+                penalty_batch = target_batch
+            else:
+                penalty_batch = target_batch[:n_penalty].detach().requires_grad_(True)
+        elif apply_penalty:
+            penalty_batch = self.get_interpolation(input_batch[:n_penalty], generated_batch[:n_penalty])
+
+        # Get the discriminator's predictions
+        if self.fused_discriminator_pass:
+            generated_logits, target_logits = self.discriminator.forward_batches(generated_batch, target_batch)
+        else:
+            generated_logits, target_logits = self.discriminator(generated_batch), self.discriminator(target_batch)
+        loss_d = generated_logits.mean() - target_logits.mean()
+        self.telemetry.mark('discriminator_forward')
+        if not apply_penalty:
+            return loss_d, None
+        penalty_logits = target_logits if penalty_batch is target_batch else self.discriminator(penalty_batch)
+        if self.penalty_type == 'r1':
+            penalty = self.get_r1_penalty(penalty_batch, penalty_logits)
+        else:
+            penalty = self.get_gradient_penalty(penalty_batch, penalty_logits)
+        self.telemetry.mark('gradient_penalty')
+        return loss_d, penalty
+
+    def train_discriminator_step(self, micro_batches, keep_graph=True):
+        """
+        Trains the discriminator for a single step based on the wasserstein gan-gp framework. The gradients are
+        accumulated over the micro-batches before the update.
+        :param micro_batches: list of (input_batch, target_batch) tuples (list of torch tensors).
+        :param keep_graph: boolean indicating if the graph of the generated batches is kept to be reused by the
+        generator step (boolean).
+        :return: the generated batches, one per micro-batch (list of torch tensors).
         """
         # Activate gradient tracking for the discriminator
         self.change_discriminator_grad_requirement(requires_grad=True)
 
         # Set the discriminator's gradients to zero
         self.discriminator_optimizer.zero_grad()
-
-        # Generate a batch and compute the penalty
-        generated_batch = self.generator(input_batch)
-
-        # Compute the loss
-        loss_d = self.discriminator(generated_batch.detach()).mean() - self.discriminator(target_batch).mean()
-        self.train_losses['discriminator']['adversarial'].append(loss_d.item())
-        if self.use_penalty:
-            penalty = self.compute_gradient_penalty(input_batch, generated_batch.detach())
-            self.train_losses['discriminator']['penalty'].append(penalty.item())
-            loss_d = loss_d + self.gamma * penalty
+        self.telemetry.mark('optimizer')
+
+        # Apply the penalty every penalty_interval steps
+        apply_penalty = self.use_penalty and not (self.discriminator_steps % self.penalty_interval)
+        self.discriminator_steps += 1
+
+        generated_batches = []
+        batch_losses = {'penalty': [], 'adversarial': []}
+        for input_batch, target_batch in micro_batches:
+            # Generate a batch
+            with torch.set_grad_enabled(keep_graph):
+                generated_batch = self.generator(input_batch)
+            generated_batches.append(generated_batch)
+            self.telemetry.mark('generator_forward')
+
+            # Compute the loss and the penalty
+            loss_d, penalty = self.compute_discriminator_loss(input_batch, target_batch, generated_batch.detach(),
+                                                              apply_penalty)
+            batch_losses['adversarial'].append(loss_d)
+            if apply_penalty:
+                batch_losses['penalty'].append(penalty)
+                loss_d = loss_d + self.gamma * self.penalty_interval * penalty
+
+            # Accumulate the gradients averaged over the micro-batches
+            (loss_d / self.accumulation_steps).backward()
+            self.telemetry.mark('backward')
 
         # Update the discriminator's weights
-        loss_d.backward()
+        all_reduce_gradients(self.discriminator)
         self.discriminator_optimizer.step()
 
         # Apply the weight constraint if needed
         if not self.use_penalty:
-            for p in self.discriminator.parameters():
-                p.data.clamp_(min=-self.clipping_limit, max=self.clipping_limit)
+            self.discriminator_parameters.clamp_(self.clipping_limit)
+        self.telemetry.mark('optimizer')
+
+        # Store the losses, NaN is stored as penalty of the steps without penalty so that the series stay aligned
+        self.loss_accumulator.append_mean(batch_losses['adversarial'], 'discriminator', 'adversarial')
+        if apply_penalty:
+            self.loss_accumulator.append_mean(batch_losses['penalty'], 'discriminator', 'penalty')
+        else:
+            self.loss_accumulator.append(torch.full((), float('nan'), device=self.device), 'discriminator', 'penalty')
 
-        # Return the generated batch to avoid redundant computation
-        return generated_batch
+        # Return the generated batches to avoid redundant computation
+        return generated_batches
 
-    def train_generator_step(self, target_batch, generated_batch):
+    def train_generator_step(self, micro_batches, generated_batches=None):
         """
-        Trains the generator for a single step based on the wasserstein gan-gp framework.
-        :param target_batch: batch of target data (torch tensor).
-        :param generated_batch: batch of generated data (torch tensor).
+        Trains the generator for a single step based on the wasserstein gan-gp framework. The gradients are
+        accumulated over the micro-batches before the update.
+        :param micro_batches: list of (input_batch, target_batch) tuples (list of torch tensors).
+        :param generated_batches: generated batches of the discriminator step with their graph, they are generated
+        again if not provided (list of torch tensors).
         :return: None
         """
         # Deactivate gradient tracking for the discriminator
@@ -162,23 +306,42 @@ class WGanTrainer(Trainer):
 
         # Set generator's gradients to zero
         self.generator_optimizer.zero_grad()
+        self.telemetry.mark('optimizer')
+
+        batch_losses = {'time_l2': [], 'adversarial': []}
+        for j, (input_batch, target_batch) in enumerate(micro_batches):
+            if generated_batches is None:
+                generated_batch = self.generator(input_batch)
+                self.telemetry.mark('generator_forward')
+            else:
+                generated_batch = generated_batches[j]
+
+            # Get the generator losses
+            loss_g_adversarial = - self.discriminator(generated_batch).mean()
+            self.telemetry.mark('discriminator_forward')
+            loss_g_time = self.generator_time_criterion(generated_batch, target_batch)
+            batch_losses['time_l2'].append(loss_g_time)
+            batch_losses['adversarial'].append(loss_g_adversarial)
+
+            # Combine the different losses
+            loss_g = loss_g_time
+            if self.epoch >= self.coupling_epoch:
+                loss_g = loss_g + self.lambda_adv * loss_g_adversarial
 
-        # Get the generator losses
-        loss_g_adversarial = - self.discriminator(generated_batch).mean()
-        loss_g_time = self.generator_time_criterion(generated_batch, target_batch)
+            self.telemetry.mark('generator_forward')
 
-        # Combine the different losses
-        loss_g = loss_g_time
-        if self.epoch >= self.coupling_epoch:
-            loss_g = loss_g + self.lambda_adv * loss_g_adversarial
+            # Back-propagate the gradients averaged over the micro-batches
+            (loss_g / self.accumulation_steps).backward()
+            self.telemetry.mark('backward')
 
-        # Back-propagate and update the generator weights
-        loss_g.backward()
+        # Update the generator weights
+        all_reduce_gradients(self.generator)
         self.generator_optimizer.step()
+        self.telemetry.mark('optimizer')
 
         # Store the losses
-        self.train_losses['generator']['time_l2'].append(loss_g_time.item())
-        self.train_losses['generator']['adversarial'].append(loss_g_adversarial.item())
+        self.loss_accumulator.append_mean(batch_losses['time_l2'], 'generator', 'time_l2')
+        self.loss_accumulator.append_mean(batch_losses['adversarial'], 'generator', 'adversarial')
 
     def change_discriminator_grad_requirement(self, requires_grad):
         """
@@ -187,8 +350,7 @@ class WGanTrainer(Trainer):
         :param requires_grad: flag indicating if the discriminator's parameter require gradient tracking (boolean).
         :return: None
         """
-        for p in self.discriminator.parameters():
-            p.requires_grad_(requires_grad)
+        self.discriminator_parameters.set_requires_grad(requires_grad)
 
     def train(self, epochs):
         """
@@ -199,20 +361,27 @@ class WGanTrainer(Trainer):
         self.generator.train()
         self.discriminator.train()
         for epoch in range(epochs):
+            epoch_start = time.perf_counter()
             for i in range(self.train_batches_per_epoch):
-                # Transfer to GPU
-                local_batch = next(self.train_loader_iter)
-                input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
+                # Get the micro-batches of the step, transferred to GPU
+                micro_batches = self.get_train_micro_batches()
+
+                # The generator is trained every n_critic steps. With a single micro-batch it reuses the batch generated
+                # for the discriminator, with several micro-batches their graphs would all be kept alive at once and
+                # the generator step generates them again instead
+                train_generator = not (i % self.n_critic)
+                reuse_generated = train_generator and self.accumulation_steps == 1
 
                 # Train the discriminator
-                generated_batch = self.train_discriminator_step(input_batch, target_batch)
+                generated_batches = self.train_discriminator_step(micro_batches, keep_graph=reuse_generated)
 
                 # Train the generator every n_critic
-                if not (i % self.n_critic):
-                    self.train_generator_step(target_batch, generated_batch)
+                if train_generator:
+                    self.train_generator_step(micro_batches, generated_batches if reuse_generated else None)
 
                 # Print message
                 if not (i % 10):
+                    self.loss_accumulator.flush(self.train_losses)
                     message = 'Batch {}: \n' \
                               '\t Generator: \n' \
                               '\t\t Time: {} \n' \
@@ -225,10 +394,15 @@ class WGanTrainer(Trainer):
                                                                self.train_losses['discriminator']['penalty'][-1],
                                                                self.train_losses['discriminator']['adversarial'][-1])
                     print(message)
+                self.telemetry.end_step()
+
+            # Display the step time, the flush waits for the last step to complete
+            self.loss_accumulator.flush(self.train_losses)
+            self.print_step_time(time.perf_counter() - epoch_start)
+            self.telemetry.flush(self.epoch)
 
             # Evaluate the model
-            with torch.no_grad():
-                self.eval()
+            self.validate()
 
             # Save the trainer state
             self.save()
@@ -238,20 +412,40 @@ class WGanTrainer(Trainer):
             self.generator_scheduler.step()
             self.discriminator_scheduler.step()
 
+    def print_step_time(self, epoch_time):
+        """
+        Displays the mean time of a training step with the regularization settings, to relate the cost of the penalty
+        to the convergence of the losses.
+        :param epoch_time: duration of the training steps of the epoch in seconds (scalar float).
+        :return: None
+        """
+        regularization = 'weight clipping'
+        if self.use_penalty:
+            regularization = '{} penalty every {} steps on {:.0%} of the samples'.format(
+                self.penalty_type, self.penalty_interval, self.penalty_fraction)
+        message = 'Train, epoch {}: \n' \
+                  '\t Step time: {:.4f} s \n' \
+                  '\t Regularization: {} \n'.format(self.epoch, epoch_time / self.train_batches_per_epoch,
+                                                     regularization)
+        print(message)
+
     def eval(self):
         # Set the models in evaluation mode
         self.generator.eval()
         self.discriminator.eval()
-        batch_losses = {'time_l2': []}
-        for i in range(self.valid_batches_per_epoch):
-            # Transfer to GPU
-            local_batch = next(self.valid_loader_iter)
-            input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
+        if self.validation_set is not None:
+            batch_losses = self.evaluate_validation_set(self.generator, use_frequency=False)
+        else:
+            batch_losses = {'time_l2': []}
+            for i in range(self.valid_batches_per_epoch):
+                # Transfer to GPU
+                local_batch = next(self.valid_loader_iter)
+                input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
 
-            generated_batch = self.generator(input_batch)
+                generated_batch = self.generator(input_batch)
 
-            loss_g_time = self.generator_time_criterion(generated_batch, target_batch)
-            batch_losses['time_l2'].append(loss_g_time.item())
+                loss_g_time = self.generator_time_criterion(generated_batch, target_batch)
+                batch_losses['time_l2'].append(loss_g_time.item())
 
         # Store the validation losses
         self.valid_losses['generator']['time_l2'].append(np.mean(batch_losses['time_l2']))
@@ -265,24 +459,42 @@ class WGanTrainer(Trainer):
         self.generator.train()
         self.discriminator.eval()
 
+    def get_validation_losses(self):
+        """
+        :return: validation losses of the generator used to select the best checkpoint (LossSeries).
+        """
+        return self.valid_losses['generator']['time_l2']
+
+    def store_background_metrics(self, record):
+        """
+        Stores the validation losses computed by the evaluation worker.
+        :param record: metrics of a checkpoint (dictionary).
+        :return: None
+        """
+        self.valid_losses['generator']['time_l2'].append(record['time_l2'])
+
     def save(self):
         """
-        Saves the model(s), optimizer(s), scheduler(s) and losses
+        Saves the model(s), optimizer(s), scheduler(s) and losses. Only the main process saves when the training is
+        distributed.
         :return: None
         """
-        savepath = self.savepath.split('.')[0] + '_' + str(self.epoch // 5) + '.' + self.savepath.split('.')[1]
-        torch.save({
+        # Gather the optimizer states on the main process if they are sharded
+        generator_optimizer_state_dict = get_optimizer_state_dict(self.generator_optimizer)
+        discriminator_optimizer_state_dict = get_optimizer_state_dict(self.discriminator_optimizer)
+        if not is_main_process():
+            return
+        self.save_checkpoint({
             'epoch': self.epoch,
             'generator_state_dict': self.generator.state_dict(),
             'discriminator_state_dict': self.discriminator.state_dict(),
-            'generator_optimizer_state_dict': self.generator_optimizer.state_dict(),
-            'discriminator_optimizer_state_dict': self.discriminator_optimizer.state_dict(),
+            'generator_optimizer_state_dict': generator_optimizer_state_dict,
+            'discriminator_optimizer_state_dict': discriminator_optimizer_state_dict,
             'generator_scheduler_state_dict': self.generator_scheduler.state_dict(),
             'discriminator_scheduler_state_dict': self.discriminator_scheduler.state_dict(),
-            'train_losses': self.train_losses,
-            'test_losses': self.test_losses,
-            'valid_losses': self.valid_losses
-        }, savepath)
+            'discriminator_steps': self.discriminator_steps,
+            **self.get_loss_log_state()
+        })
 
     def load(self):
         """
@@ -293,13 +505,14 @@ class WGanTrainer(Trainer):
         self.epoch = checkpoint['epoch']
         self.generator.load_state_dict(checkpoint['generator_state_dict'])
         # self.discriminator.load_state_dict(checkpoint['discriminator_state_dict'])
-        self.generator_optimizer.load_state_dict(checkpoint['generator_optimizer_state_dict'])
+        generator_optimizer_state_dict = filter_optimizer_state_dict(checkpoint['generator_optimizer_state_dict'],
+                                                                     checkpoint['generator_state_dict'], self.generator)
+        self.generator_optimizer.load_state_dict(generator_optimizer_state_dict)
         # self.discriminator_optimizer.load_state_dict(checkpoint['discriminator_optimizer_state_dict'])
         self.generator_scheduler.load_state_dict(checkpoint['generator_scheduler_state_dict'])
         self.discriminator_scheduler.load_state_dict(checkpoint['discriminator_scheduler_state_dict'])
-        self.train_losses = checkpoint['train_losses']
-        self.test_losses = checkpoint['test_losses']
-        self.valid_losses = checkpoint['valid_losses']
+        self.discriminator_steps = checkpoint.get('discriminator_steps', 0)
+        self.load_losses(checkpoint)
 
     def evaluate_metrics(self, n_batches):
         """
@@ -322,7 +535,7 @@ class WGanTrainer(Trainer):
 
                 # Get the metrics
                 snrs.append(snr(x=generated_batch.squeeze(), x_ref=target_batch.squeeze()))
-                lsds.append(lsd(x=generated_batch.squeeze(), x_ref=target_batch.squeeze()))
+                lsds.append(lsd(x=generated_batch.squeeze(), x_ref=target_batch.squeeze(), stft=self.spectrogram))
 
             snrs = torch.cat(snrs).cpu().numpy()
             lsds = torch.cat(lsds).cpu().numpy()
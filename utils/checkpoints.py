@@ -0,0 +1,221 @@
+import threading
+import shutil
+import atexit
+import queue
+import torch
+import glob
+import os
+
+
+def filter_optimizer_state_dict(optimizer_state_dict, model_state_dict, model):
+    """
+    Removes from an optimizer state dict the entries of the parameters that are stored in the model state dict of the
+    same checkpoint but that no longer exist in the model, e.g. the unused convolutions of the sub-pixel and super-pixel
+    layers saved by previous versions. The optimizer is assumed to hold the parameters of the model in the order of
+    model.parameters(), which is the order of the parameters in the state dict.
+    :param optimizer_state_dict: state dict of the optimizer stored in the checkpoint (dictionary).
+    :param model_state_dict: state dict of the model stored in the checkpoint (dictionary).
+    :param model: model in which the state dict is loaded (nn.Module).
+    :return: optimizer state dict matching the parameters of the model (dictionary).
+    """
+    parameter_names = set(name for name, _ in model.named_parameters())
+    buffer_names = set(name for name, _ in model.named_buffers())
+    saved_parameter_names = [name for name in model_state_dict if name not in buffer_names]
+    if len(saved_parameter_names) == len(parameter_names):
+        return optimizer_state_dict
+
+    # Map the indices of the kept parameters to their new indices
+    kept_indices = [index for index, name in enumerate(saved_parameter_names) if name in parameter_names]
+    index_map = {old_index: new_index for new_index, old_index in enumerate(kept_indices)}
+    state = {index_map[index]: value for index, value in optimizer_state_dict['state'].items() if index in index_map}
+    param_groups = [dict(group, params=[index_map[index] for index in group['params'] if index in index_map])
+                    for group in optimizer_state_dict['param_groups']]
+    return {'state': state, 'param_groups': param_groups}
+
+
+def copy_to_cpu(state):
+    """
+    Copies the tensors of a nested state (dictionaries, lists and tuples) to the CPU. The copy is a snapshot that is not
+    affected by the following updates of the models and optimizers.
+    :param state: nested state, e.g. the state dicts of a trainer (dictionary).
+    :return: copy of the state whose tensors are on the CPU (dictionary).
+    """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: copy_to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(copy_to_cpu(value) for value in state)
+    return state
+
+
+def atomic_save(state, savepath):
+    """
+    Saves a state to a temporary file which is then renamed, the checkpoint at savepath is therefore either the
+    previous or the new one even if the process is killed during the write.
+    :param state: state to save (dictionary).
+    :param savepath: location of the checkpoint (string).
+    :return: None
+    """
+    temporary_path = savepath + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        torch.save(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, savepath)
+
+
+def atomic_write(data, savepath):
+    """
+    Writes raw bytes to a temporary file which is then renamed.
+    :param data: content of the file (bytes).
+    :param savepath: location of the file (string).
+    :return: None
+    """
+    temporary_path = savepath + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, savepath)
+
+
+def atomic_copy(sourcepath, savepath):
+    """
+    Copies a checkpoint to a temporary file which is then renamed.
+    :param sourcepath: location of the checkpoint to copy (string).
+    :param savepath: location of the copy (string).
+    :return: None
+    """
+    temporary_path = savepath + '.tmp'
+    shutil.copyfile(sourcepath, temporary_path)
+    os.replace(temporary_path, savepath)
+
+
+class CheckpointWriter(object):
+    def __init__(self, savepath, keep_last=0, keep_best=False, asynchronous=True):
+        """
+        Initializes the class CheckpointWriter that writes the checkpoints of a trainer. The states are copied to the
+        CPU by the caller and serialized by a background thread so that the training is not blocked by the disk. Each
+        file is written atomically. The latest checkpoint is always written to savepath, copies of the last
+        checkpoints and of the best one (lowest validation loss) can be kept next to it.
+        :param savepath: location of the latest checkpoint, e.g. 'objects/generator.pt' (string).
+        :param keep_last: number of checkpoints kept as '<name>_epoch_<epoch><extension>', 0 to keep none (scalar int).
+        :param keep_best: boolean indicating if the best checkpoint is kept as '<name>_best<extension>' (boolean).
+        :param asynchronous: boolean indicating if the checkpoints are serialized by a background thread (boolean).
+        """
+        self.savepath = savepath
+        self.root, self.extension = os.path.splitext(savepath)
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.asynchronous = asynchronous
+        self.error = None
+
+        # Copies kept by a previous run, sorted by epoch
+        self.epoch_paths = sorted(glob.glob(glob.escape(self.root) + '_epoch_*' + self.extension),
+                                  key=self.get_epoch)
+
+        # A single checkpoint waits for the writer at most, which bounds the memory used by the snapshots
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = None
+        if asynchronous:
+            self.thread = threading.Thread(target=self.run, name='checkpoint-writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def get_epoch(self, path):
+        """
+        :param path: location of a copy of a checkpoint (string).
+        :return: epoch of the copy (scalar int).
+        """
+        suffix = path[len(self.root + '_epoch_'):len(path) - len(self.extension)]
+        return int(suffix) if suffix.isdigit() else -1
+
+    def save(self, state, epoch, is_best=False):
+        """
+        Snapshots the state to the CPU and hands it to the writer. Waits for the previous checkpoint if it is still
+        waiting to be written.
+        :param state: state of the trainer, possibly on the GPU (dictionary).
+        :param epoch: current epoch (scalar int).
+        :param is_best: boolean indicating if the state has the lowest validation loss so far (boolean).
+        :return: None
+        """
+        self.raise_error()
+        state = copy_to_cpu(state)
+        if self.is_running():
+            self.queue.put((state, epoch, is_best))
+        else:
+            self.write(state, epoch, is_best)
+
+    def run(self):
+        """
+        Loop of the background thread, writes the checkpoints until close() is called.
+        :return: None
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.write(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def write(self, state, epoch, is_best):
+        """
+        Writes a checkpoint and applies the retention policy.
+        :param state: state of the trainer on the CPU (dictionary).
+        :param epoch: epoch of the state (scalar int).
+        :param is_best: boolean indicating if the state has the lowest validation loss so far (boolean).
+        :return: None
+        """
+        atomic_save(state, self.savepath)
+        if self.keep_best and is_best:
+            atomic_copy(self.savepath, self.root + '_best' + self.extension)
+        if self.keep_last > 0:
+            epoch_path = '{}_epoch_{}{}'.format(self.root, epoch, self.extension)
+            atomic_copy(self.savepath, epoch_path)
+            if epoch_path not in self.epoch_paths:
+                self.epoch_paths.append(epoch_path)
+
+            # Remove the oldest copies
+            while len(self.epoch_paths) > self.keep_last:
+                path = self.epoch_paths.pop(0)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def wait(self):
+        """
+        Blocks until all the checkpoints handed to the writer are written.
+        :return: None
+        """
+        if self.is_running():
+            self.queue.join()
+        self.raise_error()
+
+    def is_running(self):
+        """
+        :return: boolean indicating if the checkpoints are written by the background thread (boolean).
+        """
+        return self.thread is not None and self.thread.is_alive()
+
+    def raise_error(self):
+        """
+        Raises the error of the background thread if the last write failed.
+        :return: None
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('The checkpoint could not be written to {}.'.format(self.savepath)) from error
+
+    def close(self):
+        """
+        Writes the pending checkpoints and stops the background thread.
+        :return: None
+        """
+        if self.is_running():
+            self.queue.put(None)
+            self.thread.join()
+        self.raise_error()
@@ -0,0 +1,178 @@
+import warnings
+import hashlib
+import torch
+import os
+
+
+def get_compiler_errors():
+    """
+    :return: exception types raised by torch.compile when a graph cannot be captured or compiled, the errors raised by
+    the compiled code itself (e.g. out of memory or a shape mismatch) are not part of them (tuple of types).
+    """
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+    except ImportError:
+        return ()
+    return TorchDynamoException,
+
+
+class EagerFallback(object):
+    def __init__(self, compiled_forward, eager_forward, name):
+        """
+        Initializes the class EagerFallback that wraps the forward method of a model compiled with torch.compile. The
+        graphs are compiled at the first call and at each recompilation (e.g. a new input shape), a compiler failure is
+        caught at that time and the model keeps running in eager mode afterwards. Any other error is raised, the step
+        is neither re-executed nor silently run in eager mode.
+        :param compiled_forward: compiled forward function.
+        :param eager_forward: original forward function of the model.
+        :param name: name of the model used in the warning message (string).
+        """
+        self.compiled_forward = compiled_forward
+        self.eager_forward = eager_forward
+        self.name = name
+        self.compiler_errors = get_compiler_errors()
+        self.failed = False
+
+    def __call__(self, *args, **kwargs):
+        if not self.failed:
+            try:
+                return self.compiled_forward(*args, **kwargs)
+            except self.compiler_errors as error:
+                warnings.warn('Compilation of the {} failed, falling back to eager mode: {}'.format(self.name, error))
+                self.failed = True
+        return self.eager_forward(*args, **kwargs)
+
+
+class ShapeSpecializedForward(object):
+    def __init__(self, scripted_forward, eager_forward, input_shape, name):
+        """
+        Initializes the class ShapeSpecializedForward that wraps the forward method of a model frozen with TorchScript.
+        The frozen module is traced for a single input shape, the inputs of any other shape (e.g. the last incomplete
+        batch of a track) run in eager mode, which is reported once.
+        :param scripted_forward: frozen module.
+        :param eager_forward: original forward function of the model.
+        :param input_shape: shape of the input used to trace the module (tuple).
+        :param name: name of the model used in the warning message (string).
+        """
+        self.scripted_forward = scripted_forward
+        self.eager_forward = eager_forward
+        self.input_shape = tuple(input_shape)
+        self.name = name
+        self.warned = False
+
+    def __call__(self, x):
+        if tuple(x.shape) == self.input_shape:
+            return self.scripted_forward(x)
+        if not self.warned:
+            warnings.warn('The {} was frozen for inputs of shape {}, inputs of shape {} run in eager mode.'.format(
+                self.name, self.input_shape, tuple(x.shape)))
+            self.warned = True
+        return self.eager_forward(x)
+
+
+def get_cache_key(*items):
+    """
+    Computes a key identifying a compiled artifact. The key depends on the given items and on the torch version.
+    :param items: any number of objects whose string representation identifies the artifact.
+    :return: hexadecimal digest (string).
+    """
+    content = '|'.join([torch.__version__] + [str(item) for item in items])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def get_checkpoint_signature(loadpath):
+    """
+    Identifies a checkpoint file by its location, size and modification time so that a cached artifact is invalidated
+    when the checkpoint is overwritten.
+    :param loadpath: location of the checkpoint (string).
+    :return: signature (tuple).
+    """
+    stat = os.stat(loadpath)
+    return os.path.realpath(loadpath), stat.st_size, stat.st_mtime
+
+
+def torch_compile_model(model, cache_dir):
+    """
+    Replaces the forward method of the model by its torch.compile counterpart. The model is modified in place so that
+    the parameters, the state dict and the optimizers referencing it are left untouched.
+    :param model: model to compile (nn.Module).
+    :param cache_dir: directory where inductor caches the compiled graphs across runs (string).
+    :return: the same model (nn.Module).
+    """
+    name = model.__class__.__name__
+    if not hasattr(torch, 'compile'):
+        warnings.warn('torch.compile is not available in torch {}, the {} runs in eager mode.'.format(
+            torch.__version__, name))
+        return model
+
+    # Persist the compiled graphs across runs
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(cache_dir))
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except (ImportError, AttributeError):
+        pass
+
+    eager_forward = model.forward
+    try:
+        compiled_forward = torch.compile(eager_forward)
+    except Exception as error:
+        warnings.warn('Compilation of the {} failed, falling back to eager mode: {}'.format(name, error))
+        return model
+    model.forward = EagerFallback(compiled_forward, eager_forward, name)
+    return model
+
+
+def script_model(model, example_input, cache_dir, cache_key):
+    """
+    Traces and freezes the model with TorchScript. The frozen module is saved in the cache directory and reloaded if
+    an artifact with the same key already exists. Only suited for inference as the parameters are folded as constants.
+    The module is specialized to the shape of example_input, the inputs of other shapes run in eager mode.
+    :param model: model in evaluation mode (nn.Module).
+    :param example_input: input tensor with the shape of the inference batches, used to trace the model (torch tensor).
+    :param cache_dir: directory where the frozen modules are stored (string).
+    :param cache_key: key identifying the weights and the input shape of the model (string).
+    :return: the same model whose forward runs the frozen module (nn.Module).
+    """
+    name = model.__class__.__name__
+    cache_path = os.path.join(cache_dir, '{}_{}.pt'.format(name.lower(), cache_key))
+    try:
+        if os.path.exists(cache_path):
+            scripted_model = torch.jit.load(cache_path, map_location=example_input.device)
+        else:
+            with torch.no_grad():
+                scripted_model = torch.jit.trace(model, example_input, check_trace=False)
+            scripted_model = torch.jit.freeze(scripted_model)
+            os.makedirs(cache_dir, exist_ok=True)
+            torch.jit.save(scripted_model, cache_path)
+    except Exception as error:
+        warnings.warn('Compilation of the {} failed, falling back to eager mode: {}'.format(name, error))
+        return model
+    model.forward = ShapeSpecializedForward(scripted_model, model.forward, example_input.shape, name)
+    return model
+
+
+def compile_model(model, general_args, example_input=None, cache_key=None, for_inference=False):
+    """
+    Runs a model in the graph mode selected by general_args.compile_mode. If the compilation fails, the model runs in
+    eager mode.
+    :param model: model to compile (nn.Module).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param example_input: input tensor with the shape of the inference batches, used to trace the model, only needed
+    by the "script" mode (torch tensor).
+    :param cache_key: items identifying the weights of the model, only needed by the "script" mode (tuple).
+    :param for_inference: boolean indicating if the model is only used for inference (boolean).
+    :return: compiled model (nn.Module).
+    """
+    if general_args.compile_mode == 'compile':
+        return torch_compile_model(model, general_args.compile_cache_dir)
+    if general_args.compile_mode == 'script':
+        if not for_inference:
+            warnings.warn('TorchScript freezing is only available for inference, the {} runs in eager mode during '
+                          'training.'.format(model.__class__.__name__))
+            return model
+        key = get_cache_key(cache_key, tuple(example_input.shape), example_input.device)
+        return script_model(model, example_input, general_args.compile_cache_dir, key)
+    return model
@@ -1,7 +1,28 @@
 import argparse
 
 
-def get_general_args():
+def str2bool(value):
+    """
+    Converts a command line value to a boolean, type=bool would convert any non-empty string (e.g. "False") to True.
+    :param value: value given on the command line (string).
+    :return: parsed value (boolean).
+    """
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ['true', 't', 'yes', 'y', '1']:
+        return True
+    if value.lower() in ['false', 'f', 'no', 'n', '0']:
+        return False
+    raise argparse.ArgumentTypeError('Boolean value expected, got "{}".'.format(value))
+
+
+def get_general_args(args=None):
+    """
+    Parses the arguments that are independent to the script being executed. Unknown arguments are ignored so that the
+    script specific arguments can be given on the same command line.
+    :param args: list of strings to parse, defaults to the command line arguments.
+    :return: Parsed arguments.
+    """
     parser = argparse.ArgumentParser(description='Stores all constants required for the models and training.')
     # Data related constants
     parser.add_argument('--window_length', default=8192, type=int, help='Number of samples per input tensor.')
@@ -34,6 +55,13 @@ def get_general_args():
                              'afterwards. This argument is the size of the channels for the first convolution. The '
                              'proportions of the channel sizes are kept for deepen layers, but will be scaled together '
                              ' along the depth of the model.')
+    parser.add_argument('--conv_implementation', default='direct', choices=['direct', 'fft', 'auto'], type=str,
+                        help='Implementation of the multi-scale convolutions. "direct" runs one convolution per scale '
+                             'and concatenates the outputs, "fft" computes the scales in the frequency domain and '
+                             '"auto" selects either the direct or the FFT convolution for each scale and input width '
+                             'according to a cost model. The cost model is calibrated on the CPU, see '
+                             'benchmarks/benchmark_fft_conv.py before using "auto" on another device. All share the '
+                             'same parameters, therefore checkpoints can be used with any of them.')
 
     # Auto-encoder's architecture related constants
     parser.add_argument('--autoencoder_n_block', default=4, type=int,
@@ -54,6 +82,10 @@ def get_general_args():
                              'with kernels of width 1.')
     parser.add_argument('--autoencoder_output_kernel_size', default=27, type=int,
                         help='Width of the kernel for the last convolution of the autoencoder.')
+    parser.add_argument('--autoencoder_checkpoint_levels', default=0, type=int,
+                        help='Number of levels of the auto-encoder, starting from the highest resolution, whose blocks '
+                             'recompute their activations during the backward pass instead of storing them. Trades '
+                             'compute for memory, 0 disables activation checkpointing.')
 
     # Generator's architecture related constants
     parser.add_argument('--generator_n_block', default=8, type=int,
@@ -74,6 +106,10 @@ def get_general_args():
                              'with kernels of width 1.')
     parser.add_argument('--generator_output_kernel_size', default=27, type=int,
                         help='Width of the kernel for the last convolution of the generator.')
+    parser.add_argument('--generator_checkpoint_levels', default=0, type=int,
+                        help='Number of levels of the generator, starting from the highest resolution, whose DownBlock '
+                             'and UpBlock recompute their activations during the backward pass instead of storing '
+                             'them. Trades compute for memory, 0 disables activation checkpointing.')
 
     # Discriminator's architecture related constants
     parser.add_argument('--discriminator_n_block', default=7, type=int,
@@ -93,6 +129,10 @@ def get_general_args():
                              'with kernels of width 1.')
     parser.add_argument('--fc1_output_features', default=128, type=int,
                         help='Number of output features in first linear layer of the discriminator.')
+    parser.add_argument('--discriminator_checkpoint_levels', default=0, type=int,
+                        help='Number of blocks of the discriminator, starting from the input block, that recompute '
+                             'their activations during the backward pass instead of storing them. With batch '
+                             'normalization the running statistics are updated twice per step.')
     parser.add_argument('--use_layer_norm', default=True, type=bool,
                         help='Flag indicating whether to use layer normalization or batch normalization as the latter '
                              'is incoherent with the wgan-gp framework.')
@@ -107,6 +147,146 @@ def get_general_args():
     parser.add_argument('--valid_batches_per_epoch', default=50, type=int,
                         help='Number of batches inside a validation pseudo-epoch. This allows for a faster but more'
                              ' stochastic evaluation.')
-    args = parser.parse_args()
+    parser.add_argument('--accumulation_steps', default=1, type=int,
+                        help='Number of micro-batches whose gradients are accumulated before each optimizer step. The '
+                             'effective batch size is accumulation_steps * train_batch_size and each training batch '
+                             'of a pseudo-epoch corresponds to one optimizer step.')
+    parser.add_argument('--loss_log_capacity', default=10000, type=int,
+                        help='Number of values of each loss kept in memory. The losses are written to a log next to '
+                             'the checkpoints and the checkpoints only store offsets in the log.')
+    parser.add_argument('--fused_discriminator_pass', default=False, type=str2bool,
+                        help='Flag indicating if the GAN trainers run the discriminator on the real and generated '
+                             'batches with a single forward pass on their concatenation, see '
+                             'benchmarks/benchmark_discriminator_pass.py. The samples of the gradient penalty keep '
+                             'their own pass so that its double backward only goes through them. Only used with layer '
+                             'normalization, whose statistics are computed per sample.')
+    parser.add_argument('--stft_n_ffts', default=[512], type=int, nargs='+',
+                        help='Sizes of the FFTs of the frequency loss, whose hop lengths are a quarter of the sizes. '
+                             'The loss is averaged over the resolutions. The LSD metric always uses 512 with a hop '
+                             'length of 128 and reuses the spectrograms of the loss when this resolution is part of '
+                             'them.')
+
+    # Distributed training related constants
+    parser.add_argument('--world_size', default=1, type=int,
+                        help='Number of processes of the data-parallel training. Each process trains on its own shard '
+                             'of the train set and the gradients are averaged before each optimizer step. Overridden '
+                             'by the WORLD_SIZE environment variable when launched with torchrun.')
+    parser.add_argument('--rank', default=0, type=int,
+                        help='Rank of the process in [0, world_size). The process of rank 0 saves the checkpoints. '
+                             'Overridden by the RANK environment variable when launched with torchrun.')
+    parser.add_argument('--dist_backend', default='gloo', type=str,
+                        help='Backend of torch.distributed, gloo supports the CPU.')
+    parser.add_argument('--dist_init_method', default='tcp://127.0.0.1:29500', type=str,
+                        help='Rendezvous of the processes, either "tcp://<address>:<port>" or "file://<path>" with a '
+                             'path on a shared file system. Several processes can be started on a single machine for '
+                             'local testing, e.g. by launching the training script with "--world_size 2 --rank 0" and '
+                             '"--world_size 2 --rank 1".')
+    parser.add_argument('--threads_per_rank', default=0, type=int,
+                        help='Number of intra-op threads of each process, 0 splits the cores evenly between the '
+                             'processes of the machine.')
+    parser.add_argument('--shard_optimizer_state', default=False, type=str2bool,
+                        help='Flag indicating if the states of the Adam optimizers are partitioned between the '
+                             'processes of the data-parallel training instead of being replicated (ZeRO stage 1). The '
+                             'checkpoints keep the format of a regular optimizer.')
+
+    # Checkpoint related constants
+    parser.add_argument('--async_checkpoint', default=True, type=str2bool,
+                        help='Flag indicating if the checkpoints are written by a background thread. The states are '
+                             'copied to the CPU before the training resumes and each file is written atomically.')
+    parser.add_argument('--checkpoint_keep_last', default=0, type=int,
+                        help='Number of checkpoints of the last epochs kept as "<savepath>_epoch_<epoch>" in addition '
+                             'to the latest one written to savepath.')
+    parser.add_argument('--checkpoint_keep_best', default=True, type=str2bool,
+                        help='Flag indicating if the checkpoint with the lowest validation loss is kept as '
+                             '"<savepath>_best".')
+    parser.add_argument('--save_on_sigterm', default=False, type=str2bool,
+                        help='Flag indicating if the trainer is saved at the next optimizer step and the process '
+                             'exits when SIGTERM is received, e.g. on preemptible machines. The processes of a '
+                             'distributed training agree on the stop request at every step. A process blocked outside '
+                             'of the optimizer steps, e.g. in the data loader or the evaluation, only exits when it '
+                             'reaches the next step.')
+
+    # Evaluation related constants
+    parser.add_argument('--cache_validation_set', default=False, type=str2bool,
+                        help='Flag indicating if a fixed subset of valid_batches_per_epoch batches of the validation '
+                             'set is loaded once and used at every epoch, instead of drawing new batches from the data '
+                             'loader. The outputs are reused by the plots of the reconstructions.')
+    parser.add_argument('--validation_set_on_device', default=True, type=str2bool,
+                        help='Flag indicating if the cached validation set is stored on the device instead of the '
+                             'pinned host memory.')
+    parser.add_argument('--validation_batch_size', default=256, type=int,
+                        help='Number of samples per forward pass on the cached validation set, 0 to use the batch size '
+                             'of the validation data loader.')
+    parser.add_argument('--background_eval', default=False, type=str2bool,
+                        help='Flag indicating if the generator of each new checkpoint is evaluated on the validation '
+                             'set (losses, SNR and LSD) by a separate process instead of blocking the training. The '
+                             'results are written to "<savepath>_metrics.jsonl" and read by the trainer at the end of '
+                             'the following epochs. Not used by the auto-encoder trainer.')
+    parser.add_argument('--eval_poll_interval', default=5., type=float,
+                        help='Time in seconds between two checks for a new checkpoint by the evaluation worker.')
+
+    # Execution related constants
+    parser.add_argument('--adam_implementation', default='foreach', choices=['default', 'foreach', 'fused'], type=str,
+                        help='Implementation of the Adam optimizers. "foreach" updates all the parameters with a few '
+                             'multi-tensor kernels and "fused" with a single kernel (GPU only), an implementation that '
+                             'is not supported by the installed torch falls back to the next simpler one.')
+    parser.add_argument('--compile_mode', default='none', choices=['none', 'compile', 'script'], type=str,
+                        help='Graph mode used to run the models. "compile" runs the models through torch.compile '
+                             'during training and inference, "script" traces and freezes the generator with '
+                             'TorchScript for inference only, for the shape of the inference batches. If the '
+                             'compilation fails the models run in eager mode, the errors of the compiled models are '
+                             'raised.')
+    parser.add_argument('--compile_cache_dir', default='objects/compile_cache', type=str,
+                        help='Directory where the compiled artifacts are cached to be reused across runs.')
+    parser.add_argument('--generator_plan_buffers', default=False, type=str2bool,
+                        help='Boolean indicating if the generator pre-allocates its skip-connection buffers once per '
+                             'input shape and reuses them across calls, only the buffers of the last input shape are '
+                             'kept. Only used when gradients are disabled, e.g. during validation and track '
+                             'generation.')
+
+    # Profiling related constants
+    parser.add_argument('--profile_blocks', default=False, type=str2bool,
+                        help='Flag indicating if a few training steps are profiled. Hooks on the multi-scale blocks of '
+                             'the models and on the convolutions of each scale measure the time, the estimated '
+                             'operations, the activation sizes and the allocator peaks, and torch.profiler records a '
+                             'trace. The hot-path table and the Chrome trace are written to "<savepath>_profile.txt" '
+                             'and "<savepath>_trace.json". The device is synchronized around each block, the profiled '
+                             'steps are therefore slower.')
+    parser.add_argument('--profile_steps', default=5, type=int, help='Number of profiled training steps.')
+    parser.add_argument('--profile_warmup_steps', default=2, type=int,
+                        help='Number of training steps before the profiling starts.')
+
+    # Telemetry related constants
+    parser.add_argument('--step_telemetry', default=False, type=str2bool,
+                        help='Flag indicating if each training step is split into data wait, host to device copy, '
+                             'generator forward, discriminator forward, gradient penalty, backward and optimizer '
+                             'phases. At the end of each epoch the quantiles of the phases, the samples per second '
+                             'and the real-time factor (seconds of audio trained per second) are appended to '
+                             '"<savepath>_telemetry.jsonl" and written in the Prometheus text format.')
+    parser.add_argument('--telemetry_synchronize', default=True, type=str2bool,
+                        help='Flag indicating if the device is synchronized between the phases, without it the GPU '
+                             'time is attributed to the phase that waits for the results.')
+    parser.add_argument('--telemetry_sample_rate', default=16000, type=int,
+                        help='Sampling frequency of the training data in Hz, used by the real-time factor.')
+    parser.add_argument('--prometheus_path', default=None, type=str,
+                        help='Location of the Prometheus text file, e.g. in the directory of the textfile collector '
+                             'of a node exporter, defaults to "<savepath>_telemetry.prom".')
+
+    # Memory planning related constants
+    parser.add_argument('--auto_batch_size', default='none', choices=['none', 'max', 'accumulate'], type=str,
+                        help='Selection of the train batch size by the memory planner, which estimates the memory of '
+                             'the parameters, gradients, optimizer states and activations of the models of the '
+                             'trainer. "max" uses the largest batch that fits the memory budget with the current '
+                             'accumulation_steps, "accumulate" keeps the effective batch size train_batch_size * '
+                             'accumulation_steps and splits it in the fewest micro-batches that fit the budget.')
+    parser.add_argument('--memory_budget', default=None, type=float,
+                        help='Memory available for the training in GiB, defaults to 90%% of the free memory of the '
+                             'device. On the CPU the free memory of the host is shared by its processes.')
+    parser.add_argument('--memory_dry_run', default=True, type=str2bool,
+                        help='Flag indicating if the selected batch size is checked by a dry run of the models on the '
+                             'GPU, the estimate is corrected by the measured peak until it fits the budget.')
+    parser.add_argument('--max_auto_batch_size', default=512, type=int,
+                        help='Largest train batch size selected by the memory planner.')
+    args, _ = parser.parse_known_args(args)
     return args
 
@@ -0,0 +1,188 @@
+from utils.parameters import get_adam_implementation_kwargs
+from torch import distributed as dist
+import warnings
+import torch
+import os
+
+try:
+    from torch.distributed.optim import ZeroRedundancyOptimizer
+except ImportError:
+    ZeroRedundancyOptimizer = None
+
+
+def is_distributed():
+    """
+    :return: boolean indicating if the process belongs to an initialized process group (boolean).
+    """
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    """
+    :return: rank of the process, 0 if the training is not distributed (scalar int).
+    """
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    """
+    :return: number of processes, 1 if the training is not distributed (scalar int).
+    """
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def get_local_world_size():
+    """
+    :return: number of processes on the host, read from LOCAL_WORLD_SIZE if set (e.g. by torchrun), otherwise all the
+    processes are assumed to run on the same host (scalar int).
+    """
+    return int(os.environ.get('LOCAL_WORLD_SIZE', get_world_size()))
+
+
+def is_main_process():
+    """
+    :return: boolean indicating if the process is responsible for the checkpoints and the reports (boolean).
+    """
+    return get_rank() == 0
+
+
+def init_distributed(general_args):
+    """
+    Joins the process group if the training is distributed. The rank and the world size are read from the environment
+    variables RANK and WORLD_SIZE if they are set (e.g. by torchrun), otherwise from general_args. The cores of the
+    machine are split between the local processes.
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :return: boolean indicating if the training is distributed (boolean).
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', general_args.world_size))
+    rank = int(os.environ.get('RANK', general_args.rank))
+    if world_size <= 1 or is_distributed():
+        return is_distributed()
+
+    # Use the rendezvous of the launcher if any
+    init_method = 'env://' if 'MASTER_ADDR' in os.environ else general_args.dist_init_method
+    dist.init_process_group(backend=general_args.dist_backend, init_method=init_method, rank=rank,
+                            world_size=world_size)
+
+    # Avoid over-subscription of the cores by the intra-op thread pools of the local processes
+    n_threads = general_args.threads_per_rank or max(1, (os.cpu_count() or 1) // get_local_world_size())
+    torch.set_num_threads(n_threads)
+    return True
+
+
+def cleanup_distributed():
+    """
+    Leaves the process group if any.
+    :return: None
+    """
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def broadcast_parameters(model):
+    """
+    Copies the parameters and buffers of the model of the main process to the models of the other processes so that
+    all the replicas start from identical states.
+    :param model: model replicated on each process (nn.Module).
+    :return: None
+    """
+    if not is_distributed():
+        return
+    with torch.no_grad():
+        for tensor in model.state_dict().values():
+            dist.broadcast(tensor, src=0)
+
+
+def all_reduce_gradients(model):
+    """
+    Averages the gradients of the model over the processes. The gradients are flattened in a single buffer to need a
+    single collective call. It is the synchronization done by DistributedDataParallel, called explicitly before each
+    optimizer step so that it also supports the double backward of the gradient penalty and the gradient accumulation.
+    :param model: model replicated on each process (nn.Module).
+    :return: None
+    """
+    if not is_distributed():
+        return
+    parameters = [p for p in model.parameters() if p.requires_grad]
+    for p in parameters:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+    if not parameters:
+        return
+    gradients = torch.cat([p.grad.reshape(-1) for p in parameters])
+    dist.all_reduce(gradients)
+    gradients /= get_world_size()
+    offset = 0
+    for p in parameters:
+        p.grad.copy_(gradients[offset:offset + p.numel()].view_as(p.grad))
+        offset += p.numel()
+
+
+def get_adam_optimizer(parameters, lr, shard_state=False, implementation='default'):
+    """
+    Instantiates an Adam optimizer. If the training is distributed and shard_state is set, the optimizer states are
+    partitioned between the processes (ZeRO stage 1): each process only keeps the moments of its partition, updates
+    its parameters and broadcasts them to the other processes.
+    :param parameters: parameters to optimize (iterable).
+    :param lr: learning rate (scalar float).
+    :param shard_state: boolean indicating if the optimizer states are sharded between the processes (boolean).
+    :param implementation: either 'default', 'foreach' or 'fused', see utils.parameters (string).
+    :return: optimizer (torch Optimizer).
+    """
+    parameters = list(parameters)
+    implementation_kwargs = get_adam_implementation_kwargs(parameters, implementation)
+    if shard_state and is_distributed():
+        if ZeroRedundancyOptimizer is not None:
+            return ZeroRedundancyOptimizer(parameters, optimizer_class=torch.optim.Adam, lr=lr, **implementation_kwargs)
+        warnings.warn('ZeroRedundancyOptimizer is not available in torch {}, the optimizer states are not '
+                      'sharded.'.format(torch.__version__))
+    return torch.optim.Adam(params=parameters, lr=lr, **implementation_kwargs)
+
+
+def get_optimizer_state_dict(optimizer):
+    """
+    Returns the state dict of an optimizer in the format of a regular optimizer. The shards of a sharded optimizer are
+    gathered on the main process, therefore this function must be called by all the processes.
+    :param optimizer: optimizer, possibly sharded (torch Optimizer).
+    :return: state dict of the optimizer, None on the other processes if the optimizer is sharded (dictionary).
+    """
+    if ZeroRedundancyOptimizer is not None and isinstance(optimizer, ZeroRedundancyOptimizer):
+        optimizer.consolidate_state_dict(to=0)
+        return optimizer.state_dict() if is_main_process() else None
+    return optimizer.state_dict()
+
+
+def any_process(flag):
+    """
+    Checks if a flag is set on at least one process, e.g. to stop all the processes at the same step.
+    :param flag: flag of the process (boolean).
+    :return: boolean indicating if the flag is set on any process (boolean).
+    """
+    if not is_distributed():
+        return flag
+    tensor = torch.tensor([int(flag)])
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return bool(tensor.item())
+
+
+def barrier():
+    """
+    Waits until all the processes reach this point, e.g. for a file written by the main process.
+    :return: None
+    """
+    if is_distributed():
+        dist.barrier()
+
+
+def min_over_processes(value):
+    """
+    Computes the minimum of a value over the processes, e.g. so that all the processes choose the same batch size.
+    :param value: value of the process (scalar int).
+    :return: minimum of the value over the processes (scalar int).
+    """
+    if not is_distributed():
+        return value
+    tensor = torch.tensor([value])
+    dist.all_reduce(tensor, op=dist.ReduceOp.MIN)
+    return int(tensor.item())
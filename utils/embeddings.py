@@ -0,0 +1,131 @@
+from utils.distributed import barrier, is_main_process
+from datasets.datasets import DatasetWithEmbeddings
+from utils.validation_set import inference_mode
+from torch.utils.data import DataLoader
+import contextlib
+import numpy as np
+import hashlib
+import torch
+import os
+
+# Precisions of the frozen auto-encoder
+AUTOCAST_DTYPES = {'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
+
+def get_file_hash(filepath, chunk_size=1 << 20):
+    """
+    :param filepath: location of a file, e.g. the checkpoint of the auto-encoder (string).
+    :param chunk_size: number of bytes read at once (scalar int).
+    :return: short hexadecimal digest of the content of the file (string).
+    """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def get_train_datapath(trainer_args):
+    """
+    :param trainer_args: argument parser that contains the location of the data.
+    :return: location of the file holding the train set (string).
+    """
+    return trainer_args.train_npy_filepath if trainer_args.use_npy else trainer_args.hdf5_filepath
+
+
+def get_file_stamp(filepath):
+    """
+    :param filepath: location of a file, e.g. the train set (string).
+    :return: size and modification time of the file, cheaper than hashing a large data set (string).
+    """
+    stat = os.stat(filepath)
+    return '{}_{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def get_embeddings_path(datapath, autoencoder_path):
+    """
+    Locates the embeddings of the train targets next to the data set. The file is keyed by the hash of the auto-encoder
+    checkpoint and by the size and modification time of the data set, a new auto-encoder or a regenerated data set
+    therefore never reuses the embeddings of a previous one.
+    :param datapath: location of the file holding the train set (string).
+    :param autoencoder_path: location of the checkpoint of the auto-encoder (string).
+    :return: location of the .npy file of the embeddings (string).
+    """
+    return '{}_train_embeddings_{}_{}.npy'.format(os.path.splitext(datapath)[0], get_file_hash(autoencoder_path),
+                                                  get_file_stamp(datapath))
+
+
+def get_autocast(device, precision):
+    """
+    :param device: device on which the auto-encoder runs (string).
+    :param precision: either 'float32', 'float16' or 'bfloat16' (string).
+    :return: context running the operations in the given precision, reduced precision is only used on the GPU.
+    """
+    if precision not in AUTOCAST_DTYPES or not str(device).startswith('cuda') or not hasattr(torch, 'autocast'):
+        return contextlib.nullcontext()
+    return torch.autocast(device_type='cuda', dtype=AUTOCAST_DTYPES[precision])
+
+
+def compute_target_embeddings(encoder, dataset, embeddings_path, device, batch_size, num_workers):
+    """
+    Runs the encoder on all the targets of a data set, in order, and writes the embeddings to a memory-mapped .npy
+    file. The file is written under a temporary name which is then renamed, an interrupted pass leaves no file.
+    :param encoder: frozen encoder of the auto-encoder (nn.Module).
+    :param dataset: data set returning (x_input, x_target) pairs (torch Dataset).
+    :param embeddings_path: location of the .npy file (string).
+    :param device: device on which the encoder runs (string).
+    :param batch_size: number of targets per forward pass (scalar int).
+    :param num_workers: number of workers of the data loader (scalar int).
+    :return: None
+    """
+    temporary_path = embeddings_path + '.tmp'
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    embeddings = None
+    start = 0
+    with inference_mode():
+        for _, target_batch in loader:
+            embedding_batch = encoder(target_batch.to(device)).float().cpu().numpy()
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=np.float32,
+                                                       shape=(len(dataset),) + embedding_batch.shape[1:])
+            embeddings[start:start + embedding_batch.shape[0]] = embedding_batch
+            start += embedding_batch.shape[0]
+    embeddings.flush()
+    del embeddings
+    os.replace(temporary_path, embeddings_path)
+
+
+def prepare_target_embeddings(encoder, dataset, embeddings_path, device, batch_size, num_workers):
+    """
+    Computes the embeddings of the train targets unless a file with one embedding per sample already exists. The key of
+    embeddings_path identifies the auto-encoder and the data file, the number of rows guards against a different
+    windowing of the same file. Only the main process computes them, the other processes wait for the file.
+    :param encoder: frozen encoder of the auto-encoder (nn.Module).
+    :param dataset: data set returning (x_input, x_target) pairs (torch Dataset).
+    :param embeddings_path: location of the .npy file (string).
+    :param device: device on which the encoder runs (string).
+    :param batch_size: number of targets per forward pass (scalar int).
+    :param num_workers: number of workers of the data loader (scalar int).
+    :return: None
+    """
+    if is_main_process():
+        if os.path.exists(embeddings_path) and np.load(embeddings_path, mmap_mode='r').shape[0] == len(dataset):
+            print('Reusing the target embeddings of {}'.format(embeddings_path))
+        else:
+            print('Computing the target embeddings in {}'.format(embeddings_path))
+            compute_target_embeddings(encoder, dataset, embeddings_path, device, batch_size, num_workers)
+    barrier()
+
+
+def add_target_embeddings(train_loader, embeddings_path):
+    """
+    Rebuilds a train loader whose batches also hold the precomputed embeddings of the targets. The sampler of the
+    original loader is kept, e.g. the shard of the process if the training is distributed.
+    :param train_loader: train data loader returning (x_input, x_target) batches (torch DataLoader).
+    :param embeddings_path: location of the .npy file of the embeddings (string).
+    :return: train data loader returning (x_input, x_target, phi_target) batches (torch DataLoader).
+    """
+    return DataLoader(DatasetWithEmbeddings(train_loader.dataset, embeddings_path),
+                      batch_size=train_loader.batch_size, sampler=train_loader.sampler,
+                      num_workers=train_loader.num_workers, pin_memory=train_loader.pin_memory,
+                      drop_last=train_loader.drop_last)
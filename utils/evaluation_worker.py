@@ -0,0 +1,218 @@
+from utils.checkpoints import atomic_write
+from utils.utils import prepare_maestro_data
+from models.generator import Generator
+from utils.metrics import snr, lsd_from_spectrograms
+from layers.stft import METRIC_RESOLUTION
+from itertools import cycle
+import multiprocessing
+from torch import nn
+import numpy as np
+import torch
+import json
+import io
+import os
+
+
+def get_metrics_path(savepath):
+    """
+    :param savepath: location of the checkpoints of a trainer (string).
+    :return: location of the file where the evaluation worker writes the metrics of the checkpoints (string).
+    """
+    return os.path.splitext(savepath)[0] + '_metrics.jsonl'
+
+
+def read_metrics(metrics_path, offset=0):
+    """
+    Reads the records written by the evaluation worker after a given position of the metrics file. An incomplete last
+    line is left for the next call.
+    :param metrics_path: location of the metrics file (string).
+    :param offset: position in bytes from which to read (scalar int).
+    :return: list of records (list of dictionaries) and position after the last complete record (scalar int).
+    """
+    if not os.path.exists(metrics_path):
+        return [], offset
+    with open(metrics_path, 'rb') as file:
+        file.seek(offset)
+        data = file.read()
+    records = []
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b'\n'):
+            break
+        records.append(json.loads(line.decode()))
+        offset += len(line)
+    return records, offset
+
+
+class EvaluationWorker(object):
+    def __init__(self, savepath, valid_loader, valid_batches_per_epoch, spectrogram, general_args, keep_best=False):
+        """
+        Initializes the class EvaluationWorker that evaluates the generator of each new checkpoint of a trainer on the
+        validation set. It runs in its own process with its own copy of the generator, the results are appended to a
+        metrics file read by the trainer.
+        :param savepath: location of the checkpoints written by the trainer (string).
+        :param valid_loader: data loader of the validation set (torch DataLoader).
+        :param valid_batches_per_epoch: number of batches evaluated per checkpoint (scalar int).
+        :param spectrogram: spectrogram used by the trainer for the frequency loss (nn.Module).
+        :param general_args: argument parser that contains the arguments that are independent to the script being
+        executed.
+        :param keep_best: boolean indicating if the checkpoint with the lowest validation loss is copied to
+        '<name>_best<extension>' (boolean).
+        """
+        self.device = ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.savepath = savepath
+        self.metrics_path = get_metrics_path(savepath)
+        self.valid_loader_iter = cycle(iter(valid_loader))
+        self.valid_batches_per_epoch = valid_batches_per_epoch
+        self.keep_best = keep_best
+
+        # Own copy of the generator, the training process is never blocked by the evaluation
+        self.generator = Generator(general_args).to(self.device)
+        self.spectrogram = spectrogram.to(self.device)
+        self.criterion = nn.MSELoss()
+
+        # Lowest validation loss of the metrics file, used to select the best checkpoint
+        records, _ = read_metrics(self.metrics_path)
+        self.best_loss = min([record['time_l2'] for record in records], default=np.inf)
+
+        # Identifier of the last evaluated checkpoint, a new file is created by each atomic write
+        self.last_checkpoint = None
+
+    def evaluate(self, checkpoint):
+        """
+        Computes the validation losses and the SNR and LSD metrics of the generator of a checkpoint.
+        :param checkpoint: loaded checkpoint (dictionary).
+        :return: record of the metrics (dictionary).
+        """
+        self.generator.load_state_dict(checkpoint['generator_state_dict'])
+        self.generator.eval()
+        batch_losses = {'time_l2': [], 'freq_l2': []}
+        snrs = []
+        lsds = []
+        with torch.no_grad():
+            for i in range(self.valid_batches_per_epoch):
+                # Transfer to GPU
+                local_batch = next(self.valid_loader_iter)
+                input_batch, target_batch = local_batch[0].to(self.device), local_batch[1].to(self.device)
+
+                # Generates a batch
+                generated_batch = self.generator(input_batch)
+
+                # Compute the losses, the spectrograms of the frequency loss and of the LSD come from the same pass
+                generated_spectrograms, target_spectrograms = self.spectrogram.get_pair_spectrograms(generated_batch,
+                                                                                                     target_batch)
+                batch_losses['time_l2'].append(self.criterion(generated_batch, target_batch).item())
+                batch_losses['freq_l2'].append(
+                    self.spectrogram.l2_loss_from_spectrograms(generated_spectrograms, target_spectrograms).item())
+
+                # Get the metrics
+                snrs.append(snr(x=generated_batch.squeeze(), x_ref=target_batch.squeeze()))
+                lsds.append(lsd_from_spectrograms(generated_spectrograms[METRIC_RESOLUTION],
+                                                  target_spectrograms[METRIC_RESOLUTION]))
+        snrs = torch.cat(snrs).cpu().numpy()
+        lsds = torch.cat(lsds).cpu().numpy()
+
+        # Some signals corresponding to silence will be all zeroes and cause troubles due to the logarithm
+        snrs[np.isinf(snrs)] = np.nan
+        lsds[np.isinf(lsds)] = np.nan
+        return {'epoch': checkpoint['epoch'],
+                'time_l2': float(np.mean(batch_losses['time_l2'])),
+                'freq_l2': float(np.mean(batch_losses['freq_l2'])),
+                'snr_mean': float(np.nanmean(snrs)), 'snr_std': float(np.nanstd(snrs)),
+                'lsd_mean': float(np.nanmean(lsds)), 'lsd_std': float(np.nanstd(lsds))}
+
+    def write_record(self, record):
+        """
+        Appends a record to the metrics file.
+        :param record: metrics of a checkpoint (dictionary).
+        :return: None
+        """
+        with open(self.metrics_path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def evaluate_new_checkpoint(self):
+        """
+        Evaluates the checkpoint at savepath if it was not evaluated yet. The file is read once, therefore the
+        evaluated state is not affected if the trainer writes a new checkpoint in the meantime.
+        :return: boolean indicating if a checkpoint was evaluated (boolean).
+        """
+        if not os.path.exists(self.savepath):
+            return False
+        with open(self.savepath, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            checkpoint_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if checkpoint_id == self.last_checkpoint:
+                return False
+            data = file.read()
+        self.last_checkpoint = checkpoint_id
+        record = self.evaluate(torch.load(io.BytesIO(data), map_location=self.device))
+        self.write_record(record)
+
+        # Keep a copy of the best checkpoint
+        if self.keep_best and record['time_l2'] <= self.best_loss:
+            self.best_loss = record['time_l2']
+            root, extension = os.path.splitext(self.savepath)
+            atomic_write(data, root + '_best' + extension)
+        return True
+
+    def run(self, stop_event, poll_interval):
+        """
+        Watches savepath and evaluates each new checkpoint until stop_event is set. The last checkpoint is evaluated
+        before returning.
+        :param stop_event: event set by the trainer to stop the worker (multiprocessing Event).
+        :param poll_interval: time between two checks of savepath in seconds (scalar float).
+        :return: None
+        """
+        while not stop_event.is_set():
+            if not self.evaluate_new_checkpoint():
+                stop_event.wait(poll_interval)
+        self.evaluate_new_checkpoint()
+
+
+def run_evaluation_worker(savepath, spectrogram, general_args, trainer_args, stop_event):
+    """
+    Entry point of the evaluation process.
+    :param savepath: location of the checkpoints written by the trainer (string).
+    :param spectrogram: spectrogram used by the trainer for the frequency loss (nn.Module).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param trainer_args: argument parser that contains the arguments of the trainer, used to build the data loaders.
+    :param stop_event: event set by the trainer to stop the worker (multiprocessing Event).
+    :return: None
+    """
+    _, _, valid_loader = prepare_maestro_data(trainer_args)
+    worker = EvaluationWorker(savepath, valid_loader, general_args.valid_batches_per_epoch, spectrogram, general_args,
+                              keep_best=general_args.checkpoint_keep_best)
+    worker.run(stop_event, general_args.eval_poll_interval)
+
+
+def start_evaluation_worker(savepath, spectrogram, general_args, trainer_args):
+    """
+    Starts the evaluation worker in a new process.
+    :param savepath: location of the checkpoints written by the trainer (string).
+    :param spectrogram: spectrogram used by the trainer for the frequency loss, on the CPU (nn.Module).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param trainer_args: argument parser that contains the arguments of the trainer, used to build the data loaders.
+    :return: evaluation process (multiprocessing Process) and event stopping it (multiprocessing Event).
+    """
+    # The CUDA context cannot be shared with a forked process
+    context = multiprocessing.get_context('spawn')
+    stop_event = context.Event()
+    process = context.Process(target=run_evaluation_worker, name='evaluation-worker',
+                              args=(savepath, spectrogram, general_args, trainer_args, stop_event))
+    process.start()
+    return process, stop_event
+
+
+def stop_evaluation_worker(process, stop_event):
+    """
+    Stops the evaluation worker once it has evaluated the last checkpoint.
+    :param process: evaluation process (multiprocessing Process).
+    :param stop_event: event stopping the process (multiprocessing Event).
+    :return: None
+    """
+    if process.is_alive():
+        stop_event.set()
+        process.join()
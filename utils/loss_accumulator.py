@@ -0,0 +1,51 @@
+import torch
+
+
+class LossAccumulator(object):
+    def __init__(self):
+        """
+        Initializes the class LossAccumulator that keeps the losses of the training steps on the device. Reading a loss
+        with .item() at every step forces a synchronization with the device, the pending losses are instead transferred
+        all at once when they are flushed in the loss dictionaries of the trainer, e.g. before printing or at the end of
+        a pseudo-epoch.
+        """
+        self.pending = {}
+
+    def append(self, value, *keys):
+        """
+        Appends the loss of a step without synchronization.
+        :param value: scalar loss (torch tensor).
+        :param keys: keys of the list of the loss dictionary in which the value is flushed, e.g. 'generator', 'time_l2'.
+        :return: None
+        """
+        self.pending.setdefault(keys, []).append(value.detach().reshape(()))
+
+    def append_mean(self, values, *keys):
+        """
+        Appends the mean of the losses of several micro-batches as the loss of a step without synchronization.
+        :param values: scalar losses (list of torch tensors).
+        :param keys: keys of the list of the loss dictionary in which the value is flushed.
+        :return: None
+        """
+        self.append(torch.stack([value.detach().reshape(()) for value in values]).mean(), *keys)
+
+    def flush(self, losses):
+        """
+        Transfers the pending losses to the host with a single synchronization and appends them as floats to the lists
+        of the loss dictionary.
+        :param losses: nested dictionary of lists of floats, e.g. trainer.train_losses (dictionary).
+        :return: None
+        """
+        if not self.pending:
+            return
+        keys = list(self.pending)
+        values = torch.cat([torch.stack(self.pending[key]).float() for key in keys]).cpu().tolist()
+        offset = 0
+        for key in keys:
+            target = losses
+            for k in key:
+                target = target[k]
+            n_values = len(self.pending[key])
+            target.extend(values[offset:offset + n_values])
+            offset += n_values
+        self.pending = {}
@@ -0,0 +1,247 @@
+import numpy as np
+import collections
+import itertools
+import torch
+import json
+import os
+
+
+class LossSeries(object):
+    def __init__(self, filepath, capacity):
+        """
+        Initializes the class LossSeries that stores the values of a single loss in an append-only binary file of
+        little-endian float32. Only the last values are kept in memory in a ring buffer, older values are read from the
+        file when needed. The class behaves like the list of floats it replaces: it supports append, extend, len,
+        indexing, slicing, iteration and conversion to a numpy array.
+        :param filepath: location of the binary file, created if it does not exist (string).
+        :param capacity: number of values kept in memory (scalar int).
+        """
+        self.filepath = filepath
+        self.recent = collections.deque(maxlen=capacity)
+        self.length = os.path.getsize(filepath) // 4 if os.path.exists(filepath) else 0
+        self.file = open(filepath, 'ab')
+        self.recent.extend(self.read(max(0, self.length - capacity), self.length).tolist())
+
+    def append(self, value):
+        """
+        :param value: loss value (scalar float).
+        :return: None
+        """
+        self.extend([value])
+
+    def extend(self, values):
+        """
+        :param values: loss values (iterable of scalar float).
+        :return: None
+        """
+        values = np.asarray(list(values), dtype='<f4').reshape(-1)
+        self.file.write(values.tobytes())
+        self.recent.extend(values.tolist())
+        self.length += values.shape[0]
+
+    def flush(self):
+        """
+        Writes the buffered values to the file.
+        :return: None
+        """
+        self.file.flush()
+
+    def read(self, start, stop):
+        """
+        Reads the values in [start, stop) from the file.
+        :param start: index of the first value (scalar int).
+        :param stop: index after the last value (scalar int).
+        :return: values (numpy array).
+        """
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+        self.flush()
+        return np.fromfile(self.filepath, dtype='<f4', count=stop - start, offset=4 * start)
+
+    def truncate(self, length):
+        """
+        Drops the values after the given length, e.g. the values logged after the checkpoint a run is resumed from.
+        :param length: number of values to keep (scalar int).
+        :return: None
+        """
+        length = min(length, self.length)
+        self.flush()
+        self.file.truncate(4 * length)
+        self.length = length
+        self.recent.clear()
+        self.recent.extend(self.read(max(0, length - self.recent.maxlen), length).tolist())
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        first_recent = self.length - len(self.recent)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            stop = max(start, stop) if step > 0 else stop
+            if step < 0:
+                return self[stop + 1:start + 1][::step]
+            if start >= first_recent:
+                values = list(itertools.islice(self.recent, start - first_recent, stop - first_recent))
+            else:
+                values = self.read(start, stop).tolist()
+            return values[::step]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('Loss series index out of range.')
+        if index >= first_recent:
+            return self.recent[index - first_recent]
+        return float(self.read(index, index + 1)[0])
+
+    def __iter__(self):
+        return iter(self.read(0, self.length).tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.read(0, self.length)
+        return values if dtype is None else values.astype(dtype)
+
+
+class LossLog(object):
+    def __init__(self, directory, capacity):
+        """
+        Initializes the class LossLog that stores the series of losses of a trainer in a directory, one binary file per
+        series. The file index.json maps the name of each series to its file. The checkpoints only store the length of
+        each series (offsets), therefore their size does not grow with the number of steps.
+        :param directory: location of the log, created if it does not exist (string).
+        :param capacity: number of values of each series kept in memory (scalar int).
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = os.path.realpath(directory)
+        self.capacity = capacity
+        self.series = {}
+
+        # Reopen the series of a previous run
+        for name in read_index(self.directory):
+            self.get_series(name)
+
+    def get_series(self, name):
+        """
+        :param name: name of the series, e.g. 'train/discriminator_adversarial/real' (string).
+        :return: series, created if it does not exist (LossSeries).
+        """
+        if name not in self.series:
+            filename = name.replace('/', '.') + '.f32'
+            self.series[name] = LossSeries(os.path.join(self.directory, filename), self.capacity)
+            self.write_index()
+        return self.series[name]
+
+    def write_index(self):
+        """
+        Writes the mapping from the names of the series to their files.
+        :return: None
+        """
+        index = {'series': {name: os.path.basename(series.filepath) for name, series in self.series.items()}}
+        with open(os.path.join(self.directory, 'index.json'), 'w') as file:
+            json.dump(index, file, indent=2)
+
+    def wrap(self, losses, prefix):
+        """
+        Replaces the lists of a nested dictionary of losses by series of the log. The values of the lists are appended
+        to the series, which allows to migrate the losses stored in the checkpoints of previous versions.
+        :param losses: nested dictionary of lists of floats (dictionary).
+        :param prefix: prefix of the names of the series, e.g. 'train' (string).
+        :return: nested dictionary of series with the same keys (dictionary).
+        """
+        wrapped = {}
+        for key, value in losses.items():
+            name = '{}/{}'.format(prefix, key)
+            if isinstance(value, dict):
+                wrapped[key] = self.wrap(value, name)
+            else:
+                wrapped[key] = self.get_series(name)
+                if not isinstance(value, LossSeries):
+                    wrapped[key].extend(value)
+        return wrapped
+
+    def get_offsets(self):
+        """
+        Writes the buffered values and returns the length of each series, which is what the checkpoints store.
+        :return: length of each series (dictionary).
+        """
+        for series in self.series.values():
+            series.flush()
+        return {name: len(series) for name, series in self.series.items()}
+
+    def truncate(self, offsets):
+        """
+        Truncates each series to the length given in offsets, series missing from offsets are emptied.
+        :param offsets: length of each series (dictionary).
+        :return: None
+        """
+        for name, series in self.series.items():
+            series.truncate(offsets.get(name, 0))
+
+    def extend_from(self, directory, offsets):
+        """
+        Appends the values of the series of another log, e.g. when a run is resumed from a checkpoint saved elsewhere.
+        :param directory: location of the other log (string).
+        :param offsets: number of values to copy from each series of the other log (dictionary).
+        :return: None
+        """
+        for name, values in read_series(directory, offsets).items():
+            self.get_series(name).extend(values)
+
+
+def read_index(directory):
+    """
+    :param directory: location of a loss log (string).
+    :return: mapping from the names of the series to their files (dictionary).
+    """
+    index_path = os.path.join(directory, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as file:
+        return json.load(file)['series']
+
+
+def read_series(directory, offsets):
+    """
+    Reads the series of a loss log up to the given offsets.
+    :param directory: location of the log (string).
+    :param offsets: number of values to read from each series (dictionary).
+    :return: values of each series (dictionary of numpy arrays).
+    """
+    index = read_index(directory)
+    return {name: np.fromfile(os.path.join(directory, index[name]), dtype='<f4', count=length)
+            for name, length in offsets.items() if name in index}
+
+
+def get_loss_log_directory(savepath):
+    """
+    :param savepath: location of the checkpoints of a trainer (string).
+    :return: location of the loss log of the trainer (string).
+    """
+    return os.path.splitext(savepath)[0] + '_losses'
+
+
+def load_losses(loadpath, phase):
+    """
+    Loads the losses of a phase from a checkpoint, e.g. to plot them with utils.utils.plot_losses. Works with the
+    checkpoints storing offsets in a loss log as well as with the ones storing the lists of losses.
+    :param loadpath: location of the checkpoint (string).
+    :param phase: either 'train', 'test' or 'valid' (string).
+    :return: nested dictionary of losses (dictionary of numpy arrays).
+    """
+    checkpoint = torch.load(loadpath, map_location='cpu')
+    if 'loss_offsets' not in checkpoint:
+        return checkpoint['{}_losses'.format(phase)]
+    losses = {}
+    prefix = phase + '/'
+    for name, values in read_series(checkpoint['loss_log'], checkpoint['loss_offsets']).items():
+        if not name.startswith(prefix):
+            continue
+        keys = name[len(prefix):].split('/')
+        target = losses
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = values
+    return losses
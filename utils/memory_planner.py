@@ -0,0 +1,350 @@
+from utils.distributed import get_local_world_size, get_world_size, is_main_process, min_over_processes
+from models.discriminator import Discriminator
+from models.autoencoder import AutoEncoder
+from models.generator import Generator
+import warnings
+import torch
+import math
+import os
+
+GIB = 1024 ** 3
+
+# Number of moments stored by Adam for each parameter
+ADAM_STATES = 2
+
+# Fraction of the free memory used when no budget is given
+DEFAULT_BUDGET_FRACTION = 0.9
+
+# Number of dry runs before the selection is accepted
+MAX_DRY_RUNS = 3
+
+
+def get_parameter_bytes(model):
+    """
+    :param model: model (nn.Module).
+    :return: number of bytes of the parameters of the model (scalar int).
+    """
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def measure_saved_bytes(model, batch_size, window_length, device):
+    """
+    Runs a forward pass of the model and counts the tensors saved for the backward pass, i.e. the activations kept
+    alive until the backward pass. The parameters are not counted and the activations of the checkpointed blocks are
+    only counted through their inputs.
+    :param model: model in training mode (nn.Module).
+    :param batch_size: number of samples (scalar int).
+    :param window_length: number of samples per input tensor (scalar int).
+    :param device: device of the model, e.g. 'meta' to measure without allocating memory (string).
+    :return: number of bytes of the saved tensors (scalar int).
+    """
+    parameters = {id(p) for p in model.parameters()}
+    saved = {}
+
+    def pack(tensor):
+        # The tensors are kept alive until the end of the pass so that their ids are unique
+        if id(tensor) not in parameters:
+            saved[id(tensor)] = tensor
+        return tensor
+
+    x = torch.zeros(batch_size, 1, window_length, device=device, requires_grad=True)
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        model(x)
+    return sum(tensor.numel() * tensor.element_size() for tensor in saved.values())
+
+
+class ModelPlan(object):
+    def __init__(self, get_model, window_length, trainable=True):
+        """
+        Initializes the class ModelPlan that estimates the memory of a model as a function of the batch size. The
+        activations are measured on the meta device, which only propagates the shapes, and on the CPU if an operation
+        of the model is not supported there. They are measured for two batch sizes, the activations of a pass on B
+        samples are then estimated as activations_fixed + B * activations_per_sample.
+        :param get_model: function without arguments that builds the model (function).
+        :param window_length: number of samples per input tensor (scalar int).
+        :param trainable: boolean indicating if the model is optimized, a frozen model has no gradients nor optimizer
+        states (boolean).
+        """
+        self.get_model = get_model
+        self.trainable = trainable
+        model = get_model()
+        self.parameter_bytes = get_parameter_bytes(model)
+
+        # The batch normalization needs more than one sample per channel
+        try:
+            small, large = [measure_saved_bytes(model.to('meta'), batch_size, window_length, 'meta')
+                            for batch_size in [2, 4]]
+        except (NotImplementedError, RuntimeError):
+            model = get_model()
+            small, large = [measure_saved_bytes(model, batch_size, window_length, 'cpu') for batch_size in [2, 4]]
+        self.activations_per_sample = (large - small) / 2
+        self.activations_fixed = max(0., small - 2 * self.activations_per_sample)
+
+    def get_activation_bytes(self, batch_size):
+        """
+        :param batch_size: number of samples of the pass (scalar float).
+        :return: estimated number of bytes of the activations of a pass (scalar float).
+        """
+        return self.activations_fixed + batch_size * self.activations_per_sample
+
+
+class MemoryPlan(object):
+    def __init__(self, general_args, trainer_args, trainer_name):
+        """
+        Initializes the class MemoryPlan that estimates the peak memory of a training step of a trainer from the
+        arguments: the parameters, the gradients and the Adam states of the trained models, the parameters of the
+        frozen models, the activations of the passes of the step and the micro-batches of the step. A step is made of
+        phases (discriminator and generator updates) whose graphs are freed by their backward pass, the activations are
+        therefore the ones of the phase with the most activations. The double backward of the gradient penalty is
+        counted as a second pass of the discriminator on the penalized samples. The workspaces of the convolutions, the
+        recomputation of the checkpointed blocks and the fragmentation of the allocator are not modelled, the dry run
+        corrects the activations by the measured peak.
+        :param general_args: argument parser that contains the arguments that are independent to the script being
+        executed.
+        :param trainer_args: argument parser that contains the arguments of the trainer.
+        :param trainer_name: either 'generator', 'autoencoder', 'gan' or 'wgan' (string).
+        """
+        self.general_args = general_args
+        self.trainer_args = trainer_args
+        self.trainer_name = trainer_name
+        self.window_length = general_args.window_length
+
+        # Models of the trainer
+        self.models = {}
+        if trainer_name == 'autoencoder':
+            self.models['autoencoder'] = ModelPlan(lambda: AutoEncoder(general_args, return_embedding=False),
+                                                   self.window_length)
+        else:
+            self.models['generator'] = ModelPlan(lambda: Generator(general_args), self.window_length)
+        if trainer_name in ['gan', 'wgan']:
+            self.models['discriminator'] = ModelPlan(lambda: Discriminator(general_args), self.window_length)
+        if trainer_name == 'gan' and trainer_args.autoencoder_path and os.path.exists(trainer_args.autoencoder_path):
+            self.models['encoder'] = ModelPlan(lambda: AutoEncoder(general_args).encoder, self.window_length,
+                                               trainable=False)
+
+        # Correction of the activations measured by the dry runs
+        self.activation_scale = 1.
+
+    def get_phases(self, accumulation_steps):
+        """
+        :param accumulation_steps: number of micro-batches per step (scalar int).
+        :return: passes of each phase of a step, as (model name, number of samples per sample of the micro-batch) tuples
+        (list of lists of tuples).
+        """
+        if self.trainer_name == 'generator':
+            return [[('generator', 1)]]
+        if self.trainer_name == 'autoencoder':
+            return [[('autoencoder', 2 if self.trainer_args.dual_stream_step else 1)]]
+
+        # With a single micro-batch the graph of the generated batch is kept by the discriminator update
+        reuse_generated = accumulation_steps == 1
+        discriminator_samples = 2
+        if self.trainer_name == 'wgan' and self.trainer_args.use_penalty:
+            discriminator_samples += 2 * self.trainer_args.penalty_fraction
+        discriminator_phase = [('discriminator', discriminator_samples)] + ([('generator', 1)] if reuse_generated
+                                                                             else [])
+        generator_phase = [('generator', 1), ('discriminator', 1)] + ([('encoder', 1)] if 'encoder' in self.models
+                                                                      else [])
+        return [discriminator_phase, generator_phase]
+
+    def estimate(self, batch_size, accumulation_steps):
+        """
+        :param batch_size: number of samples per micro-batch (scalar int).
+        :param accumulation_steps: number of micro-batches per step (scalar int).
+        :return: estimated number of bytes of each part of the peak memory and their total (dictionary).
+        """
+        trainable_bytes = sum(plan.parameter_bytes for plan in self.models.values() if plan.trainable)
+        optimizer_states = ADAM_STATES
+        if self.general_args.shard_optimizer_state:
+            optimizer_states /= get_world_size()
+        activations = max(sum(self.models[name].get_activation_bytes(samples * batch_size) for name, samples in phase)
+                          for phase in self.get_phases(accumulation_steps))
+        memory = {'parameters': sum(plan.parameter_bytes for plan in self.models.values()),
+                  'gradients': trainable_bytes,
+                  'optimizer': optimizer_states * trainable_bytes,
+                  'activations': self.activation_scale * activations,
+                  # The input and target micro-batches of a step are transferred at once
+                  'data': 2 * 4 * accumulation_steps * batch_size * self.window_length}
+        memory['total'] = sum(memory.values())
+        return memory
+
+    def get_max_batch_size(self, budget, accumulation_steps):
+        """
+        :param budget: number of bytes available for the training (scalar float).
+        :param accumulation_steps: number of micro-batches per step (scalar int).
+        :return: largest number of samples per micro-batch that fits the budget, 0 if none fits (scalar int).
+        """
+        # The estimate is affine in the batch size
+        fixed = self.estimate(0, accumulation_steps)['total']
+        per_sample = self.estimate(1, accumulation_steps)['total'] - fixed
+        if per_sample <= 0:
+            return self.general_args.max_auto_batch_size
+        return int(max(0, min(self.general_args.max_auto_batch_size, (budget - fixed) // per_sample)))
+
+    def select(self, budget, max_batch_size=None):
+        """
+        Selects the batch size and the number of accumulation steps w.r.t. the auto_batch_size mode. In 'max' mode the
+        largest micro-batch that fits the budget is used with the current number of accumulation steps. In
+        'accumulate' mode the effective batch size train_batch_size * accumulation_steps is kept and split in the
+        smallest number of micro-batches that fit the budget.
+        :param budget: number of bytes available for the training (scalar float).
+        :param max_batch_size: upper bound of the number of samples per micro-batch, e.g. agreed by the processes
+        (scalar int).
+        :return: number of samples per micro-batch and number of accumulation steps (tuple of scalar int).
+        """
+        max_batch_size = max_batch_size or self.general_args.max_auto_batch_size
+        if self.general_args.auto_batch_size == 'max':
+            accumulation_steps = self.general_args.accumulation_steps
+            batch_size = min(max_batch_size, self.get_max_batch_size(budget, accumulation_steps))
+            if batch_size < 1:
+                raise RuntimeError('A single sample does not fit the memory budget of {:.2f} GiB'.format(budget / GIB))
+            return batch_size, accumulation_steps
+
+        effective_batch_size = self.trainer_args.train_batch_size * self.general_args.accumulation_steps
+        for accumulation_steps in range(1, effective_batch_size + 1):
+            batch_size = effective_batch_size // accumulation_steps
+            if effective_batch_size % accumulation_steps or batch_size > max_batch_size:
+                continue
+            if batch_size <= self.get_max_batch_size(budget, accumulation_steps):
+                return batch_size, accumulation_steps
+        raise RuntimeError('No split of the effective batch size {} fits the memory budget of {:.2f} GiB'.format(
+            effective_batch_size, budget / GIB))
+
+    def dry_run(self, batch_size, accumulation_steps, device):
+        """
+        Measures the peak memory of the passes of a step on the device. The models are built on the device, each phase
+        runs its passes on the last micro-batch followed by a backward pass and the trained models take an Adam step,
+        which allocates the optimizer states.
+        :param batch_size: number of samples per micro-batch (scalar int).
+        :param accumulation_steps: number of micro-batches per step (scalar int).
+        :param device: CUDA device (string).
+        :return: peak number of allocated bytes (scalar int).
+        """
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+        start = torch.cuda.memory_allocated(device)
+        models, micro_batches, optimizer, loss, x = {}, [], None, None, None
+        try:
+            for name, plan in self.models.items():
+                models[name] = plan.get_model().to(device).train()
+                models[name].requires_grad_(plan.trainable)
+            micro_batches = [torch.randn(2, batch_size, 1, self.window_length, device=device)
+                             for _ in range(accumulation_steps)]
+            for phase in self.get_phases(accumulation_steps):
+                loss = 0.
+                for name, samples in phase:
+                    x = torch.randn(int(math.ceil(samples * batch_size)), 1, self.window_length, device=device,
+                                    requires_grad=True)
+                    loss = loss + models[name](x).float().mean()
+                loss.backward()
+                loss, x = None, None
+            for name, model in models.items():
+                if self.models[name].trainable:
+                    optimizer = torch.optim.Adam(model.parameters())
+                    optimizer.step()
+                    optimizer = None
+            torch.cuda.synchronize(device)
+            return torch.cuda.max_memory_allocated(device) - start
+        finally:
+            # Release the models and tensors of the dry run, also when a pass runs out of memory
+            models, micro_batches, optimizer, loss, x = None, None, None, None, None
+            torch.cuda.empty_cache()
+
+    def describe(self, batch_size, accumulation_steps, budget, measured=None):
+        """
+        :param batch_size: number of samples per micro-batch (scalar int).
+        :param accumulation_steps: number of micro-batches per step (scalar int).
+        :param budget: number of bytes available for the training (scalar float).
+        :param measured: peak number of bytes of the dry run if any (scalar int).
+        :return: description of the selection and of the estimated memory (string).
+        """
+        memory = self.estimate(batch_size, accumulation_steps)
+        message = 'Memory plan ({} trainer, budget {:.2f} GiB): \n' \
+                  '\t Batch size: {} x {} accumulation steps \n' \
+                  '\t Estimate: {:.2f} GiB ({}) \n'.format(
+            self.trainer_name, budget / GIB, batch_size, accumulation_steps, memory['total'] / GIB,
+            ', '.join('{} {:.2f}'.format(key, value / GIB) for key, value in memory.items() if key != 'total'))
+        if measured is not None:
+            message += '\t Dry run: {:.2f} GiB \n'.format(measured / GIB)
+        return message
+
+
+def get_memory_budget(general_args, device):
+    """
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param device: either 'cpu' or 'cuda' (string).
+    :return: number of bytes available for the training on each process, None if it cannot be determined (scalar
+    float).
+    """
+    if general_args.memory_budget is not None:
+        return general_args.memory_budget * GIB
+    if device == 'cuda':
+        free, _ = torch.cuda.mem_get_info()
+        return DEFAULT_BUDGET_FRACTION * free
+
+    # The processes of a host share its memory
+    try:
+        return DEFAULT_BUDGET_FRACTION * os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / \
+            get_local_world_size()
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def auto_tune_batch_size(general_args, trainer_args, trainer_name):
+    """
+    Sets trainer_args.train_batch_size and general_args.accumulation_steps to the selection of the memory planner if
+    general_args.auto_batch_size is not 'none'. On a GPU the selection is checked by dry runs and the activations of
+    the plan are corrected until the measured peak fits the budget. The processes of a distributed training agree on
+    the smallest batch size. Must be called before the data loaders are created.
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :param trainer_args: argument parser that contains the arguments of the trainer.
+    :param trainer_name: either 'generator', 'autoencoder', 'gan' or 'wgan' (string).
+    :return: None
+    """
+    if general_args.auto_batch_size == 'none':
+        return
+    device = ('cuda' if torch.cuda.is_available() else 'cpu')
+    budget = get_memory_budget(general_args, device)
+    if budget is None:
+        warnings.warn('The available memory cannot be determined, set --memory_budget to select the batch size.')
+        return
+    plan = MemoryPlan(general_args, trainer_args, trainer_name)
+    batch_size, accumulation_steps = plan.select(budget)
+
+    # Correct the activations of the plan by the measured peak
+    measured = None
+    if general_args.memory_dry_run and device == 'cuda':
+        for _ in range(MAX_DRY_RUNS):
+            memory = plan.estimate(batch_size, accumulation_steps)
+            out_of_memory = False
+            try:
+                measured = plan.dry_run(batch_size, accumulation_steps, device)
+            except RuntimeError as error:
+                if 'out of memory' not in str(error):
+                    raise
+                out_of_memory = True
+
+            # The traceback holds the tensors of the failed pass, the cache is released once the exception is gone
+            if out_of_memory:
+                torch.cuda.empty_cache()
+                measured = 2 * memory['total']
+            if measured <= budget:
+                break
+            other = memory['total'] - memory['activations']
+            plan.activation_scale *= max(1.1, (measured - other) / max(memory['activations'], 1.))
+            batch_size, accumulation_steps = plan.select(budget)
+            measured = None
+        else:
+            warnings.warn('The batch size {} x {} accumulation steps selected after {} dry runs was not checked by a '
+                          'dry run, it may not fit the budget.'.format(batch_size, accumulation_steps, MAX_DRY_RUNS))
+
+    # The processes train with the same batch size
+    max_batch_size = min_over_processes(batch_size)
+    if max_batch_size != batch_size:
+        batch_size, accumulation_steps = plan.select(budget, max_batch_size)
+    trainer_args.train_batch_size = batch_size
+    general_args.accumulation_steps = accumulation_steps
+    if is_main_process():
+        print(plan.describe(batch_size, accumulation_steps, budget, measured))
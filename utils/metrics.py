@@ -1,4 +1,4 @@
-from torchaudio.transforms import Spectrogram
+from layers.stft import METRIC_RESOLUTION, get_shared_stft_engine
 import torch
 
 
@@ -14,18 +14,28 @@ def snr(x, x_ref):
     return 10 * (num / den).log10()
 
 
-def lsd(x, x_ref):
+def lsd(x, x_ref, stft=None):
     """
     Computes the LSD metric of a batch of signals
     :param x: approximate reconstruction of the signals x_ref as a torch tensor of dimension [B, W]
     :param x_ref: reference signals as a torch tensor of dimension [B, W]
+    :param stft: STFT engine of the caller (e.g. the one of a trainer), an engine shared by all the calls on the same
+    device is used by default (STFTEngine).
     :return: lsd metric as a torch tensor
     """
-    # Get the STFT of the signals
-    spectrogram = Spectrogram(n_fft=512, hop_length=128, power=2)
-    X, X_ref = spectrogram(x), spectrogram(x_ref)
-    return (X / X_ref).log10().pow(2).mean(dim=1).pow(0.5).mean(dim=1)
-
-
+    # Get the STFT of both batches with a single pass
+    stft = stft or get_shared_stft_engine(x.device)
+    spectrograms = stft.compute(torch.cat([x, x_ref]), METRIC_RESOLUTION)
+    return lsd_from_spectrograms(spectrograms[:x.shape[0]], spectrograms[x.shape[0]:])
 
 
+def lsd_from_spectrograms(X, X_ref):
+    """
+    Computes the LSD metric from the power spectrograms of the signals at METRIC_RESOLUTION, e.g. the ones computed for
+    the frequency loss. The metric does not depend on the normalization of the spectrograms.
+    :param X: power spectrograms of the reconstructions as a torch tensor of dimension [B, ..., F, T]
+    :param X_ref: power spectrograms of the reference signals as a torch tensor of dimension [B, ..., F, T]
+    :return: lsd metric as a torch tensor of dimension [B]
+    """
+    X, X_ref = X.reshape(X.shape[0], -1, X.shape[-1]), X_ref.reshape(X_ref.shape[0], -1, X_ref.shape[-1])
+    return (X / X_ref).log10().pow(2).mean(dim=1).pow(0.5).mean(dim=1)
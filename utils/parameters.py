@@ -0,0 +1,73 @@
+import inspect
+import torch
+
+
+def has_foreach_clamp():
+    """
+    Checks if the multi-tensor clamp operations are available (torch >= 2.0).
+    :return: boolean indicating if torch._foreach_clamp_min_ and torch._foreach_clamp_max_ exist (boolean).
+    """
+    return hasattr(torch, '_foreach_clamp_min_') and hasattr(torch, '_foreach_clamp_max_')
+
+
+def clamp_parameters_(parameters, limit):
+    """
+    Clamps the values of the parameters in place to [-limit, limit], e.g. the weight clipping of the WGAN. The
+    parameters are clamped by a few multi-tensor kernels if available instead of one kernel per parameter.
+    :param parameters: parameters to clamp (list of torch tensors).
+    :param limit: maximum absolute value (scalar float).
+    :return: None
+    """
+    with torch.no_grad():
+        if has_foreach_clamp():
+            torch._foreach_clamp_min_(parameters, -limit)
+            torch._foreach_clamp_max_(parameters, limit)
+        else:
+            for p in parameters:
+                p.clamp_(min=-limit, max=limit)
+
+
+class ParameterGroup(object):
+    def __init__(self, module):
+        """
+        Initializes the class ParameterGroup that caches the parameters of a module, so that the module tree is not
+        traversed at each step, and toggles their requires_grad flag only when it changes.
+        :param module: module whose parameters are grouped (nn.Module).
+        """
+        self.parameters = list(module.parameters())
+        self.requires_grad = all(p.requires_grad for p in self.parameters)
+
+    def set_requires_grad(self, requires_grad):
+        """
+        :param requires_grad: flag indicating if the parameters require gradient tracking (boolean).
+        :return: None
+        """
+        if requires_grad == self.requires_grad:
+            return
+        for p in self.parameters:
+            p.requires_grad_(requires_grad)
+        self.requires_grad = requires_grad
+
+    def clamp_(self, limit):
+        """
+        :param limit: maximum absolute value of the parameters (scalar float).
+        :return: None
+        """
+        clamp_parameters_(self.parameters, limit)
+
+
+def get_adam_implementation_kwargs(parameters, implementation):
+    """
+    Returns the keyword arguments selecting the implementation of torch.optim.Adam. The 'foreach' implementation
+    updates all the parameters with a few multi-tensor kernels, the 'fused' one with a single kernel but it requires
+    the parameters to be on the GPU. An implementation that is not supported falls back to the next simpler one.
+    :param parameters: parameters to optimize (list of torch tensors).
+    :param implementation: either 'default', 'foreach' or 'fused' (string).
+    :return: keyword arguments of torch.optim.Adam (dictionary).
+    """
+    supported = inspect.signature(torch.optim.Adam).parameters
+    if implementation == 'fused' and 'fused' in supported and all(p.is_cuda for p in parameters):
+        return {'fused': True}
+    if implementation in ['fused', 'foreach'] and 'foreach' in supported:
+        return {'foreach': True}
+    return {}
@@ -0,0 +1,292 @@
+from blocks.base_block import BaseBlock
+from torch import nn
+import warnings
+import torch
+import time
+import os
+
+
+def get_profile_paths(savepath):
+    """
+    :param savepath: location of the checkpoints of a trainer (string).
+    :return: locations of the hot-path report and of the Chrome trace (tuple of strings).
+    """
+    root = os.path.splitext(savepath)[0]
+    return root + '_profile.txt', root + '_trace.json'
+
+
+def get_conv_flops(conv_layer, batch_size, width):
+    """
+    Estimates the number of floating point operations of a 1D convolution whose output has the same width as its
+    input, counting a multiply-add as two operations.
+    :param conv_layer: convolution layer (nn.Conv1d).
+    :param batch_size: number of samples (scalar int).
+    :param width: width of the output feature map (scalar int).
+    :return: number of operations (scalar int).
+    """
+    in_channels = conv_layer.in_channels // conv_layer.groups
+    return 2 * batch_size * width * conv_layer.out_channels * in_channels * conv_layer.kernel_size[0]
+
+
+def get_block_branches(block):
+    """
+    :param block: multi-scale block (BaseBlock).
+    :return: convolution layers of each scale, the bottleneck convolution followed by the multi-scale one if the
+    bottleneck is used (list of lists of nn.Conv1d).
+    """
+    if block.use_bottleneck:
+        return [[conv_layer_1, conv_layer_2] for conv_layer_1, conv_layer_2 in zip(block.conv_layers_1,
+                                                                                    block.conv_layers_2)]
+    return [[conv_layer] for conv_layer in block.conv_layers]
+
+
+def get_tensor_bytes(output):
+    """
+    :param output: output of a module, a tensor or a (nested) tuple of tensors.
+    :return: number of bytes of the tensors (scalar int).
+    """
+    if torch.is_tensor(output):
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)):
+        return sum(get_tensor_bytes(item) for item in output)
+    return 0
+
+
+class ModuleRecord(object):
+    def __init__(self, name, kind):
+        """
+        Initializes the class ModuleRecord that accumulates the measurements of a profiled module.
+        :param name: qualified name of the module, prefixed by the name of its model (string).
+        :param kind: either 'block' or 'branch' (string).
+        """
+        self.name = name
+        self.kind = kind
+        self.calls = 0
+        self.forward_time = 0.
+        self.backward_time = 0.
+        self.flops = 0
+        self.activation_bytes = 0
+        self.peak_bytes = 0
+
+    @property
+    def total_time(self):
+        return self.forward_time + self.backward_time
+
+
+class BlockProfiler(object):
+    def __init__(self, models, device, profile_backward=True):
+        """
+        Initializes the class BlockProfiler that registers hooks on every multi-scale block (DownBlock, UpBlock,
+        DiscriminatorBlock, DiscriminatorInput) of the models and on the convolutions of each of their scales. The
+        hooks measure the wall time of the forward and backward passes, the output size and the peak of the CUDA
+        allocator of each module, the number of operations is estimated from the shapes. The device is synchronized
+        around each module, which slows the training down, hence the profiler is only attached for a few steps. The
+        branches are only called with the 'direct' convolution implementation, the other implementations use the
+        weights of the branches without calling them.
+        :param models: models to profile, keyed by name (dictionary of nn.Module).
+        :param device: device on which the models run (string).
+        :param profile_backward: boolean indicating if the backward passes are timed, requires torch >= 2.0 (boolean).
+        """
+        self.device = device
+        self.use_cuda = str(device).startswith('cuda')
+        self.records = {}
+        self.handles = []
+
+        # Stack of the modules whose forward pass is running, to propagate the allocator peaks to the parents
+        self.stack = []
+
+        profile_backward = profile_backward and hasattr(nn.Module, 'register_full_backward_pre_hook')
+        for model_name, model in models.items():
+            for module_name, module in model.named_modules():
+                if not isinstance(module, BaseBlock):
+                    continue
+                modules = [('{}.{}'.format(model_name, module_name), 'block', module)]
+                for scale, branch in enumerate(get_block_branches(module)):
+                    modules += [('{}.{}.scale_{}.{}'.format(model_name, module_name, scale, index), 'branch',
+                                 conv_layer) for index, conv_layer in enumerate(branch)]
+                for name, kind, hooked_module in modules:
+                    self.records[name] = ModuleRecord(name, kind)
+                    self.register_hooks(name, hooked_module, profile_backward)
+
+        # Start times of the backward passes, a module may be called several times per step
+        self.backward_starts = {name: [] for name in self.records}
+
+    def synchronize(self):
+        if self.use_cuda:
+            torch.cuda.synchronize()
+
+    def register_hooks(self, name, module, profile_backward):
+        """
+        :param name: name of the record of the module (string).
+        :param module: profiled module (nn.Module).
+        :param profile_backward: boolean indicating if the backward pass is timed (boolean).
+        :return: None
+        """
+        self.handles.append(module.register_forward_pre_hook(lambda m, inputs: self.forward_pre_hook(name, m, inputs)))
+        self.handles.append(module.register_forward_hook(lambda m, inputs, output: self.forward_hook(name, m, inputs,
+                                                                                                     output)))
+        if profile_backward:
+            self.handles.append(module.register_full_backward_pre_hook(
+                lambda m, grad_output: self.backward_pre_hook(name)))
+            self.handles.append(module.register_full_backward_hook(
+                lambda m, grad_input, grad_output: self.backward_hook(name)))
+
+    def forward_pre_hook(self, name, module, inputs):
+        self.synchronize()
+        entry = {'name': name, 'peak': 0, 'allocated': 0,
+                 'range': torch.autograd.profiler.record_function(name)}
+        if self.use_cuda:
+            # The peak reached so far belongs to the parent, the allocator only tracks a single peak
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], torch.cuda.max_memory_allocated())
+            torch.cuda.reset_peak_memory_stats()
+            entry['allocated'] = torch.cuda.memory_allocated()
+        entry['range'].__enter__()
+        entry['start'] = time.perf_counter()
+        self.stack.append(entry)
+
+    def forward_hook(self, name, module, inputs, output):
+        self.synchronize()
+        entry = self.stack.pop()
+        record = self.records[name]
+        record.calls += 1
+        record.forward_time += time.perf_counter() - entry['start']
+        entry['range'].__exit__(None, None, None)
+        record.activation_bytes += get_tensor_bytes(output)
+
+        # Number of operations of the convolutions, whose outputs have the width of the input
+        x = inputs[0]
+        if record.kind == 'branch':
+            record.flops += get_conv_flops(module, x.shape[0], x.shape[-1])
+        else:
+            record.flops += sum(get_conv_flops(conv_layer, x.shape[0], x.shape[-1])
+                                for branch in get_block_branches(module) for conv_layer in branch)
+
+        if self.use_cuda:
+            peak = max(entry['peak'], torch.cuda.max_memory_allocated())
+            record.peak_bytes = max(record.peak_bytes, peak - entry['allocated'])
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+
+    def backward_pre_hook(self, name):
+        self.synchronize()
+        self.backward_starts[name].append(time.perf_counter())
+
+    def backward_hook(self, name):
+        self.synchronize()
+        if self.backward_starts[name]:
+            self.records[name].backward_time += time.perf_counter() - self.backward_starts[name].pop()
+
+    def remove(self):
+        """
+        Removes the hooks from the models.
+        :return: None
+        """
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def get_report(self, n_steps):
+        """
+        Builds the hot-path table: one row per profiled module sorted by total time, the branches are listed after
+        their block. The times, operations and sizes are averaged over the profiled steps.
+        :param n_steps: number of profiled steps (scalar int).
+        :return: table (string).
+        """
+        blocks = sorted([record for record in self.records.values() if record.kind == 'block' and record.calls],
+                        key=lambda record: record.total_time, reverse=True)
+        total_time = sum(record.total_time for record in blocks) or 1.
+        lines = ['{:<52} {:>6} {:>10} {:>10} {:>7} {:>9} {:>9} {:>10} {:>10}'.format(
+            'module', 'calls', 'fwd [ms]', 'bwd [ms]', 'share', 'GFLOP', 'GFLOP/s', 'act [MB]', 'peak [MB]')]
+        for block in blocks:
+            branches = sorted([record for name, record in self.records.items() if record.kind == 'branch' and
+                               record.calls and name.startswith(block.name + '.')],
+                              key=lambda record: record.total_time, reverse=True)
+            for record in [block] + branches:
+                name = record.name if record.kind == 'block' else '  ' + record.name[len(block.name) + 1:]
+                lines.append('{:<52} {:>6} {:>10.3f} {:>10.3f} {:>6.1f}% {:>9.3f} {:>9.1f} {:>10.2f} {:>10.2f}'.format(
+                    name, record.calls // n_steps, 1e3 * record.forward_time / n_steps,
+                    1e3 * record.backward_time / n_steps, 100 * record.total_time / total_time,
+                    record.flops / n_steps / 1e9, record.flops / max(record.forward_time, 1e-12) / 1e9,
+                    record.activation_bytes / n_steps / 2 ** 20, record.peak_bytes / 2 ** 20))
+        return '\n'.join(lines)
+
+
+class TrainingProfiler(object):
+    def __init__(self, models, device, savepath, n_steps, n_warmup_steps=2):
+        """
+        Initializes the class TrainingProfiler that profiles a few training steps. After n_warmup_steps steps, the
+        block hooks and torch.profiler are attached for n_steps steps, then the hot-path table is printed and written
+        next to the checkpoints together with a Chrome trace (chrome://tracing or https://ui.perfetto.dev) in which the
+        blocks appear as named ranges.
+        :param models: models to profile, keyed by name (dictionary of nn.Module).
+        :param device: device on which the models run (string).
+        :param savepath: location of the checkpoints of the trainer (string).
+        :param n_steps: number of profiled steps (scalar int).
+        :param n_warmup_steps: number of steps before the profiling starts, e.g. for the autotuning of cuDNN (scalar
+        int).
+        """
+        self.models = models
+        self.device = device
+        self.report_path, self.trace_path = get_profile_paths(savepath)
+        self.n_steps = n_steps
+        self.n_warmup_steps = n_warmup_steps
+        self.step_count = 0
+        self.block_profiler = None
+        self.torch_profiler = None
+        self.done = False
+
+    def start(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if str(self.device).startswith('cuda'):
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.block_profiler = BlockProfiler(self.models, self.device)
+        self.torch_profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self.torch_profiler.__enter__()
+
+    def stop(self):
+        self.block_profiler.synchronize()
+        self.torch_profiler.__exit__(None, None, None)
+        self.block_profiler.remove()
+        self.done = True
+
+        # Write the reports
+        report = self.block_profiler.get_report(self.n_steps)
+        print('Hot path over {} steps:\n{}'.format(self.n_steps, report))
+        directory = os.path.dirname(self.report_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.report_path, 'w') as f:
+            f.write(report + '\n')
+        self.torch_profiler.export_chrome_trace(self.trace_path)
+        print('Profiling report written to {} and trace to {}'.format(self.report_path, self.trace_path))
+
+    def step(self):
+        """
+        Marks the beginning of a training step, starts and stops the profiling when needed.
+        :return: None
+        """
+        if self.done:
+            return
+        if self.step_count == self.n_warmup_steps:
+            self.start()
+        elif self.step_count == self.n_warmup_steps + self.n_steps:
+            self.stop()
+        self.step_count += 1
+
+
+def get_training_profiler(models, device, savepath, general_args):
+    """
+    :param models: models to profile, keyed by name (dictionary of nn.Module).
+    :param device: device on which the models run (string).
+    :param savepath: location of the checkpoints of the trainer (string).
+    :param general_args: argument parser that contains the arguments that are independent to the script being
+    executed.
+    :return: profiler of the training steps, None if the profiling is disabled (TrainingProfiler).
+    """
+    if not general_args.profile_blocks:
+        return None
+    if general_args.compile_mode == 'compile':
+        warnings.warn('The hooks of the profiler break the graphs of torch.compile, the measured times are not the ones '
+                      'of the compiled models.')
+    return TrainingProfiler(models, device, savepath, general_args.profile_steps, general_args.profile_warmup_steps)
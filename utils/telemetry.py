@@ -0,0 +1,223 @@
+from utils.distributed import get_world_size, is_main_process
+import numpy as np
+import torch
+import time
+import json
+import os
+
+# Phases of a training step, in the order in which they are displayed
+PHASES = ['data_wait', 'h2d', 'generator_forward', 'discriminator_forward', 'gradient_penalty', 'backward',
+          'optimizer', 'other']
+
+# Quantiles of the step and phase times
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+def get_telemetry_paths(savepath):
+    """
+    :param savepath: location of the checkpoints of a trainer (string).
+    :return: locations of the JSONL file of the records and of the Prometheus text file (tuple of strings).
+    """
+    root = os.path.splitext(savepath)[0]
+    return root + '_telemetry.jsonl', root + '_telemetry.prom'
+
+
+def summarize(values):
+    """
+    :param values: durations in seconds (list of floats).
+    :return: mean, quantiles and sum of the durations (dictionary).
+    """
+    summary = {'mean': float(np.mean(values)), 'sum': float(np.sum(values))}
+    for quantile, value in zip(QUANTILES, np.quantile(values, QUANTILES)):
+        summary['p{}'.format(int(round(100 * quantile)))] = float(value)
+    return summary
+
+
+class StepTelemetry(object):
+    def __init__(self, trainer_name, device, savepath=None, sample_rate=16000, enabled=False, synchronize=True,
+                 prometheus_path=None):
+        """
+        Initializes the class StepTelemetry that splits each training step into phases (see PHASES). The phases are
+        delimited by calls to mark(), which attribute the time elapsed since the previous call to a phase. The time of
+        a step that is not attributed to a phase is counted as 'other'. At each flush, the steps since the previous
+        flush are summarized with quantiles, together with the number of samples per second and the real-time factor
+        (seconds of audio trained per second). The summary is appended to a JSONL file and the Prometheus text file is
+        replaced, e.g. for the textfile collector of the node exporter. Only the main process exports.
+        :param trainer_name: name of the trainer used as a label of the metrics (string).
+        :param device: device on which the models run (string).
+        :param savepath: location of the checkpoints of the trainer, required if enabled (string).
+        :param sample_rate: sampling frequency of the signals in Hz (scalar int).
+        :param enabled: boolean indicating if the steps are measured, mark() does nothing otherwise (boolean).
+        :param synchronize: boolean indicating if the device is synchronized at each mark so that the GPU time is
+        attributed to the right phase (boolean).
+        :param prometheus_path: location of the Prometheus text file, next to the checkpoints by default (string).
+        """
+        self.enabled = enabled
+        self.trainer_name = trainer_name
+        self.synchronize = synchronize and str(device).startswith('cuda')
+        self.sample_rate = sample_rate
+        self.jsonl_path, self.prometheus_path = None, None
+        if enabled:
+            self.jsonl_path, default_prometheus_path = get_telemetry_paths(savepath)
+            self.prometheus_path = prometheus_path or default_prometheus_path
+
+        # Current step
+        self.step_start = None
+        self.last_mark = None
+        self.phases = None
+        self.samples = 0
+        self.audio_seconds = 0.
+
+        # Steps since the last flush and totals since the start
+        self.steps = []
+        self.total_steps = 0
+        self.total_samples = 0
+        self.total_audio_seconds = 0.
+
+    def get_time(self):
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def begin_step(self):
+        """
+        Starts a step, the step time includes the waiting time for the data.
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self.step_start = self.last_mark = self.get_time()
+        self.phases = {}
+        self.samples = 0
+        self.audio_seconds = 0.
+
+    def mark(self, phase):
+        """
+        Attributes the time elapsed since the previous mark (or the beginning of the step) to a phase.
+        :param phase: name of the phase, see PHASES (string).
+        :return: None
+        """
+        if not self.enabled or self.step_start is None:
+            return
+        now = self.get_time()
+        self.phases[phase] = self.phases.get(phase, 0.) + now - self.last_mark
+        self.last_mark = now
+
+    def add_samples(self, n_samples, window_length):
+        """
+        :param n_samples: number of samples of a micro-batch of the step (scalar int).
+        :param window_length: number of audio samples per sample (scalar int).
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self.samples += n_samples
+        self.audio_seconds += n_samples * window_length / self.sample_rate
+
+    def end_step(self):
+        """
+        Ends the step, the time since the last mark is counted as 'other'.
+        :return: None
+        """
+        if not self.enabled or self.step_start is None:
+            return
+        self.mark('other')
+        self.steps.append({'total': self.last_mark - self.step_start, 'phases': self.phases, 'samples': self.samples,
+                           'audio_seconds': self.audio_seconds})
+        self.step_start = None
+
+    def get_record(self, epoch):
+        """
+        :param epoch: current epoch of the trainer (scalar int).
+        :return: summary of the steps since the last flush (dictionary).
+        """
+        duration = sum(step['total'] for step in self.steps)
+        samples = sum(step['samples'] for step in self.steps)
+        audio_seconds = sum(step['audio_seconds'] for step in self.steps)
+        phases = {}
+        for phase in PHASES:
+            values = [step['phases'].get(phase, 0.) for step in self.steps]
+            phases[phase] = dict(summarize(values), share=float(np.sum(values) / max(duration, 1e-12)))
+        return {'time': time.time(),
+                'trainer': self.trainer_name,
+                'epoch': epoch,
+                'steps': len(self.steps),
+                'world_size': get_world_size(),
+                'samples_per_second': samples / max(duration, 1e-12),
+                'real_time_factor': audio_seconds / max(duration, 1e-12),
+                'step_time': summarize([step['total'] for step in self.steps]),
+                'phases': phases}
+
+    def get_prometheus_text(self, record):
+        """
+        :param record: summary of the last steps (dictionary).
+        :return: metrics in the Prometheus text format (string).
+        """
+        labels = 'trainer="{}"'.format(self.trainer_name)
+        lines = ['# HELP audio_sr_samples_per_second Training samples per second of the process over the last '
+                 'pseudo-epoch.',
+                 '# TYPE audio_sr_samples_per_second gauge',
+                 'audio_sr_samples_per_second{{{}}} {}'.format(labels, record['samples_per_second']),
+                 '# HELP audio_sr_real_time_factor Seconds of audio trained per second over the last pseudo-epoch.',
+                 '# TYPE audio_sr_real_time_factor gauge',
+                 'audio_sr_real_time_factor{{{}}} {}'.format(labels, record['real_time_factor']),
+                 '# HELP audio_sr_epoch Current epoch of the trainer.',
+                 '# TYPE audio_sr_epoch gauge',
+                 'audio_sr_epoch{{{}}} {}'.format(labels, record['epoch']),
+                 '# HELP audio_sr_steps_total Training steps since the start of the process.',
+                 '# TYPE audio_sr_steps_total counter',
+                 'audio_sr_steps_total{{{}}} {}'.format(labels, self.total_steps),
+                 '# HELP audio_sr_samples_total Training samples since the start of the process.',
+                 '# TYPE audio_sr_samples_total counter',
+                 'audio_sr_samples_total{{{}}} {}'.format(labels, self.total_samples),
+                 '# HELP audio_sr_audio_seconds_total Seconds of audio trained since the start of the process.',
+                 '# TYPE audio_sr_audio_seconds_total counter',
+                 'audio_sr_audio_seconds_total{{{}}} {}'.format(labels, self.total_audio_seconds)]
+
+        # Summaries of the step and phase times over the last pseudo-epoch
+        summaries = [('audio_sr_step_seconds', 'Duration of the training steps.', [(labels, record['step_time'])]),
+                     ('audio_sr_step_phase_seconds', 'Duration of the phases of the training steps.',
+                      [('{},phase="{}"'.format(labels, phase), summary) for phase, summary in
+                       record['phases'].items()])]
+        for name, description, series in summaries:
+            lines += ['# HELP {} {}'.format(name, description), '# TYPE {} summary'.format(name)]
+            for series_labels, summary in series:
+                for quantile in QUANTILES:
+                    lines.append('{}{{{},quantile="{}"}} {}'.format(name, series_labels, quantile,
+                                                                    summary['p{}'.format(int(round(100 * quantile)))]))
+                lines.append('{}_sum{{{}}} {}'.format(name, series_labels, summary['sum']))
+                lines.append('{}_count{{{}}} {}'.format(name, series_labels, record['steps']))
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, epoch):
+        """
+        Summarizes the steps since the last flush and exports the summary.
+        :param epoch: current epoch of the trainer (scalar int).
+        :return: summary of the steps, None if no step was measured (dictionary).
+        """
+        if not self.enabled or not self.steps:
+            return None
+        self.total_steps += len(self.steps)
+        self.total_samples += sum(step['samples'] for step in self.steps)
+        self.total_audio_seconds += sum(step['audio_seconds'] for step in self.steps)
+        record = self.get_record(epoch)
+        self.steps = []
+        if not is_main_process():
+            return record
+
+        # Append the record and replace the Prometheus file atomically, a scraper never reads a partial file
+        for path in [self.jsonl_path, self.prometheus_path]:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(self.jsonl_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        temporary_path = self.prometheus_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            f.write(self.get_prometheus_text(record))
+        os.replace(temporary_path, self.prometheus_path)
+
+        print('Telemetry, epoch {}: {:.1f} samples/s, real-time factor {:.1f}, step time {:.4f} s ({})'.format(
+            epoch, record['samples_per_second'], record['real_time_factor'], record['step_time']['mean'],
+            ', '.join('{} {:.0%}'.format(phase, summary['share']) for phase, summary in record['phases'].items()
+                      if summary['share'] > 0)))
+        return record
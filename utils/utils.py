@@ -1,5 +1,7 @@
 from datasets.datasets import DatasetBeethoven, DatasetMaestroHDF, DatasetMaestroNPY
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
+from utils.distributed import is_distributed
+from utils.compilation import compile_model, get_checkpoint_signature
 from models.generator import Generator
 import matplotlib.pyplot as plt
 import torch
@@ -45,9 +47,24 @@ def get_the_maestro_data_loaders_npy(datapath, loaders_parameters):
     return tuple(data_loaders)
 
 
+def shard_train_loader(train_loader, shuffle):
+    """
+    Restricts the train loader to the shard of the current process if the training is distributed.
+    :param train_loader: train data loader over the complete train set (torch DataLoader).
+    :param shuffle: boolean indicating if the samples are shuffled (boolean).
+    :return: train data loader over the shard of the process (torch DataLoader).
+    """
+    if not is_distributed():
+        return train_loader
+    dataset = train_loader.dataset
+    return DataLoader(dataset, batch_size=train_loader.batch_size, num_workers=train_loader.num_workers,
+                      sampler=DistributedSampler(dataset, shuffle=shuffle))
+
+
 def prepare_maestro_data(trainer_args):
     """
-    Prepares the dataset and data loaders for all phases (train, test and validation).
+    Prepares the dataset and data loaders for all phases (train, test and validation). If the training is distributed,
+    each process gets its own shard of the train set.
     :param trainer_args: argument parser that contains all the needed parameters.
     :return: one data loader for each phase (torch DataLoader).
     """
@@ -66,7 +83,7 @@ def prepare_maestro_data(trainer_args):
         datapath = {'train': trainer_args.train_npy_filepath,
                     'test': trainer_args.test_npy_filepath,
                     'valid': trainer_args.valid_npy_filepath}
-        return get_the_maestro_data_loaders_npy(datapath, loaders_parameters)
+        train_loader, test_loader, valid_loader = get_the_maestro_data_loaders_npy(datapath, loaders_parameters)
     else:
         datapath = trainer_args.hdf5_filepath
         datasets_parameters = {'train': {'batch_size': trainer_args.train_batch_size,
@@ -75,7 +92,9 @@ def prepare_maestro_data(trainer_args):
                                         'use_cache': not trainer_args.test_shuffle},
                                'valid': {'batch_size': trainer_args.valid_batch_size,
                                          'use_cache': not trainer_args.valid_shuffle}}
-        return get_the_maestro_data_loaders_hdf(datapath, datasets_parameters, loaders_parameters)
+        train_loader, test_loader, valid_loader = get_the_maestro_data_loaders_hdf(datapath, datasets_parameters,
+                                                                                  loaders_parameters)
+    return shard_train_loader(train_loader, trainer_args.train_shuffle), test_loader, valid_loader
 
 
 def get_consecutive_samples(dataset, index):
@@ -94,7 +113,8 @@ def get_consecutive_samples(dataset, index):
 def plot_losses(losses, names, is_training, savepath=None):
     """
     Display the different losses accumulated throughout train and test phases
-    :param losses: dictionary containing the different losses
+    :param losses: dictionary containing the different losses, either the losses of a trainer or the ones returned by
+    utils.loss_log.load_losses
     :param names: keys of the dictionary to select the desired losses
     :param is_training: boolean indicating the desired phase (train/test) needed for proper labels
     :param savepath: string path indicating where to save the plot
@@ -117,12 +137,14 @@ def plot_losses(losses, names, is_training, savepath=None):
     plt.show()
 
 
-def get_generator(loadpath, device, general_args):
+def get_generator(loadpath, device, general_args, batch_size=1):
     """
-    Returns a pre-trained generator in evaluation mode.
+    Returns a pre-trained generator in evaluation mode. The generator runs in the graph mode selected by
+    general_args.compile_mode.
     :param loadpath: location of the generator trainer (string).
     :param device: either 'cpu' or 'cuda' depending on hardware availability (string).
     :param general_args: argument parser that contains the arguments that are independent to the script being executed.
+    :param batch_size: number of samples of the inference batches, the "script" mode is specialized to it (scalar int).
     :return: pre-trained generator (nn.Module).
     """
     # Instantiate a new generator with identical architecture
@@ -131,7 +153,12 @@ def get_generator(loadpath, device, general_args):
     # Restore pre-trained weights
     checkpoint = torch.load(loadpath, map_location=device)
     generator.load_state_dict(checkpoint['generator_state_dict'])
-    return generator.eval()
+    generator.eval()
+
+    # Compile the generator for inference
+    example_input = torch.zeros(batch_size, 1, general_args.window_length, device=device)
+    return compile_model(generator, general_args, example_input=example_input,
+                         cache_key=get_checkpoint_signature(loadpath), for_inference=True)
 
 
 def prepare_transformations(args):
@@ -0,0 +1,105 @@
+import torch
+
+
+def inference_mode():
+    """
+    :return: context disabling the autograd tracking, inference_mode if available (torch >= 1.9) otherwise no_grad.
+    """
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+class ValidationSet(object):
+    def __init__(self, valid_loader, n_batches, device, on_device=True, batch_size=0):
+        """
+        Initializes the class ValidationSet that holds a fixed subset of the validation set. The subset is loaded once
+        in two contiguous tensors, the validation loss is therefore measured on the same data at every epoch and
+        without the overhead of the data loader. The outputs of the model are cached until the next epoch.
+        :param valid_loader: data loader of the validation set (torch DataLoader).
+        :param n_batches: number of batches of the data loader stored in the subset (scalar int).
+        :param device: device on which the model runs (string).
+        :param on_device: boolean indicating if the subset is stored on the device instead of the (pinned) host memory
+        (boolean).
+        :param batch_size: number of samples per forward pass, 0 to use the batch size of the data loader (scalar int).
+        """
+        inputs, targets = [], []
+        valid_loader_iter = iter(valid_loader)
+        for _ in range(n_batches):
+            try:
+                data_batch = next(valid_loader_iter)
+            except StopIteration:
+                break
+            inputs.append(data_batch[0])
+            targets.append(data_batch[1])
+        self.device = device
+        self.batch_size = batch_size or valid_loader.batch_size
+
+        # Store the subset in contiguous tensors
+        storage_device = device if on_device else 'cpu'
+        self.inputs = torch.cat(inputs).to(storage_device).contiguous()
+        self.targets = torch.cat(targets).to(storage_device).contiguous()
+        if storage_device == 'cpu' and device != 'cpu':
+            self.inputs, self.targets = self.inputs.pin_memory(), self.targets.pin_memory()
+
+        # Outputs of the model for a given (model, epoch) pair
+        self.generated_batches = None
+        self.generated_key = None
+
+    def __len__(self):
+        return self.inputs.shape[0]
+
+    def get_batches(self):
+        """
+        Iterates over the subset in batches of batch_size samples.
+        :return: generator of (input_batch, target_batch) tuples on the device (torch tensors).
+        """
+        for start in range(0, len(self), self.batch_size):
+            yield (self.inputs[start:start + self.batch_size].to(self.device, non_blocking=True),
+                   self.targets[start:start + self.batch_size].to(self.device, non_blocking=True))
+
+    def generate(self, model, epoch, is_autoencoder=False):
+        """
+        Returns the outputs of the model on the subset, computed once per epoch. The auto-encoder reconstructs the
+        concatenation of the input and target batches.
+        :param model: generator or auto-encoder (nn.Module).
+        :param epoch: current epoch of the trainer (scalar int).
+        :param is_autoencoder: boolean indicating if the model is the auto-encoder (boolean).
+        :return: one output per batch of get_batches (list of torch tensors).
+        """
+        key = (id(model), epoch)
+        if self.generated_key != key:
+            model.eval()
+            self.generated_batches = []
+            with inference_mode():
+                for input_batch, target_batch in self.get_batches():
+                    if is_autoencoder:
+                        self.generated_batches.append(model(torch.cat([input_batch, target_batch]))[0])
+                    else:
+                        self.generated_batches.append(model(input_batch))
+            self.generated_key = key
+        return self.generated_batches
+
+    def get_first_batch(self, model, epoch, batch_size, is_autoencoder=False):
+        """
+        Returns the first samples of the subset and the cached outputs of the model, e.g. for the plots. The samples
+        may span several forward passes if batch_size is larger than the batch size of the subset. With the
+        auto-encoder, the generated batch holds the reconstructions of the inputs followed by the ones of the targets.
+        :param model: generator or auto-encoder (nn.Module).
+        :param epoch: current epoch of the trainer (scalar int).
+        :param batch_size: number of samples (scalar int).
+        :param is_autoencoder: boolean indicating if the model is the auto-encoder (boolean).
+        :return: input, target and generated batches (torch tensors).
+        """
+        generated_batches = self.generate(model, epoch, is_autoencoder)
+        n_batches = -(-batch_size // self.batch_size)
+        if is_autoencoder:
+            # Each output holds the reconstructions of the inputs of its forward pass followed by the ones of the targets
+            halves = [generated_batch.split(generated_batch.shape[0] // 2) for generated_batch in
+                      generated_batches[:n_batches]]
+            generated_batch = torch.cat([torch.cat([half[0] for half in halves])[:batch_size],
+                                         torch.cat([half[1] for half in halves])[:batch_size]])
+        else:
+            generated_batch = torch.cat(generated_batches[:n_batches])[:batch_size]
+        return (self.inputs[:batch_size].to(self.device, non_blocking=True),
+                self.targets[:batch_size].to(self.device, non_blocking=True), generated_batch)